@@ -1 +1,31 @@
-app = None
\ No newline at end of file
+import logging
+import time
+
+app         = None      # Tk UI, None when running headless
+scheduler   = None      # Scheduler which runs all core timers
+
+startTime   = time.perf_counter()    # Startup timings are measured from here, the first pyTracker module import
+startupTimes = {}                   # Startup milestone name -> msecs since startTime
+
+_stateListeners     = []
+_shutdownListeners  = []
+
+def addStateListener(listener):
+    _stateListeners.append(listener)
+
+def notifyStateChanged(delta, key = None):
+    for listener in _stateListeners:
+        listener(delta, key)
+
+def addShutdownListener(listener):
+    _shutdownListeners.append(listener)
+
+def requestShutdown():
+    for listener in _shutdownListeners:
+        listener()
+
+def startupMilestone(name):
+    # Only the first time each milestone is reached counts
+    if name not in startupTimes:
+        startupTimes[name] = (time.perf_counter() - startTime) * 1000
+        logging.info("Startup %s %.0f msecs", name, startupTimes[name])
@@ -0,0 +1,123 @@
+import math
+import threading
+
+def headingFromQuaternion(x, y, z, w):
+    # Yaw in radians, rotation about the down axis from north (position_x) towards east (position_y)
+    return math.atan2(2.0 * (w * z + x * y), 1.0 - 2.0 * (y * y + z * z))
+
+class Bearing:
+    def __init__(self, tagId, bearingDegrees, confidence, pulseCount, positionX, positionY):
+        self.tagId          = tagId
+        self.bearingDegrees = bearingDegrees    # 0-360, clockwise from north
+        self.confidence     = confidence        # 0-1
+        self.pulseCount     = pulseCount
+        self.positionX      = positionX         # Mean vehicle position during the rotation
+        self.positionY      = positionY
+
+# Running sums for a least squares fit of snr = a + b*cos(heading) + c*sin(heading) over a rotation. Adding a pulse is
+# O(1) and an estimate can be taken at any point during the rotation without revisiting the pulses.
+class _RotationSums:
+    __slots__ = ("n", "sumCos", "sumSin", "sumCosCos", "sumSinSin", "sumCosSin", "sumSNR", "sumSNRCos", "sumSNRSin", "sumSNRSNR", "sumX", "sumY")
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, 0.0)
+        self.n = 0
+
+    def add(self, heading, snr, positionX, positionY):
+        cosHeading = math.cos(heading)
+        sinHeading = math.sin(heading)
+        self.n          += 1
+        self.sumCos     += cosHeading
+        self.sumSin     += sinHeading
+        self.sumCosCos  += cosHeading * cosHeading
+        self.sumSinSin  += sinHeading * sinHeading
+        self.sumCosSin  += cosHeading * sinHeading
+        self.sumSNR     += snr
+        self.sumSNRCos  += snr * cosHeading
+        self.sumSNRSin  += snr * sinHeading
+        self.sumSNRSNR  += snr * snr
+        self.sumX       += positionX
+        self.sumY       += positionY
+
+    def solve(self):
+        # Returns [ a, b, c, r squared, heading coverage ] or None if the fit is degenerate
+        n = self.n
+        m = [   [ n,            self.sumCos,    self.sumSin ],
+                [ self.sumCos,  self.sumCosCos, self.sumCosSin ],
+                [ self.sumSin,  self.sumCosSin, self.sumSinSin ] ]
+        v = [ self.sumSNR, self.sumSNRCos, self.sumSNRSin ]
+        determinant = _determinant3(m)
+        if n < 3 or abs(determinant) < 1e-9 * n ** 3:
+            return None
+        coefficients = []
+        for column in range(3):
+            replaced = [ row[:] for row in m ]
+            for row in range(3):
+                replaced[row][column] = v[row]
+            coefficients.append(_determinant3(replaced) / determinant)
+        a, b, c = coefficients
+        totalSS     = self.sumSNRSNR - self.sumSNR * self.sumSNR / n
+        residualSS  = self.sumSNRSNR - (a * v[0] + b * v[1] + c * v[2])
+        rSquared    = max(0.0, 1.0 - residualSS / totalSS) if totalSS > 0 else 0.0
+        # 1 when headings are spread evenly round the circle, 0 when they all point the same way
+        coverage    = 1.0 - math.hypot(self.sumCos, self.sumSin) / n
+        return [ a, b, c, rSquared, coverage ]
+
+def _determinant3(m):
+    return (m[0][0] * (m[1][1] * m[2][2] - m[1][2] * m[2][1])
+          - m[0][1] * (m[1][0] * m[2][2] - m[1][2] * m[2][0])
+          + m[0][2] * (m[1][0] * m[2][1] - m[1][1] * m[2][0]))
+
+# Estimates a bearing to each tag from the SNR of its pulses against vehicle heading while the vehicle rotates on
+# station. The strongest SNR points towards the tag.
+class BearingEstimator:
+    def __init__(self):
+        self._lock      = threading.Lock()
+        self._sums      = {}
+        self.rotating   = False
+
+    def startRotation(self):
+        with self._lock:
+            self._sums      = {}
+            self.rotating   = True
+
+    def stopRotation(self):
+        estimates = self.estimates()
+        self.rotating = False
+        return estimates
+
+    def addPulse(self, pulseInfo):
+        if not self.rotating:
+            return
+        heading = headingFromQuaternion(pulseInfo.orientation_x, pulseInfo.orientation_y, pulseInfo.orientation_z, pulseInfo.orientation_w)
+        with self._lock:
+            sums = self._sums.get(pulseInfo.tag_id)
+            if sums is None:
+                sums = self._sums[pulseInfo.tag_id] = _RotationSums()
+            sums.add(heading, pulseInfo.snr, pulseInfo.position_x, pulseInfo.position_y)
+
+    def estimate(self, tagId):
+        with self._lock:
+            sums = self._sums.get(tagId)
+            if sums is None:
+                return None
+            solution    = sums.solve()
+            pulseCount  = sums.n
+            positionX   = sums.sumX / pulseCount
+            positionY   = sums.sumY / pulseCount
+        if solution is None:
+            return None
+        _, b, c, rSquared, coverage = solution
+        bearingDegrees = math.degrees(math.atan2(c, b)) % 360.0
+        return Bearing(tagId, bearingDegrees, rSquared * coverage, pulseCount, positionX, positionY)
+
+    def estimates(self):
+        with self._lock:
+            tagIds = list(self._sums)
+        bearings = {}
+        for tagId in tagIds:
+            bearing = self.estimate(tagId)
+            if bearing:
+                bearings[tagId] = bearing
+        return bearings
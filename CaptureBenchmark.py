@@ -0,0 +1,107 @@
+from VehicleSimulator import *
+from MavlinkThread import *
+from Scheduler import *
+import AppGlobal
+
+import argparse
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+# Raw capture retrieval throughput against an in-process VehicleSimulator over loopback UDP. For each chunk loss
+# probability a capture is taken and downloaded, and the download rate, chunks sent per chunk of capture and the
+# number of retransmit requests are reported. With --drop the controller is rebooted half way through each download,
+# which the download has to ride out and resume from.
+class CaptureBenchmark:
+    def __init__(self, captureBytes, lossProbabilities, port, drop, timeoutSecs):
+        self._lossProbabilities = lossProbabilities
+        self._drop              = drop
+        self._timeoutSecs       = timeoutSecs
+        self._tagFilePath       = self._writeTagFile()
+        self._captureDirectory  = tempfile.mkdtemp(prefix = "pyTrackerCaptures")
+        Settings.captureDirectory = self._captureDirectory
+        self._simulator         = VehicleSimulator("udpout:localhost:{0}".format(port), captureBytes = captureBytes, captureSecs = 0.5, rebootSecs = 2.0)
+        self._mavlinkThread     = MavlinkThread("udpin:localhost:{0}".format(port), self._tagFilePath)
+
+    def _writeTagFile(self):
+        tagFile = tempfile.NamedTemporaryFile("w", suffix = ".txt", delete = False)
+        tagFile.write("2,capture,146000000,1000,-,0,-,15,60,5\n")
+        tagFile.close()
+        return tagFile.name
+
+    def run(self):
+        AppGlobal.scheduler = Scheduler()
+        AppGlobal.scheduler.start()
+        self._simulator.start()
+        self._mavlinkThread.start()
+        try:
+            if not self._waitFor(lambda: self._simulator.status == HeartbeatStatus.HEARTBEAT_STATUS_DETECTING):
+                print("pyTracker did not start detection")
+                return
+            for lossProbability in self._lossProbabilities:
+                self._runCapture(lossProbability)
+        finally:
+            self._mavlinkThread.stop()
+            self._mavlinkThread.join()
+            self._simulator.stop()
+            AppGlobal.scheduler.stop()
+            os.unlink(self._tagFilePath)
+            shutil.rmtree(self._captureDirectory, ignore_errors = True)
+
+    def _runCapture(self, lossProbability):
+        commandHandler  = self._mavlinkThread.commandHandler
+        captureId       = self._simulator.captureId
+        # Heartbeats have to show the controller detecting again after the previous capture before the next one
+        self._waitFor(lambda: self._simulator.status == HeartbeatStatus.HEARTBEAT_STATUS_DETECTING and not commandHandler.controllerLostHeartbeat)
+        time.sleep(1.5)
+        self._simulator.lossProbability = lossProbability
+        retransmitsStart    = self._retransmitRequests()
+        commandHandler.lastCapturePath = None
+        commandHandler.startRawCapture()
+        if not self._waitFor(lambda: self._simulator.captureId != captureId):
+            print("loss {0:.2f}: capture did not finish".format(lossProbability))
+            return
+        chunksSentStart = self._simulator.chunksSent
+        startTime       = time.time()
+        if self._drop:
+            self._waitFor(lambda: commandHandler.captureProgress() and commandHandler.captureProgress()[0] * 2 >= commandHandler.captureProgress()[1])
+            self._simulator.reboot()
+        if not self._waitFor(lambda: commandHandler.lastCapturePath is not None):
+            print("loss {0:.2f}: download did not complete".format(lossProbability))
+            return
+        elapsedSecs     = time.time() - startTime
+        captureData     = self._simulator.captureData
+        chunkCount      = (len(captureData) + captureChunkDataSize - 1) // captureChunkDataSize
+        matches         = pathlib.Path(commandHandler.lastCapturePath).read_bytes() == captureData
+        print("loss {0:.2f}: {1} bytes in {2:.2f} secs, {3:.0f} KB/s, sent:chunks {4:.2f}, retransmit requests {5}, {6}".format(
+              lossProbability, len(captureData), elapsedSecs, len(captureData) / 1024 / elapsedSecs,
+              (self._simulator.chunksSent - chunksSentStart) / chunkCount, self._retransmitRequests() - retransmitsStart,
+              "data matches" if matches else "DATA MISMATCH"))
+        os.unlink(commandHandler.lastCapturePath)
+
+    def _retransmitRequests(self):
+        return metrics.snapshot()["metrics"].get("vehicle.0.capture.retransmit_requests", 0)
+
+    def _waitFor(self, condition):
+        deadline = time.time() + self._timeoutSecs
+        while time.time() < deadline:
+            if condition():
+                return True
+            time.sleep(0.01)
+        return False
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Raw capture download benchmark against a simulated vehicle")
+    parser.add_argument("--bytes",      type = int,     default = 1000000,  help = "capture size")
+    parser.add_argument("--loss",       default = "0,0.01,0.05",            help = "comma separated chunk loss probabilities")
+    parser.add_argument("--port",       type = int,     default = 14700)
+    parser.add_argument("--drop",       action = "store_true",  help = "reboot the controller half way through each download")
+    parser.add_argument("--timeout",    type = float,   default = 120.0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='[%(levelname)s] %(message)s |  %(filename)s:%(lineno)d')
+    with tempfile.TemporaryDirectory() as directory:
+        Settings.tagCacheDirectory = directory
+        CaptureBenchmark(args.bytes, [ float(loss) for loss in args.loss.split(",") ], args.port, args.drop, args.timeout).run()
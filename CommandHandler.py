@@ -2,30 +2,103 @@ from TunnelMessage import *
 from TagInfoList import *
 from Timer import *
 from DetectorInfoList import *
+from PulseStore import *
+from TagUploader import *
+from BearingEstimator import *
+from TelemetryLog import *
+from Metrics import *
+from RawCapture import *
 import AppGlobal
 
-import threading
+import collections
 import logging
+import time
 
 class CommandHandler:
-    def __init__(self, mavlink, callbackQueue):
-        self._mavlink                   = mavlink
-        self._callbackQueue             = callbackQueue
+    # sender (VehicleLink) queues TUNNEL commands to the vehicle. It is None when replaying a recording, nothing is
+    # sent to the vehicle in that case.
+    #
+    # The protocol state is owned by the processing thread which feeds processMavlinkTunnelMessage. Work from other
+    # threads which changes it is handed over with callSoon and run by the processing thread in runPendingCalls.
+    # processingWakeup, if given, wakes the processing thread when work is queued.
+    def __init__(self, sender, tagFilePath = None, recorder = None, vehicleId = 0, processingWakeup = None):
+        self._sender                    = sender
+        self._processingWakeup          = processingWakeup
+        self._pendingCalls              = collections.deque()
+        self.vehicleId                  = vehicleId
+        self._recorder                  = recorder
         self._tunnelCommandAckTimer     = Timer(2000, self._tunnelCommandAckFailed)
         self._controllerHeartbeatTimer  = Timer(6000, self._controllerHeartbeatFailed)
         self._heartbeatCounter          = 1
+        self.tunnelMessageCount         = 0
         self._controllerLostHeartbeat   = True
-        self._firstControllerHeartbeat  = True
         self._controllerStatus          = HeartbeatStatus.HEARTBEAT_STATUS_IDLE
-        self.detectorInfoList           = DetectorInfoList()
+        self._controllerHasTags         = False     # The controller holds the tags we last uploaded
+        self._statusMismatchCount       = 0
+        self._resyncStepSent            = False
+        self._resyncStartTime           = None
+        self._controllerSynced          = False     # The controller has been detecting with our tags at some point
+        self.detectorInfoList           = DetectorInfoList(vehicleId)
+        self.pulseStore                 = PulseStore()
+        self._pendingPulses             = []
+        self.bearingEstimator           = BearingEstimator()
+        self.pulseSummaryLog            = PulseSummaryLog(self.detectorInfoList, pulseStore = self.pulseStore)
+        self._bearingUpdateTimer        = Timer(Settings.bearingUpdateMsecs, self._updateBearings)
         self._tunnelCommandAckExpected  = TunnelCommand.COMMAND_ID_ACK
-        self._tagInfoList               = TagInfoList()
+        self._tagInfoList               = TagInfoList(tagFilePath)
+        self._tagsToSend                = []
+        self._tagUploader               = TagUploader(self._sendTunnelMessage, self._tagUploadComplete)
+        self._tagFilePollTimer          = Timer(Settings.tagFilePollMsecs, self._pollTagFile)
+        self._intervalPushTimer         = Timer(Settings.intervalPushMsecs, lambda: self.callSoon(self._pushIntervalEstimates))
+        self._captureDownloader         = CaptureDownloader(self._sendTunnelMessage, self._captureDownloadComplete, Settings.captureDirectory, vehicleId)
+        self._captureRequested          = False
+        self._captureStarted            = False     # RAW_CAPTURE acked, the capture is running
+        self._staleCaptureId            = 0         # The controller's most recent capture when RAW_CAPTURE was acked
+        self.lastCapturePath            = None
+        self._tagReloadPending          = False
+        self._radioCenterHzSent         = None
+        self._tunnelCommandSendTime     = None
+        self._commandCounters           = { command: metrics.counter("tunnel.rx." + command.name) for command in TunnelCommand }
+        self._decodeFailedCounter       = metrics.counter("tunnel.rx.decode_failed")
+        self._decodeMsecs               = metrics.histogram("tunnel.decode_msecs")
+        self._dispatchMsecs             = metrics.histogram("tunnel.dispatch_msecs")
+        self._ackRttMsecs               = metrics.histogram("tunnel.ack_rtt_msecs")
+        metrics.gauge("vehicle.{0}.pulse_store.count".format(vehicleId), lambda: self.pulseStore.totalCount)
+        metrics.gauge("vehicle.{0}.detectors.count".format(vehicleId), lambda: len(self.detectorInfoList))
+        self._resyncCounter             = metrics.counter("vehicle.{0}.resync.count".format(vehicleId))
+        self._resyncMsecs               = metrics.histogram("vehicle.{0}.resync.recovery_msecs".format(vehicleId))
         self._tagInfoList.checkForTagFile()
         self._tagInfoList.loadTags()
+        if self._sender is None:
+            # Replaying a recording, there is no tag upload so the detectors are set up right away
+            self.sendTags()
 
     def stop(self):
+        if self._recorder:
+            self._recorder.close()
+        self._tagUploader.stop()
+        self._tagFilePollTimer.stop()
+        self._intervalPushTimer.stop()
+        self._captureDownloader.stop()
+        self._bearingUpdateTimer.stop()
         self._tunnelCommandAckTimer.stop()
         self._controllerHeartbeatTimer.stop()
+        self.pulseSummaryLog.flush(force = True)
+
+    def callSoon(self, callback, *args):
+        # Safe from any thread, callback runs on the processing thread
+        self._pendingCalls.append([ callback, args ])
+        if self._processingWakeup:
+            self._processingWakeup()
+
+    def runPendingCalls(self):
+        # Called by the processing thread between batches of TUNNEL messages
+        while self._pendingCalls:
+            callback, args = self._pendingCalls.popleft()
+            try:
+                callback(*args)
+            except:
+                logging.exception("Exception in CommandHandler call")
 
     @property
     def controllerLostHeartbeat(self):
@@ -35,49 +108,136 @@ class CommandHandler:
     def controllerLostHeartbeat(self, value):
         if value != self._controllerLostHeartbeat:
             self._controllerLostHeartbeat = value
-            AppGlobal.app.updateUI()
+            AppGlobal.notifyStateChanged(StateDelta.CONTROLLER_HEARTBEAT, self.vehicleId)
 
     def processMavlinkTunnelMessage(self, mavlinkTunnelMsg):
-        [ command, tunnelObject ] = TunnelMessageHandler.processMavlinkMessage(mavlinkTunnelMsg)
-        if command == TunnelCommand.COMMAND_ID_HEARTBEAT:
-            self._handleTunnelHeartbeat(tunnelObject)
-        elif command == TunnelCommand.COMMAND_ID_ACK:
-            self._handleTunnelAck(tunnelObject)
-        elif command == TunnelCommand.COMMAND_ID_PULSE:
-            self._handleTunnelPulse(tunnelObject)
+        self.tunnelMessageCount += 1
+        decodeStart = time.perf_counter()
+        payloadBytes = TunnelMessageHandler.payloadBytes(mavlinkTunnelMsg)
+        decoded = TunnelMessageHandler.decodePayload(payloadBytes)
+        dispatchStart = time.perf_counter()
+        self._decodeMsecs.record((dispatchStart - decodeStart) * 1000)
+        if decoded is None:
+            self._decodeFailedCounter.increment()
         else:
-            logging.warning("processMavlinkTunnelMessage: Unknown command: %s", command.name)
-            pass
+            [ command, tunnelObject ] = decoded
+            self._commandCounters[command].increment()
+            if command == TunnelCommand.COMMAND_ID_HEARTBEAT:
+                self._handleTunnelHeartbeat(tunnelObject)
+            elif command == TunnelCommand.COMMAND_ID_ACK:
+                self._handleTunnelAck(tunnelObject)
+            elif command == TunnelCommand.COMMAND_ID_PULSE:
+                self._handleTunnelPulse(tunnelObject)
+            elif command == TunnelCommand.COMMAND_ID_START_ROTATION:
+                self.startRotation()
+            elif command == TunnelCommand.COMMAND_ID_STOP_ROTATION:
+                self.stopRotation()
+            elif command == TunnelCommand.COMMAND_ID_CAPTURE_CHUNK:
+                self._captureDownloader.handleChunk(tunnelObject, payloadBytes)
+            elif command == TunnelCommand.COMMAND_ID_CAPTURE_INFO:
+                self._captureDownloader.handleInfo(tunnelObject)
+            else:
+                logging.warning("processMavlinkTunnelMessage: Unknown command: %s", command.name)
+            self._dispatchMsecs.record((time.perf_counter() - dispatchStart) * 1000)
+        # Recorded after handling so the heartbeat which starts a new flight recording is part of it. Capture data
+        # goes to its own file, not the flight recording.
+        if self._recorder and (decoded is None or decoded[0] != TunnelCommand.COMMAND_ID_CAPTURE_CHUNK):
+            self._recorder.record(payloadBytes)
 
     def _handleTunnelHeartbeat(self, heartbeat):
         if heartbeat.system_id == HeartbeatSystemId.HEARTBEAT_SYSTEM_ID_MAVLINKCONTROLLER:
-            logging.info("HEARTBEAT from MavlinkTagController - counter:status {0} {1}".format(self._heartbeatCounter, heartbeat.status))
+            logging.info("HEARTBEAT from MavlinkTagController - counter:status %d %d", self._heartbeatCounter, heartbeat.status)
+            AppGlobal.startupMilestone("first_heartbeat")
+            if self.controllerLostHeartbeat:
+                if self._recorder:
+                    # Each time the controller (re)appears is treated as a new flight
+                    self._recorder.rotate()
+                self._captureDownloader.resume()
+            if self._captureStarted and heartbeat.status != HeartbeatStatus.HEARTBEAT_STATUS_CAPTURE:
+                # A short capture can be over before a heartbeat reports it, so this does not wait to see CAPTURE. A
+                # controller slow to report CAPTURE still has the previous capture, the downloader waits that out.
+                logging.info("Raw capture finished, downloading it")
+                self._captureStarted = False
+                self._captureDownloader.start(self._staleCaptureId)
             self.controllerLostHeartbeat = False
             self._controllerHeartbeatTimer.start()
             self._controllerStatus = heartbeat.status
-            if self._firstControllerHeartbeat:
-                self._firstControllerHeartbeat = False
-                self.sendTags()
+            self._reconcileControllerStatus(heartbeat.status)
+
+    def _reconcileControllerStatus(self, status):
+        # The controller should be detecting with the tags we last uploaded. Each heartbeat's status is compared with
+        # that and the fewest commands which get it back there are sent:
+        #   IDLE, RECEIVING_TAGS    controller restarted or an upload was cut off: upload tags, start detection
+        #   HAS_TAGS                detection stopped: start detection
+        #   DETECTING               with tags from before we connected: stop detection, upload tags, start detection
+        #   CAPTURE                 left alone until the capture ends
+        # Nothing is done while a command or upload is outstanding. The first mismatch is acted on straight away, once
+        # a resync is under way the next step waits for the mismatch to be seen on consecutive heartbeats so a
+        # heartbeat which crossed with the previous command is not acted on. Only resyncs after the controller was
+        # first brought up to detecting count as recoveries in the metrics.
+        if self._sender is None or self._tagInfoList.isEmpty() or status not in HeartbeatStatus._value2member_map_:
+            return
+        commandOutstanding = self._tunnelCommandAckExpected != TunnelCommand.COMMAND_ID_ACK or self._tagUploader.active
+        if commandOutstanding or status == HeartbeatStatus.HEARTBEAT_STATUS_CAPTURE:
+            return
+        if status == HeartbeatStatus.HEARTBEAT_STATUS_DETECTING and self._controllerHasTags:
+            self._statusMismatchCount = 0
+            self._resyncStepSent      = False
+            self._controllerSynced    = True
+            return
+        if status in (HeartbeatStatus.HEARTBEAT_STATUS_IDLE, HeartbeatStatus.HEARTBEAT_STATUS_RECEIVING_TAGS):
+            self._controllerHasTags = False
+        self._statusMismatchCount += 1
+        if self._resyncStepSent and self._statusMismatchCount < Settings.resyncMismatchHeartbeats:
+            return
+        self._statusMismatchCount   = 0
+        self._resyncStepSent        = True
+        if self._resyncStartTime is None and self._controllerSynced:
+            self._resyncStartTime = time.monotonic()
+            self._resyncCounter.increment()
+        logging.info("Controller status %s, resyncing - has_tags:reload_pending %d %d", HeartbeatStatus(status).name, self._controllerHasTags, self._tagReloadPending)
+        if status == HeartbeatStatus.HEARTBEAT_STATUS_DETECTING:
+            self._tagReloadPending = True
+            self.stopDetection()
+        elif status == HeartbeatStatus.HEARTBEAT_STATUS_HAS_TAGS and self._controllerHasTags and not self._tagReloadPending:
+            self.startDetection()
+        else:
+            self._tagReloadPending = False
+            self.sendTags()
 
     def _handleTunnelAck(self, ack):
+        if self._tagUploader.handleAck(ack):
+            return
+
         if ack.command == self._tunnelCommandAckExpected:
             self._tunnelCommandAckTimer.stop();
             self._tunnelCommandAckExpected = TunnelCommand.COMMAND_ID_ACK
+            self._ackRttMsecs.record((time.monotonic() - self._tunnelCommandSendTime) * 1000)
 
-            logging.info("Tunnel command ack received - command:result {0} {1}".format(ack.command, ack.result))
+            logging.info("Tunnel command ack received - command:result %d %d", ack.command, ack.result)
 
-            if ack.result == CommandResult.COMMAND_RESULT_SUCCESS:
-                if ack.command == TunnelCommand.COMMAND_ID_START_TAGS or ack.command == TunnelCommand.COMMAND_ID_TAG:
-                    self._sendNextTag()
-                elif ack.command == TunnelCommand.COMMAND_ID_END_TAGS:
-                    self.detectorInfoList.populateFromTags(self._tagInfoList)
-                    AppGlobal.app.updateUI()
-                    self.startDetection()
-            else:
-                logging.warning("Tunnel command failed - command:result {0}".format(ack.command))
-                raise Exception
+            if ack.result != CommandResult.COMMAND_RESULT_SUCCESS:
+                # The next controller heartbeats show where it was left and resync from there
+                logging.warning("Tunnel command failed - command:result %d %d", ack.command, ack.result)
+                return
+
+            if ack.command == TunnelCommand.COMMAND_ID_RAW_CAPTURE and self._captureRequested:
+                self._captureRequested  = False
+                self._captureStarted    = True
+                self._staleCaptureId    = self._captureDownloader.captureId
+            elif ack.command == TunnelCommand.COMMAND_ID_START_DETECTION:
+                AppGlobal.startupMilestone("detecting")
+                if self._resyncStartTime is not None:
+                    # Recovery time runs from the first out of step heartbeat to detection running again
+                    recoveryMsecs = (time.monotonic() - self._resyncStartTime) * 1000
+                    self._resyncMsecs.record(recoveryMsecs)
+                    logging.info("Controller resynced in %.0f msecs", recoveryMsecs)
+                    self._resyncStartTime = None
+            elif ack.command == TunnelCommand.COMMAND_ID_STOP_DETECTION and self._tagReloadPending:
+                self._tagReloadPending = False
+                self.sendTags()
         else:
-            logging.warning("Tunnel command ack received for unexpected command - expected:actual {0} {1}".format(self._tunnelCommandAckExpected, ack.command))
+            logging.warning("Tunnel command ack received for unexpected command - expected:actual %d %d", self._tunnelCommandAckExpected, ack.command)
 
     def _handleTunnelPulse(self, pulseInfo):
         if self._tagInfoList.isEmpty():
@@ -85,18 +245,91 @@ class CommandHandler:
             return
 
         self.detectorInfoList.handleTunnelPulse(pulseInfo);
+        self.pulseSummaryLog.addPulse(pulseInfo)
 
         isDetectorHeartbeat = pulseInfo.frequency_hz == 0
-        if isDetectorHeartbeat:
-            logging.info("Detector heartbeat: tag_id {0}".format(pulseInfo.tag_id))
-        else:
-            knownTag = self._tagInfoList.getTagInfo(pulseInfo.tag_id) != None
-            logging.info("Pulse received: tag_id:confirmed:known {0} {1} {2}".format(pulseInfo.tag_id, pulseInfo.confirmed_status, knownTag))
+        if not isDetectorHeartbeat:
+            self._pendingPulses.append(pulseInfo)
+            if pulseInfo.confirmed_status:
+                self.bearingEstimator.addPulse(pulseInfo)
+
+    def flushPulses(self):
+        # Called by the receive loop once per batch of TUNNEL messages
+        if self._pendingPulses:
+            self.pulseStore.appendPulses(self._pendingPulses)
+            self._pendingPulses = []
+        if self._recorder:
+            self._recorder.flush()
+        self.pulseSummaryLog.flush()
+
+    def startRawCapture(self):
+        # The controller reports CAPTURE status while capturing, the download starts with the first heartbeat after the
+        # RAW_CAPTURE ack which no longer does. The capture info asked for first gives the id of the capture it replaces.
+        if self._sender is None or self.controllerLostHeartbeat:
+            logging.warning("Raw capture: no controller")
+            return
+        logging.info("Raw capture requested")
+        self._captureRequested  = True
+        self._captureStarted    = False
+        self._captureDownloader.requestInfo()
+        rawCapture = TunnelRawCapture()
+        rawCapture.hdr_command  = TunnelCommand.COMMAND_ID_RAW_CAPTURE
+        rawCapture.sdr_type     = SdrType.SDR_TYPE_AIRSPY_MINI
+        self._sendTunnelCommand(rawCapture)
+
+    def captureProgress(self):
+        # [ chunks received, chunk count ] or None if no download is running
+        return self._captureDownloader.progress() if self._captureDownloader.active else None
+
+    def _captureDownloadComplete(self, success, path):
+        if success:
+            self.lastCapturePath = path
+
+    def startRotation(self):
+        logging.info("Rotation started")
+        self._recordRotationMarker(TunnelStartRotation, TunnelCommand.COMMAND_ID_START_ROTATION)
+        self.bearingEstimator.startRotation()
+        self._bearingUpdateTimer.start()
+
+    def stopRotation(self):
+        self._bearingUpdateTimer.stop()
+        bearings = self.bearingEstimator.stopRotation()
+        self._updateBearings()
+        self._recordRotationMarker(TunnelStopRotation, TunnelCommand.COMMAND_ID_STOP_ROTATION)
+        # Each rotation adds one line of position per tag to its location, low confidence bearings would only add noise
+        confidentBearings = []
+        for tagId, bearing in bearings.items():
+            logging.info("BEARING tag_id:bearing:confidence:pulses %d %.1f %.2f %d", tagId, bearing.bearingDegrees, bearing.confidence, bearing.pulseCount)
+            if bearing.confidence >= Settings.minBearingConfidence:
+                confidentBearings.append(bearing)
+        for tagLocation in self.detectorInfoList.addRotationBearings(confidentBearings):
+            if tagLocation.isValid():
+                logging.info("LOCATION tag_id:x:y:error:bearings %d %.1f %.1f %s %d", tagLocation.tagId, tagLocation.positionX, tagLocation.positionY,
+                             "-" if tagLocation.errorRadius is None else "{0:.1f}".format(tagLocation.errorRadius), tagLocation.observationCount)
+            for detectorId in (tagLocation.tagId, tagLocation.tagId + 1):
+                AppGlobal.notifyStateChanged(StateDelta.DETECTOR, (self.vehicleId, detectorId))
+
+    def _recordRotationMarker(self, markerClass, command):
+        if self._recorder:
+            marker = markerClass()
+            marker.hdr_command = command
+            self._recorder.record(bytearray(marker))
+
+    def _updateBearings(self):
+        # Provisional bearings while rotating, final ones when the rotation stops
+        for tagId, bearing in self.bearingEstimator.estimates().items():
+            detectorInfo = self.detectorInfoList.getDetectorInfo(tagId)
+            if detectorInfo:
+                detectorInfo.bearing = bearing
+                AppGlobal.notifyStateChanged(StateDelta.DETECTOR, detectorInfo.key)
+        if self.bearingEstimator.rotating:
+            self._bearingUpdateTimer.start()
 
     def startDetection(self):
         startDetection = TunnelStartDetection()
         startDetection.hdr_command                  = TunnelCommand.COMMAND_ID_START_DETECTION
         startDetection.radio_center_frequency_hz    = self._tagInfoList.radioCenterHz()
+        self._radioCenterHzSent                     = startDetection.radio_center_frequency_hz
         startDetection.sdr_type                     = SdrType.SDR_TYPE_AIRSPY_MINI
         self._sendTunnelCommand(startDetection)
 
@@ -110,35 +343,122 @@ class CommandHandler:
             logging.warning("No tags are available to send.")
             return
 
-        self._nextTagToSend = 0
+        self._tagsToSend = self._tagInfoList.activeTags()
+        if self._sender is None:
+            # Replaying a recording: the recorded controller already has the tags, just set up the detectors
+            self.detectorInfoList.populateFromTags(self._tagsToSend)
+            AppGlobal.notifyStateChanged(StateDelta.DETECTOR_LIST, self.vehicleId)
+            return
+        self._tagUploader.start(self._tagsToSend, SdrType.SDR_TYPE_AIRSPY_MINI)
 
-        startTags = TunnelStartTags()
-        startTags.hdr_command   = TunnelCommand.COMMAND_ID_START_TAGS;
-        startTags.sdr_type      = SdrType.SDR_TYPE_AIRSPY_MINI
-        self._sendTunnelCommand(startTags)
+    def _tagUploadComplete(self, success):
+        self._controllerHasTags = success
+        if success:
+            keptCount, createdCount, removedCount = self.detectorInfoList.updateFromTags(self._tagsToSend)
+            logging.info("Detectors kept:created:removed %d %d %d", keptCount, createdCount, removedCount)
+            AppGlobal.notifyStateChanged(StateDelta.DETECTOR_LIST, self.vehicleId)
+            self.startDetection()
+        self._tagFilePollTimer.start()
+        self._intervalPushTimer.start()
 
-    def _sendNextTag(self):
-        if self._nextTagToSend == len(self._tagInfoList):
-            self._sendEndTags()
+    def _pollTagFile(self):
+        # Runs on the scheduler thread. A changed tag file is loaded into a new TagInfoList here, off the processing
+        # thread, which then swaps it in. Polling resumes once it has been applied.
+        tagInfoList = self._tagInfoList.reloadIfChanged()
+        if tagInfoList is None:
+            self.callSoon(self._startPendingTagReload)
+            self._tagFilePollTimer.start()
         else:
-            extTagInfo = self._tagInfoList[self._nextTagToSend]
-            self._sendTunnelCommand(extTagInfo.tagInfo)
-            self._nextTagToSend += 1
+            self.callSoon(self._applyReloadedTags, tagInfoList)
+
+    def _applyReloadedTags(self, tagInfoList):
+        # Tag file edits are picked up while running. The controller only needs a new upload when the set of tags
+        # it is detecting actually changed, since START_TAGS replaces the whole set the upload is always the full
+        # active set: STOP_DETECTION, START_TAGS...END_TAGS, START_DETECTION.
+        # Reloaded tags start without the learned intra pulse estimates
+        self._applyIntervalEstimates(tagInfoList.activeTags())
+        diff                = TagSetDiff(self._tagInfoList, tagInfoList)
+        self._tagInfoList   = tagInfoList
+        if diff.hasChanges():
+            logging.info("Tag file changed: %s", diff)
+            activeTags = tagInfoList.activeTags()
+            if self._tagSetBytes(activeTags) != self._tagSetBytes(self._tagsToSend) or self._radioCenterHzSent != tagInfoList.radioCenterHz():
+                self._tagReloadPending = True
+            else:
+                logging.info("Tag file changed: active tag set on the controller is unchanged, no upload needed")
+        self._startPendingTagReload()
+        self._tagFilePollTimer.start()
+
+    def _startPendingTagReload(self):
+        commandOutstanding = self._tunnelCommandAckExpected != TunnelCommand.COMMAND_ID_ACK or self._tagUploader.active
+        if self._tagReloadPending and not self.controllerLostHeartbeat and not commandOutstanding:
+            logging.info("Tag set changed, stopping detection to upload %d tags", len(self._tagInfoList.activeTags()))
+            self.stopDetection()
 
-    def _sendEndTags(self):
-        endTags = TunnelEndTags()
-        endTags.hdr_command = TunnelCommand.COMMAND_ID_END_TAGS
-        self._sendTunnelCommand(endTags)
+    def _pushIntervalEstimates(self):
+        # Converged intra pulse estimates are sent to the controller as ip1/ip2 mu and sigma so it can search a
+        # narrower window. Each upload stops detection briefly, so tags are only re-sent when an estimate moved by
+        # more than its sigma (or the sigma halved or doubled) since it was last sent. Runs on the processing thread
+        # and waits for the next push while an upload is under way.
+        if self._tagUploader.active:
+            self._intervalPushTimer.start()
+            return
+        if self._applyIntervalEstimates(self._tagInfoList.activeTags()):
+            logging.info("Intra pulse estimates changed, uploading tightened tags")
+            self._tagReloadPending = True
+            self._startPendingTagReload()
+        self._intervalPushTimer.start()
+
+    def _applyIntervalEstimates(self, tags):
+        # Returns True if any tag changed. mu and sigma are in seconds. A changed tag gets a new TunnelTagInfo, the
+        # previous one may still be held by the TagUploader for retransmission. Tags may come from a reloaded tag
+        # file, so an estimate is only used while its detector still matches the tag's definition.
+        changed = False
+        for extTagInfo in tags:
+            tagInfo = extTagInfo.tagInfo
+            detectorDefinitions = [ [ tagInfo.id, extTagInfo.ip_msecs_1_id, tagInfo.intra_pulse1_msecs, "ip1_mu", "ip1_sigma" ] ]
+            if tagInfo.intra_pulse2_msecs != 0:
+                detectorDefinitions.append([ tagInfo.id + 1, extTagInfo.ip_msecs_2_id, tagInfo.intra_pulse2_msecs, "ip2_mu", "ip2_sigma" ])
+            for detectorId, tagLabel, intraPulseMsecs, muField, sigmaField in detectorDefinitions:
+                detectorInfo    = self.detectorInfoList.getDetectorInfo(detectorId)
+                if detectorInfo is None or not detectorInfo.matches(tagLabel, intraPulseMsecs, tagInfo.k):
+                    continue
+                estimator       = detectorInfo.intervalEstimator
+                if estimator is None or not estimator.isConverged():
+                    continue
+                muSecs          = estimator.meanSecs()
+                sigmaSecs       = estimator.sigmaSecs()
+                sentMuSecs      = getattr(tagInfo, muField)
+                sentSigmaSecs   = getattr(tagInfo, sigmaField)
+                if sentSigmaSecs and abs(muSecs - sentMuSecs) <= sentSigmaSecs and 0.5 <= sigmaSecs / sentSigmaSecs <= 2:
+                    continue
+                logging.info("Intra pulse estimate detector_id:mu:sigma:samples %d %.4f %.4f %d", detectorId, muSecs, sigmaSecs, estimator.sampleCount())
+                if tagInfo is extTagInfo.tagInfo:
+                    tagInfo = TunnelTagInfo.from_buffer_copy(tagInfo)
+                setattr(tagInfo, muField, muSecs)
+                setattr(tagInfo, sigmaField, sigmaSecs)
+                changed = True
+            extTagInfo.tagInfo = tagInfo
+        return changed
+
+    @staticmethod
+    def _tagSetBytes(tags):
+        return sorted(extTagInfo.contentBytes() for extTagInfo in tags)
 
     def _sendTunnelCommand(self, tunnelMsg):
         self._tunnelCommandAckTimer.start()
         self._tunnelCommandAckExpected = tunnelMsg.hdr_command
-        TunnelMessageHandler.sendTunnelCommand(self._mavlink, tunnelMsg)
+        self._tunnelCommandSendTime = time.monotonic()
+        self._sendTunnelMessage(tunnelMsg)
+
+    def _sendTunnelMessage(self, tunnelMsg):
+        self._sender.sendTunnelCommand(tunnelMsg)
 
     def _tunnelCommandAckFailed(self):
-        logging.warning("Tunnel command failed - no response from vehicle: command {0}".format(self._tunnelCommandAckExpected))
+        logging.warning("Tunnel command failed - no response from vehicle: command %d", self._tunnelCommandAckExpected)
         self._tunnelCommandAckExpected = TunnelCommand.COMMAND_ID_ACK
 
     def _controllerHeartbeatFailed(self):
         logging.info("Controller heartbeat failed")
         self.controllerLostHeartbeat = True
+        self._captureDownloader.pause()
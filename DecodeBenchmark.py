@@ -0,0 +1,44 @@
+from TunnelMessage import *
+
+import argparse
+import ctypes
+import time
+
+# TUNNEL decode throughput of TunnelMessageHandler.processMavlinkMessage, no vehicle or pymavlink needed. Messages are
+# shaped like pymavlink delivers them: a 128 entry list of ints with the real length in payload_length.
+class BenchmarkTunnelMessage:
+    def __init__(self, tunnelMsg):
+        self.payload_length = ctypes.sizeof(tunnelMsg)
+        self.payload        = list(bytes(tunnelMsg) + bytes(128 - self.payload_length))
+
+def makeMessages(pulsesPerHeartbeat):
+    pulseInfo = TunnelPulseInfo()
+    pulseInfo.hdr_command       = TunnelCommand.COMMAND_ID_PULSE
+    pulseInfo.tag_id            = 2
+    pulseInfo.frequency_hz      = 146000000
+    pulseInfo.snr               = 12.5
+    heartbeat = TunnelHeartbeat()
+    heartbeat.hdr_command       = TunnelCommand.COMMAND_ID_HEARTBEAT
+    heartbeat.system_id         = HeartbeatSystemId.HEARTBEAT_SYSTEM_ID_MAVLINKCONTROLLER
+    heartbeat.status            = HeartbeatStatus.HEARTBEAT_STATUS_DETECTING
+    return [ BenchmarkTunnelMessage(pulseInfo) ] * pulsesPerHeartbeat + [ BenchmarkTunnelMessage(heartbeat) ]
+
+def runBenchmark(messageCount, pulsesPerHeartbeat):
+    messages = makeMessages(pulsesPerHeartbeat)
+    startTime = time.perf_counter()
+    for messageIndex in range(messageCount):
+        decoded = TunnelMessageHandler.processMavlinkMessage(messages[messageIndex % len(messages)])
+    elapsedSecs = time.perf_counter() - startTime
+    # The last message of each cycle is the heartbeat
+    if decoded is None or decoded[0] != TunnelCommand.COMMAND_ID_HEARTBEAT:
+        print("Decode failed")
+        return
+    print("messages {0}  pulse:heartbeat {1}:1  msgs/sec {2:.0f}  usecs/msg {3:.2f}".format(messageCount, pulsesPerHeartbeat, messageCount / elapsedSecs, elapsedSecs / messageCount * 1e6))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "TUNNEL message decode throughput benchmark")
+    parser.add_argument("--pulses",     type = int, default = 9,        help = "pulses per heartbeat")
+    parser.add_argument("--messages",   type = int, default = 200000)
+    args = parser.parse_args()
+
+    runBenchmark(args.messages - args.messages % (args.pulses + 1), args.pulses)
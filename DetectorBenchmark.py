@@ -0,0 +1,68 @@
+from DetectorInfoList import *
+from TagInfoList import *
+from TunnelMessage import *
+from Scheduler import *
+import AppGlobal
+
+import argparse
+import gc
+import time
+import tracemalloc
+
+# Memory per detector and per pulse update cost of DetectorInfoList for large tag catalogs, no vehicle or UI needed
+def makeTags(detectorCount):
+    tags = []
+    for tagIndex in range(detectorCount // 2):
+        extTagInfo = ExtendedTagInfo()
+        extTagInfo.tagInfo.id                   = 2 + tagIndex * 2
+        extTagInfo.tagInfo.frequency_hz         = 146000000 + tagIndex * 500
+        extTagInfo.tagInfo.intra_pulse1_msecs   = 1000
+        extTagInfo.tagInfo.intra_pulse2_msecs   = 1500
+        extTagInfo.tagInfo.k                    = Settings.k
+        extTagInfo.name                         = "bench{0}".format(extTagInfo.tagInfo.id)
+        extTagInfo.ip_msecs_1_id                = "-"
+        extTagInfo.ip_msecs_2_id                = "-"
+        tags.append(extTagInfo)
+    return tags
+
+def makePulses(tagCount, pulseCount):
+    pulses = []
+    for pulseIndex in range(pulseCount):
+        pulseInfo = TunnelPulseInfo()
+        pulseInfo.tag_id            = 2 + 2 * (pulseIndex * 37 % tagCount)
+        pulseInfo.frequency_hz      = 146000000
+        pulseInfo.confirmed_status  = 1
+        pulseInfo.snr               = 10.0 + pulseIndex % 3
+        pulseInfo.group_seq_counter = pulseIndex // Settings.k
+        pulses.append(pulseInfo)
+    return pulses
+
+def runBenchmark(detectorCount, passes):
+    tags = makeTags(detectorCount)
+    gc.collect()
+    tracemalloc.start()
+    detectorInfoList = DetectorInfoList()
+    detectorInfoList.populateFromTags(tags)
+    gc.collect()
+    detectorBytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    pulses = makePulses(len(tags), 2000)
+    startTime = time.perf_counter()
+    for _ in range(passes):
+        for pulseInfo in pulses:
+            detectorInfoList.handleTunnelPulse(pulseInfo)
+    pulseUsecs = (time.perf_counter() - startTime) / (passes * len(pulses)) * 1e6
+    print("detectors {0}  bytes/detector {1:.0f}  usecs/pulse {2:.2f}".format(len(detectorInfoList), detectorBytes / len(detectorInfoList), pulseUsecs))
+    detectorInfoList.clear()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "DetectorInfoList memory and pulse update benchmark")
+    parser.add_argument("--detectors",  type = int, default = 10000)
+    parser.add_argument("--passes",     type = int, default = 50)
+    args = parser.parse_args()
+
+    AppGlobal.scheduler = Scheduler()
+    AppGlobal.scheduler.start()
+    runBenchmark(args.detectors, args.passes)
+    AppGlobal.scheduler.stop()
@@ -1,11 +1,22 @@
+from Settings import *
 from Timer import *
+from StateDeltaQueue import *
+from Metrics import *
+from IntervalEstimator import *
+from GroupStats import *
 import AppGlobal
 
-import logging
-
 class DetectorInfo:
-    def __init__(self, tagId, tagLabel, intraPulseMsecs, k):
+    # Slots, plus an SNR history which is only allocated once the detector sees a pulse, keep large tag catalogs
+    # (thousands of detectors, most of them silent at any time) compact
+    __slots__ = ("tagId", "vehicleId", "key", "tagLabel", "intraPulseMsecs", "k", "heartbeatTimeout", "lastPulseGroupSeqCtr", "lastPulseSNR",
+                 "lastPulseStale", "bearing", "location", "_pulseCounter", "_heartbeatCounter", "groupStats", "heartbeatTimerInterval",
+                 "heartbeatTimeoutTimer", "stalePulseSNRTimer", "intervalEstimator")
+
+    def __init__(self, tagId, tagLabel, intraPulseMsecs, k, vehicleId = 0):
         self.tagId                      = tagId
+        self.vehicleId                  = vehicleId
+        self.key                        = (vehicleId, tagId)    # Unique across vehicles, used for UI state deltas
         self.tagLabel                   = tagLabel
         self.intraPulseMsecs            = intraPulseMsecs
         self.k                          = k
@@ -13,41 +24,62 @@ class DetectorInfo:
         self.lastPulseGroupSeqCtr       = -1
         self.lastPulseSNR               = 0.0
         self.lastPulseStale             = True
+        self.bearing                    = None      # Latest BearingEstimator result
+        self.location                   = None      # TagLocation shared by the detectors of the same tag
+        self._pulseCounter              = metrics.counter("detector.{0}.{1}.pulses".format(vehicleId, tagId))
+        self._heartbeatCounter          = metrics.counter("detector.{0}.{1}.heartbeats".format(vehicleId, tagId))
+        self.groupStats                 = None      # Created on the first pulse
+        self.intervalEstimator          = None      # Created on the first confirmed pulse
         self.heartbeatTimerInterval    = (k + 1) * intraPulseMsecs
         self.heartbeatTimeoutTimer     = Timer(self.heartbeatTimerInterval, self._heartbeatTimeoutCallback)
         self.stalePulseSNRTimer        = Timer(self.heartbeatTimerInterval, self._lastPulseStateTimeoutCallback)
 
+    def matches(self, tagLabel, intraPulseMsecs, k):
+        return self.tagLabel == tagLabel and self.intraPulseMsecs == intraPulseMsecs and self.k == k
+
+    def stop(self):
+        self.heartbeatTimeoutTimer.stop()
+        self.stalePulseSNRTimer.stop()
+
     def _heartbeatTimeoutCallback(self):
         self.heartbeatTimeout = True
-        AppGlobal.app.updateUI()
+        AppGlobal.notifyStateChanged(StateDelta.DETECTOR, self.key)
 
     def _lastPulseStateTimeoutCallback(self):
         self.lastPulseStale = True
-        AppGlobal.app.updateUI()
+        AppGlobal.notifyStateChanged(StateDelta.DETECTOR, self.key)
 
     def handleTunnelPulse(self, pulseInfo):
         if pulseInfo.tag_id == self.tagId:
             isDetectorHeartbeat = pulseInfo.frequency_hz == 0
             if isDetectorHeartbeat:
-                self.heartbeatLost = False
+                self._heartbeatCounter.increment()
+                self.heartbeatTimeout = False
                 self.heartbeatTimeoutTimer.start()
-                AppGlobal.app.updateUI()
-                logging.info("HEARTBEAT from Detector id {0}".format(self.tagId))
+                AppGlobal.notifyStateChanged(StateDelta.DETECTOR, self.key)
             elif pulseInfo.confirmed_status:
-                logging.info("CONFIRMED tag_id:frequency_hz:seq_ctr:snr:noise_psd {0} {1} {2} {3} {4}".format(
-                    pulseInfo.tag_id,
-                    pulseInfo.frequency_hz,
-                    pulseInfo.group_seq_counter,
-                    pulseInfo.snr,
-                    pulseInfo.noise_psd))
-
+                self._pulseCounter.increment()
+                # ctypes field reads are comparatively slow, so each field is read once
+                groupSeqCtr = pulseInfo.group_seq_counter
+                snr         = pulseInfo.snr
+                if self.intervalEstimator is None:
+                    self.intervalEstimator  = IntervalEstimator(self.intraPulseMsecs)
+                if self.groupStats is None:
+                    self.groupStats         = GroupStats(self.k)
+                self.intervalEstimator.addPulse(pulseInfo.start_time_seconds)
+                self.groupStats.addPulse(pulseInfo, groupSeqCtr, snr)
                 # We track the max pulse in each K group
-                if self.lastPulseGroupSeqCtr != pulseInfo.group_seq_counter:
-                    self.lastPulseGroupSeqCtr = pulseInfo.group_seq_counter
-                    self.lastPulseSNR = pulseInfo.snr
-                else:
-                    self.lastPulseSNR = max(pulseInfo.snr, self.lastPulseSNR)
+                if self.lastPulseGroupSeqCtr != groupSeqCtr:
+                    self.lastPulseGroupSeqCtr = groupSeqCtr
+                    self.lastPulseSNR = snr
+                elif snr > self.lastPulseSNR:
+                    self.lastPulseSNR = snr
                 self.lastPulseStale = False
 
                 self.stalePulseSNRTimer.start()
-                AppGlobal.app.updateUI()
+                AppGlobal.notifyStateChanged(StateDelta.DETECTOR, self.key)
+            else:
+                # Unconfirmed reports only time when their group was first heard, for its confirmation latency
+                if self.groupStats is None:
+                    self.groupStats = GroupStats(self.k)
+                self.groupStats.addReport(pulseInfo.group_seq_counter)
@@ -1,16 +1,86 @@
 from DetectorInfo import *
+from TagLocalizer import *
 
 class DetectorInfoList(list):
+    def __init__(self, vehicleId = 0):
+        super().__init__()
+        self.vehicleId         = vehicleId
+        self._detectorsByTagId = {}
+        self._tagLocations     = {}    # Survey long, kept across tag uploads
+
     def populateFromTags(self, tagInfoList):
-        for extTagInfo in tagInfoList:
-            detectorInfo = DetectorInfo(extTagInfo.tagInfo.id, extTagInfo.ip_msecs_1_id, extTagInfo.tagInfo.intra_pulse1_msecs, extTagInfo.tagInfo.k)
-            self.append(detectorInfo)
+        self.clear()
+        self.updateFromTags(tagInfoList)
 
+    def updateFromTags(self, tagInfoList):
+        # Detectors whose definition is unchanged are kept along with their state and group statistics, the rest are
+        # replaced or removed. Returns [ kept count, created count, removed count ].
+        previousDetectors = self._detectorsByTagId
+        super().clear()
+        self._detectorsByTagId = {}
+        createdCount = 0
+        for extTagInfo in tagInfoList:
+            detectorDefinitions = [ [ extTagInfo.tagInfo.id, extTagInfo.ip_msecs_1_id, extTagInfo.tagInfo.intra_pulse1_msecs ] ]
             if extTagInfo.tagInfo.intra_pulse2_msecs != 0:
-                detectorInfo = DetectorInfo(extTagInfo.tagInfo.id + 1, extTagInfo.ip_msecs_2_id, extTagInfo.tagInfo.intra_pulse2_msecs, extTagInfo.tagInfo.k)
-                self.append(detectorInfo)
+                detectorDefinitions.append([ extTagInfo.tagInfo.id + 1, extTagInfo.ip_msecs_2_id, extTagInfo.tagInfo.intra_pulse2_msecs ])
+            for tagId, tagLabel, intraPulseMsecs in detectorDefinitions:
+                detectorInfo = previousDetectors.pop(tagId, None)
+                if detectorInfo is None or not detectorInfo.matches(tagLabel, intraPulseMsecs, extTagInfo.tagInfo.k):
+                    if detectorInfo:
+                        detectorInfo.stop()
+                    detectorInfo = DetectorInfo(tagId, tagLabel, intraPulseMsecs, extTagInfo.tagInfo.k, self.vehicleId)
+                    createdCount += 1
+                self._appendDetector(detectorInfo)
+        for detectorInfo in previousDetectors.values():
+            detectorInfo.stop()
+        return [ len(self) - createdCount, createdCount, len(previousDetectors) ]
 
-    def handleTunnelPulse(self, pulseInfo):
+    def _appendDetector(self, detectorInfo):
+        self.append(detectorInfo)
+        self._detectorsByTagId[detectorInfo.tagId] = detectorInfo
+        detectorInfo.location = self._tagLocations.get(self._physicalTagId(detectorInfo.tagId))
+
+    @staticmethod
+    def _physicalTagId(tagId):
+        # Detectors id and id + 1 listen for the two pulse rates of the same tag
+        return tagId & ~1
+
+    def addBearing(self, bearing, weight = 1.0):
+        physicalTagId = self._physicalTagId(bearing.tagId)
+        tagLocation = self._tagLocations.get(physicalTagId)
+        if tagLocation is None:
+            tagLocation = self._tagLocations[physicalTagId] = TagLocation(physicalTagId)
+            for tagId in (physicalTagId, physicalTagId + 1):
+                detectorInfo = self._detectorsByTagId.get(tagId)
+                if detectorInfo:
+                    detectorInfo.location = tagLocation
+        tagLocation.addBearing(bearing.positionX, bearing.positionY, bearing.bearingDegrees, weight)
+        return tagLocation
+
+    def addRotationBearings(self, bearings):
+        # The id and id + 1 detectors of a tag hear the same transmitter from the same place during a rotation, so
+        # their bearings are one observation: only the most confident of them is added. Returns the updated locations.
+        bestBearings = {}
+        for bearing in bearings:
+            physicalTagId   = self._physicalTagId(bearing.tagId)
+            bestBearing     = bestBearings.get(physicalTagId)
+            if bestBearing is None or bearing.confidence > bestBearing.confidence:
+                bestBearings[physicalTagId] = bearing
+        return [ self.addBearing(bearing, bearing.confidence) for bearing in bestBearings.values() ]
+
+    def tagLocation(self, tagId):
+        return self._tagLocations.get(self._physicalTagId(tagId))
+
+    def clear(self):
         for detectorInfo in self:
-            detectorInfo.handleTunnelPulse(pulseInfo)
+            detectorInfo.stop()
+        super().clear()
+        self._detectorsByTagId.clear()
 
+    def getDetectorInfo(self, tagId):
+        return self._detectorsByTagId.get(tagId)
+
+    def handleTunnelPulse(self, pulseInfo):
+        detectorInfo = self._detectorsByTagId.get(pulseInfo.tag_id)
+        if detectorInfo:
+            detectorInfo.handleTunnelPulse(pulseInfo)
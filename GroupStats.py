@@ -0,0 +1,107 @@
+from Settings import *
+
+import collections
+import time
+
+# Statistics for one K group of confirmed pulses, identified by group_seq_counter
+class KGroup:
+    __slots__ = ("seqCtr", "confirmLatencySecs", "pulseCount", "missedCount", "snrSum", "snrMax", "groupSNR", "stftScoreMax", "noisePSDSum",
+                 "detectionStatus", "_indMask")
+
+    def __init__(self, seqCtr, confirmLatencySecs):
+        self.seqCtr             = seqCtr
+        self.confirmLatencySecs = confirmLatencySecs    # From the group's first report to its first confirmed pulse
+        self.pulseCount         = 0
+        self.missedCount        = 0         # Set when the group is finished
+        self.snrSum             = 0.0
+        self.snrMax             = 0.0
+        self.groupSNR           = 0.0
+        self.stftScoreMax       = 0.0
+        self.noisePSDSum        = 0.0
+        self.detectionStatus    = 0
+        self._indMask           = 0
+
+    def snrMean(self):
+        return self.snrSum / self.pulseCount if self.pulseCount else 0.0
+
+    def noisePSDMean(self):
+        return self.noisePSDSum / self.pulseCount if self.pulseCount else 0.0
+
+# O(1) per pulse aggregation of a detector's confirmed pulses into K groups, with a bounded history of finished groups.
+# The UI and the summary log read these instead of the individual pulses. Confirmation latency is measured on the
+# ground clock, from when a group was first heard (an unconfirmed report, or else its first confirmed pulse) to its
+# first confirmed pulse. Pulses are timed as they are processed, so the clock is read once per group, not per pulse.
+class GroupStats:
+    __slots__ = ("k", "current", "history", "finishedCount", "_reportSeqCtr", "_reportSecs")
+
+    def __init__(self, k):
+        self.k                  = k
+        self.current            = None
+        self.history            = collections.deque(maxlen = Settings.groupHistoryLength)
+        self.finishedCount      = 0
+        self._reportSeqCtr      = None      # Group heard through unconfirmed reports but not yet confirmed
+        self._reportSecs        = 0.0       # When that group was first heard
+
+    def addReport(self, groupSeqCtr):
+        # An unconfirmed pulse, only the time its group was first heard is kept
+        if groupSeqCtr != self._reportSeqCtr and (self.current is None or self.current.seqCtr != groupSeqCtr):
+            self._reportSeqCtr  = groupSeqCtr
+            self._reportSecs    = time.perf_counter()
+
+    def addPulse(self, pulseInfo, groupSeqCtr, snr):
+        # groupSeqCtr and snr are passed in since the caller has already read them
+        group = self.current
+        if group is None or group.seqCtr != groupSeqCtr:
+            if group is not None:
+                self._finishGroup(group)
+            confirmSecs         = time.perf_counter()
+            firstHeardSecs      = self._reportSecs if groupSeqCtr == self._reportSeqCtr else confirmSecs
+            self._reportSeqCtr  = None
+            group = self.current = KGroup(groupSeqCtr, confirmSecs - firstHeardSecs)
+        groupIndBit = 1 << pulseInfo.group_ind
+        if group._indMask & groupIndBit:
+            # Same pulse reported again
+            return
+        group._indMask      |= groupIndBit
+        group.pulseCount    += 1
+        group.snrSum        += snr
+        group.noisePSDSum   += pulseInfo.noise_psd
+        if snr > group.snrMax:
+            group.snrMax = snr
+        stftScore = pulseInfo.stft_score
+        if stftScore > group.stftScoreMax:
+            group.stftScoreMax = stftScore
+        group.groupSNR          = pulseInfo.group_snr
+        group.detectionStatus   = pulseInfo.detection_status
+
+    def _finishGroup(self, group):
+        group.missedCount = max(0, self.k - group.pulseCount)
+        self.history.append(group)
+        self.finishedCount += 1
+
+    def snrMaxHistory(self):
+        # Max SNR of the finished groups followed by the group in progress. Called from the UI thread while the
+        # processing thread adds pulses, so the history is snapshotted before it is iterated.
+        snrs    = [ group.snrMax for group in tuple(self.history) ]
+        current = self.current
+        if current is not None:
+            snrs.append(current.snrMax)
+        return snrs[-Settings.groupHistoryLength:]
+
+    def recentGroups(self, count = None):
+        # The most recent finished groups, oldest first
+        groups = list(self.history)
+        return groups if count is None else groups[max(0, len(groups) - count):]
+
+    def summary(self, groups):
+        # [ group count, missed pulse fraction, snr mean, noise psd mean, confirmation latency mean secs ] over the
+        # given groups
+        if not groups:
+            return None
+        pulseCount  = sum(group.pulseCount for group in groups)
+        missedCount = sum(group.missedCount for group in groups)
+        return [ len(groups),
+                 missedCount / ((pulseCount + missedCount) or 1),
+                 sum(group.snrSum for group in groups) / (pulseCount or 1),
+                 sum(group.noisePSDSum for group in groups) / (pulseCount or 1),
+                 sum(group.confirmLatencySecs for group in groups) / len(groups) ]
@@ -0,0 +1,63 @@
+from Settings import *
+
+import math
+
+# Streaming estimate of a detector's intra pulse interval from the start times of its confirmed pulses, O(1) memory.
+#
+# Missed pulses are handled by dividing each gap by the nearest whole number of intervals. The mean is total time
+# over total intervals, which uses every gap. The sigma is a Welford running variance over single interval gaps
+# only, because the per pulse time jitter does not shrink when a gap spans several intervals. Gaps far from the
+# current estimate (false detections, a pulse time reported twice) are rejected.
+class IntervalEstimator:
+    __slots__ = ("_nominalSecs", "_lastStartSecs", "_totalSecs", "_totalIntervals", "_varianceCount", "_varianceMean", "_varianceM2", "rejectedCount")
+
+    def __init__(self, nominalMsecs):
+        self._nominalSecs       = nominalMsecs / 1000.0
+        self._lastStartSecs     = None
+        self._totalSecs         = 0.0
+        self._totalIntervals    = 0
+        self._varianceCount     = 0
+        self._varianceMean      = 0.0
+        self._varianceM2        = 0.0
+        self.rejectedCount      = 0
+
+    def addPulse(self, startSecs):
+        if self._lastStartSecs is None:
+            self._lastStartSecs = startSecs
+            return
+        gapSecs         = startSecs - self._lastStartSecs
+        expectedSecs    = self.meanSecs()
+        intervalCount   = round(gapSecs / expectedSecs)
+        if intervalCount < 1:
+            # Same pulse reported again or out of order
+            return
+        self._lastStartSecs = startSecs
+        if intervalCount > Settings.intervalMaxMissedPulses + 1:
+            return
+        sigmaSecs       = self.sigmaSecs()
+        toleranceSecs   = expectedSecs * 0.1 if sigmaSecs is None else max(5 * sigmaSecs, Settings.intervalSigmaFloorSecs)
+        intervalSecs    = gapSecs / intervalCount
+        if abs(intervalSecs - expectedSecs) > toleranceSecs:
+            self.rejectedCount += 1
+            return
+        self._totalSecs         += gapSecs
+        self._totalIntervals    += intervalCount
+        if intervalCount == 1:
+            self._varianceCount += 1
+            delta               = gapSecs - self._varianceMean
+            self._varianceMean  += delta / self._varianceCount
+            self._varianceM2    += delta * (gapSecs - self._varianceMean)
+
+    def meanSecs(self):
+        return self._totalSecs / self._totalIntervals if self._totalIntervals else self._nominalSecs
+
+    def sigmaSecs(self):
+        if self._varianceCount < 2:
+            return None
+        return max(math.sqrt(self._varianceM2 / (self._varianceCount - 1)), Settings.intervalSigmaFloorSecs)
+
+    def sampleCount(self):
+        return self._varianceCount
+
+    def isConverged(self):
+        return self._varianceCount >= Settings.intervalMinSamples
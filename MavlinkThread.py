@@ -1,54 +1,314 @@
 from TunnelMessage import *
 from TagInfoList import *
 from CommandHandler import *
+from StateDeltaQueue import *
+from TunnelRecorder import *
+from MessageQueue import *
+from Metrics import *
 import AppGlobal
 
-import sys
+import os
 import time
 import logging
-import struct
-import queue
+import pathlib
+import selectors
 import threading
 
-from pymavlink import mavutil
+# pymavlink and its generated dialect take a noticeable time to import, so it is imported by the MavlinkThread after the
+# UI is up rather than when this module is imported
+mavutil = None
+
+def importMavlink():
+    global mavutil
+    if mavutil is None:
+        from pymavlink import mavutil as importedMavutil
+        mavutil = importedMavutil
+        AppGlobal.startupMilestone("pymavlink_imported")
+    return mavutil
+
+# One MAVLink connection to a vehicle and the CommandHandler which runs the TUNNEL protocol with its controller. The
+# link is also the CommandHandler's sender: commands are queued to the shared MavlinkSender tagged with the link.
+#
+# The connection is opened by a background thread which retries with exponential backoff, and is re-opened the same way
+# when it fails. The CommandHandler outlives the connection, so a reconnect resumes the session (tags, detectors,
+# pulses, recording) instead of starting over.
+class VehicleLink:
+    def __init__(self, vehicleId, connectionString, tagFilePath = None, recordingDirectory = None):
+        self.vehicleId          = vehicleId
+        self.connectionString   = connectionString
+        self._tagFilePath       = tagFilePath
+        self._recorder          = TunnelRecorder(recordingDirectory) if recordingDirectory else None
+        self.mavlink            = None      # None while disconnected
+        self.commandHandler     = None
+        self._sender            = None
+        self._connectionChanged = None
+        self._connectLock       = threading.Lock()
+        self._connectThread     = None
+        self._stopEvent         = threading.Event()
+        self.name               = "V{0}".format(vehicleId + 1)
+        self._connectCounter    = metrics.counter("vehicle.{0}.link.connects".format(vehicleId))
+        self._lostCounter       = metrics.counter("vehicle.{0}.link.lost".format(vehicleId))
+        metrics.gauge("vehicle.{0}.link.connected".format(vehicleId), lambda: self.mavlink is not None)
+
+    def start(self, sender, connectionChanged, processingWakeup = None):
+        # connectionChanged(link) is called from the connecting thread whenever self.mavlink changes
+        self._sender            = sender
+        self._connectionChanged = connectionChanged
+        self.commandHandler     = CommandHandler(self, self._tagFilePath, self._recorder, self.vehicleId, processingWakeup)
+        self._startConnect()
+
+    def stop(self):
+        self._stopEvent.set()
+        with self._connectLock:
+            mavlink, self.mavlink = self.mavlink, None
+        if mavlink:
+            mavlink.close()
+
+    def _startConnect(self):
+        self._connectThread = threading.Thread(target = self._connectLoop, name = "Connect" + self.name, daemon = True)
+        self._connectThread.start()
+
+    def _connectLoop(self):
+        # The vehicle's MAVLink system id is picked up from its heartbeats as they arrive, so there is no blocking
+        # wait_heartbeat here and one slow vehicle does not hold up the others
+        backoffMsecs = Settings.reconnectMinMsecs
+        while not self._stopEvent.is_set():
+            try:
+                mavlink = importMavlink().mavlink_connection(self.connectionString)
+            except Exception as exception:
+                logging.warning("Vehicle %s: connect to %s failed, retrying in %.1f secs: %s", self.name, self.connectionString, backoffMsecs / 1000.0, exception)
+                self._stopEvent.wait(backoffMsecs / 1000.0)
+                backoffMsecs = min(backoffMsecs * 2, Settings.reconnectMaxMsecs)
+                continue
+            with self._connectLock:
+                if self._stopEvent.is_set():
+                    mavlink.close()
+                    return
+                self.mavlink = mavlink
+            self._connectCounter.increment()
+            logging.info("Vehicle %s: listening on %s", self.name, self.connectionString)
+            AppGlobal.startupMilestone("link_connected")
+            self._connectionChanged(self)
+            return
+
+    def connectionLost(self, mavlink, reason):
+        # Called by the receive or send stage when I/O on mavlink fails. Only the first report for a connection
+        # counts, a reconnect is already under way for the others.
+        with self._connectLock:
+            if mavlink is not self.mavlink or self._stopEvent.is_set():
+                return
+            self.mavlink = None
+        self._lostCounter.increment()
+        logging.warning("Vehicle %s: connection lost, reconnecting: %s", self.name, reason)
+        try:
+            mavlink.close()
+        except Exception:
+            pass
+        self._connectionChanged(self)
+        self._startConnect()
+
+    def sendTunnelCommand(self, tunnelMsg):
+        self._sender.sendTunnelCommand(self, tunnelMsg)
+
+# Outbound stage. All MAVLink sends (GCS heartbeats and TUNNEL commands from any thread, for every link) go through
+# this thread, so heartbeats are sent on a fixed schedule no matter how busy reception is, and pymavlink's send side
+# is only ever used from one thread.
+class MavlinkSender(threading.Thread):
+    def __init__(self, vehicleLinks):
+        super().__init__(name = "MavlinkSender", daemon = True)
+        self._vehicleLinks      = vehicleLinks
+        self._sendQueue         = MessageQueue("send", Settings.sendQueueSize)
+        self._finished          = False
+        self._heartbeatLateness = metrics.histogram("mavlink.heartbeat_late_msecs")
+        self._sentCounter       = metrics.counter("mavlink.tunnel_sent")
+
+    def stop(self):
+        self._finished = True
+        self._sendQueue.wakeup()
+
+    def sendTunnelCommand(self, vehicleLink, tunnelMsg):
+        # Copied so the caller is free to reuse the message
+        if not self._sendQueue.put([ vehicleLink, type(tunnelMsg).from_buffer_copy(tunnelMsg) ]):
+            logging.warning("MavlinkSender: send queue full, dropped command %d for %s", tunnelMsg.hdr_command, vehicleLink.name)
+
+    def run(self):
+        nextHeartbeatTime = time.monotonic()
+        while not self._finished:
+            now = time.monotonic()
+            if now >= nextHeartbeatTime:
+                self._heartbeatLateness.record((now - nextHeartbeatTime) * 1000)
+                logging.debug("Sending heartbeat")
+                for vehicleLink in self._vehicleLinks:
+                    self._send(vehicleLink, self._sendHeartbeat)
+                nextHeartbeatTime += Settings.gcsHeartbeatMsecs / 1000.0
+                if nextHeartbeatTime < now:
+                    # Fell more than a period behind, do not send a burst to catch up
+                    nextHeartbeatTime = now + Settings.gcsHeartbeatMsecs / 1000.0
+            for vehicleLink, tunnelMsg in self._sendQueue.getBatch(Settings.maxReceiveBatch, max(nextHeartbeatTime - time.monotonic(), 0)):
+                # Commands for a disconnected link are dropped, the CommandHandler's ack timeout covers them
+                if self._send(vehicleLink, TunnelMessageHandler.sendTunnelCommand, tunnelMsg):
+                    self._sentCounter.increment()
+
+    def _send(self, vehicleLink, sendFunction, *args):
+        mavlink = vehicleLink.mavlink
+        if mavlink is None:
+            return False
+        try:
+            sendFunction(mavlink, *args)
+        except OSError as exception:
+            vehicleLink.connectionLost(mavlink, exception)
+            return False
+        return True
+
+    @staticmethod
+    def _sendHeartbeat(mavlink):
+        mavlink.mav.heartbeat_send(mavutil.mavlink.MAV_TYPE_GCS, mavutil.mavlink.MAV_AUTOPILOT_INVALID, 0, 0, 0)
+
+# Inbound stage. A single selector loop over every connected link which does nothing but pull TUNNEL messages off
+# readable links into the receive queue, so a slow processing stage shows up as receive queue depth and counted drops
+# rather than as unread socket buffers and silent UDP loss. Links come and go as they (re)connect, linkChanged wakes the
+# loop to update the selector.
+class MavlinkReceiver(threading.Thread):
+    def __init__(self, vehicleLinks, receiveQueue):
+        super().__init__(name = "MavlinkReceiver", daemon = True)
+        self._vehicleLinks      = vehicleLinks
+        self._receiveQueue      = receiveQueue
+        self._finished          = False
+        self._badDataCounter    = metrics.counter("mavlink.bad_data")
+        self._registered        = {}        # VehicleLink -> connection registered with the selector
+        self._changedLinks      = []
+        self._changedLock       = threading.Lock()
+        self._wakeupRead, self._wakeupWrite = os.pipe()
+
+    def stop(self):
+        self._finished = True
+        self.linkChanged(None)
+
+    def linkChanged(self, vehicleLink):
+        with self._changedLock:
+            self._changedLinks.append(vehicleLink)
+        os.write(self._wakeupWrite, b"x")
 
-class MavlinkThread(threading.Thread):
     def run(self):
         try:
-            self._finished = False
+            with selectors.DefaultSelector() as selector:
+                selector.register(self._wakeupRead, selectors.EVENT_READ, None)
+                while not self._finished:
+                    for selectorKey, _ in selector.select(timeout = 1):
+                        if selectorKey.data is None:
+                            os.read(self._wakeupRead, 4096)
+                            self._updateSelector(selector)
+                        else:
+                            self._drainLink(*selectorKey.data)
+        except:
+            logging.exception("Exception in MavlinkReceiver")
+            AppGlobal.requestShutdown()
+        finally:
+            os.close(self._wakeupRead)
+            os.close(self._wakeupWrite)
+
+    def _updateSelector(self, selector):
+        with self._changedLock:
+            changedLinks, self._changedLinks = self._changedLinks, []
+        for vehicleLink in changedLinks:
+            if vehicleLink is None:
+                continue
+            mavlink = self._registered.pop(vehicleLink, None)
+            if mavlink is not None:
+                # The old connection may already be closed and its fd reused, so unregister by key rather than by fd
+                for selectorKey in list(selector.get_map().values()):
+                    if selectorKey.data and selectorKey.data[1] is mavlink:
+                        selector.unregister(selectorKey.fileobj)
+            mavlink = vehicleLink.mavlink
+            if mavlink is not None:
+                try:
+                    selector.register(mavlink.fd, selectors.EVENT_READ, (vehicleLink, mavlink))
+                except (KeyError, ValueError, OSError) as exception:
+                    vehicleLink.connectionLost(mavlink, exception)
+                    continue
+                self._registered[vehicleLink] = mavlink
+
+    def _drainLink(self, vehicleLink, mavlink):
+        # Everything already readable on the link, without blocking. A read error hands the link back for reconnect.
+        if mavlink is not vehicleLink.mavlink:
+            return
+        try:
+            mavlinkTunnelMsg = mavlink.recv_match(type="TUNNEL", blocking=False)
+            while mavlinkTunnelMsg:
+                if mavlinkTunnelMsg.get_type() == "BAD_DATA":
+                    self._badDataCounter.increment()
+                else:
+                    self._receiveQueue.put([ vehicleLink, mavlinkTunnelMsg ])
+                mavlinkTunnelMsg = mavlink.recv_match(type="TUNNEL", blocking=False)
+        except (OSError, EOFError) as exception:
+            vehicleLink.connectionLost(mavlink, exception)
 
-            # create a mavlink serial instance
-            mavlink = mavutil.mavlink_connection("udpin:localhost:14550")
+# Processing stage for one or more vehicle links. Runs the receiver and sender stages and feeds received messages to
+# each link's CommandHandler in batches.
+class MavlinkThread(threading.Thread):
+    def __init__(self, connectionStrings = "udpin:localhost:14550", tagFilePaths = None, recordingDirectory = None):
+        super().__init__()
+        # Either argument may be a single value or a list with one entry per vehicle
+        if isinstance(connectionStrings, str):
+            connectionStrings = [ connectionStrings ]
+        if not isinstance(tagFilePaths, (list, tuple)):
+            tagFilePaths = [ tagFilePaths ]
+        self.vehicleLinks = []
+        for vehicleId, connectionString in enumerate(connectionStrings):
+            # A single tag file is shared by all vehicles, otherwise one per vehicle
+            tagFilePath = tagFilePaths[vehicleId] if len(tagFilePaths) > 1 else tagFilePaths[0]
+            vehicleRecordingDirectory = recordingDirectory
+            if recordingDirectory and len(connectionStrings) > 1:
+                vehicleRecordingDirectory = pathlib.Path(recordingDirectory).expanduser() / "vehicle{0}".format(vehicleId + 1)
+            self.vehicleLinks.append(VehicleLink(vehicleId, connectionString, tagFilePath, vehicleRecordingDirectory))
+        self._finished          = False
+        self._receiveQueue      = MessageQueue("receive", Settings.receiveQueueSize)
+        self._receiver          = None
+        self._sender            = None
+        self.callbackQueue      = StateDeltaQueue(Settings.callbackQueueSize)
+
+    @property
+    def commandHandler(self):
+        # First vehicle, for single vehicle users
+        return self.vehicleLinks[0].commandHandler
 
-            # wait for the heartbeat msg to find the system ID
-            mavlink.wait_heartbeat()
-            print("Heartbeat from APM (system %u component %u)" % (mavlink.target_system, mavlink.target_system))
+    def commandHandlers(self):
+        return [ vehicleLink.commandHandler for vehicleLink in self.vehicleLinks if vehicleLink.commandHandler ]
 
-            logging.info("Using Mavlink 2.0 %s", mavutil.mavlink20())
+    def run(self):
+        try:
+            logging.info("Using Mavlink 2.0 %s", importMavlink().mavlink20())
 
-            lastHeartbeatTime = 0
-            callbackQueue = queue.Queue()
-            self.commandHandler = CommandHandler(mavlink, callbackQueue)
+            batchSizes      = metrics.histogram("mavlink.process_batch")
+            self._sender    = MavlinkSender(self.vehicleLinks)
+            self._receiver  = MavlinkReceiver(self.vehicleLinks, self._receiveQueue)
+            self._sender.start()
+            self._receiver.start()
+            for vehicleLink in self.vehicleLinks:
+                vehicleLink.start(self._sender, self._receiver.linkChanged, self._receiveQueue.wakeup)
 
             while not self._finished:
-                curTime = time.time()
-                if curTime - lastHeartbeatTime > 1:
-                    logging.info("Sending heartbeat")
-                    mavlink.mav.heartbeat_send(mavutil.mavlink.MAV_TYPE_GCS, mavutil.mavlink.MAV_AUTOPILOT_INVALID, 0, 0, 0)
-                    lastHeartbeatTime = curTime
-
-                mavlinkTunnelMsg = mavlink.recv_match(type="TUNNEL", blocking=True, timeout=1)
-                if mavlinkTunnelMsg:
-                    if mavlinkTunnelMsg.get_type() == "BAD_DATA":
-                        logging.warning("recv_match: Bad data")
-                    else:
-                        self.commandHandler.processMavlinkTunnelMessage(mavlinkTunnelMsg)
-
-            self.commandHandler.stop()
+                batch = self._receiveQueue.getBatch(Settings.maxReceiveBatch, 1)
+                for vehicleLink, mavlinkTunnelMsg in batch:
+                    vehicleLink.commandHandler.processMavlinkTunnelMessage(mavlinkTunnelMsg)
+                batchSizes.record(len(batch))
+                for vehicleLink in self.vehicleLinks:
+                    vehicleLink.commandHandler.flushPulses()
+                    vehicleLink.commandHandler.runPendingCalls()
         except:
             logging.exception("Exception in MavlinkThread")
-            self.commandHandler.stop()
-            AppGlobal.app.after(100, AppGlobal.app.shutdown)
+            AppGlobal.requestShutdown()
+        finally:
+            for vehicleLink in self.vehicleLinks:
+                vehicleLink.stop()
+            for stage in [ self._receiver, self._sender ]:
+                if stage:
+                    stage.stop()
+                    if stage.is_alive():
+                        stage.join()
+            for commandHandler in self.commandHandlers():
+                commandHandler.stop()
 
     def stop(self):
         self._finished = True
+        self._receiveQueue.wakeup()
@@ -0,0 +1,55 @@
+from Metrics import *
+
+import collections
+import threading
+
+# Bounded FIFO between pipeline stages. put() never blocks the producer: when the queue is full the new message is
+# dropped and counted. The consumer takes messages in batches with a single lock acquisition per batch. Depth, drops
+# and the high water mark are published as metrics under "queue.<name>".
+class MessageQueue:
+    def __init__(self, name, maxSize):
+        self.name           = name
+        self._maxSize       = maxSize
+        self._condition     = threading.Condition()
+        self._messages      = collections.deque()
+        self._wakeupPending = False
+        self.putCount       = 0
+        self.droppedCount   = 0
+        self.maxDepth       = 0
+        metrics.gauge("queue.{0}.depth".format(name),       lambda: len(self._messages))
+        metrics.gauge("queue.{0}.max_depth".format(name),   lambda: self.maxDepth)
+        metrics.gauge("queue.{0}.put".format(name),         lambda: self.putCount)
+        metrics.gauge("queue.{0}.dropped".format(name),     lambda: self.droppedCount)
+
+    def __len__(self):
+        return len(self._messages)
+
+    def put(self, message):
+        # Returns False if the message was dropped
+        with self._condition:
+            self.putCount += 1
+            if len(self._messages) >= self._maxSize:
+                self.droppedCount += 1
+                return False
+            self._messages.append(message)
+            if len(self._messages) > self.maxDepth:
+                self.maxDepth = len(self._messages)
+            if len(self._messages) == 1:
+                self._condition.notify()
+            return True
+
+    def getBatch(self, maxItems, timeoutSecs = None):
+        # Waits up to timeoutSecs for at least one message, returns an empty list on timeout
+        with self._condition:
+            if not self._messages and not self._wakeupPending:
+                self._condition.wait(timeoutSecs)
+            self._wakeupPending = False
+            itemCount = min(maxItems, len(self._messages))
+            return [ self._messages.popleft() for _ in range(itemCount) ]
+
+    def wakeup(self):
+        # Releases a consumer waiting in getBatch, or makes its next getBatch return at once if it is not waiting yet.
+        # Used on shutdown and when the consumer has other work queued.
+        with self._condition:
+            self._wakeupPending = True
+            self._condition.notify_all()
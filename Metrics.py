@@ -0,0 +1,183 @@
+from Settings import *
+
+import json
+import logging
+import math
+import os
+import pathlib
+import threading
+import time
+
+# Runtime counters, gauges and latency histograms. Each metric is normally updated from a single thread and updates
+# take no lock, a snapshot taken from another thread may be a few updates behind but is never blocked by or blocks
+# the receive path.
+class Counter:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def increment(self, count = 1):
+        self.value += count
+
+    def snapshot(self):
+        return self.value
+
+class Gauge:
+    # Value is read from a callable when the snapshot is taken, nothing is done on the hot path
+    __slots__ = ("_valueFunction",)
+
+    def __init__(self, valueFunction):
+        self._valueFunction = valueFunction
+
+    def snapshot(self):
+        try:
+            return self._valueFunction()
+        except Exception:
+            return None
+
+class Histogram:
+    # Power of two buckets: bucket i counts values in [2^(i-1-_scaleBits), 2^(i-_scaleBits)), so recording is a
+    # multiply, a bit_length and an index. Percentiles are reported as bucket upper bounds, good to within a factor of two.
+    _scaleBits      = 10        # Smallest bucket is ~1 usec when recording msecs
+    _scale          = 1 << _scaleBits
+    _bucketCount    = 32
+
+    __slots__ = ("count", "total", "maximum", "_buckets")
+
+    def __init__(self):
+        self.count      = 0
+        self.total      = 0.0
+        self.maximum    = 0.0
+        self._buckets   = [ 0 ] * Histogram._bucketCount
+
+    def record(self, value):
+        self.count += 1
+        self.total += value
+        if value > self.maximum:
+            self.maximum = value
+        bucket = int(value * Histogram._scale).bit_length()
+        self._buckets[bucket if bucket < Histogram._bucketCount else Histogram._bucketCount - 1] += 1
+
+    def _percentile(self, buckets, count, percent):
+        threshold = count * percent / 100.0
+        cumulative = 0
+        for bucket, bucketCount in enumerate(buckets):
+            cumulative += bucketCount
+            if cumulative >= threshold:
+                return min(math.ldexp(1.0, bucket - Histogram._scaleBits), self.maximum)
+        return self.maximum
+
+    def snapshot(self):
+        buckets = list(self._buckets)
+        count   = sum(buckets)
+        if count == 0:
+            return { "count": 0 }
+        return {
+            "count":    count,
+            "mean":     self.total / self.count,
+            "p50":      self._percentile(buckets, count, 50),
+            "p90":      self._percentile(buckets, count, 90),
+            "p99":      self._percentile(buckets, count, 99),
+            "max":      self.maximum,
+        }
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock      = threading.Lock()     # Only taken to create metrics and take snapshots
+        self._metrics   = {}
+        self._startTime = time.monotonic()
+
+    def _metric(self, name, metricClass, *args):
+        metric = self._metrics.get(name)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.get(name)
+                if metric is None:
+                    metric = self._metrics[name] = metricClass(*args)
+        return metric
+
+    def counter(self, name):
+        return self._metric(name, Counter)
+
+    def histogram(self, name):
+        return self._metric(name, Histogram)
+
+    def gauge(self, name, valueFunction):
+        # Replaces any previous gauge of the same name, so a new CommandHandler etc. can re-register its gauges
+        with self._lock:
+            self._metrics[name] = Gauge(valueFunction)
+
+    def snapshot(self):
+        with self._lock:
+            metrics = list(self._metrics.items())
+        values = { name: metric.snapshot() for name, metric in sorted(metrics) }
+        return { "time": time.time(), "uptimeSecs": time.monotonic() - self._startTime, "metrics": values }
+
+metrics = MetricsRegistry()
+
+def _metricsRequestHandler():
+    # http.server is slow to import and only needed when the HTTP endpoint is enabled, so it is imported here
+    import http.server
+
+    class MetricsRequestHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            body = json.dumps(metrics.snapshot(), indent = 1).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return http.server.ThreadingHTTPServer, MetricsRequestHandler
+
+# Exposes the registry as a periodically rewritten JSON file and/or a JSON HTTP endpoint bound to localhost only
+class MetricsExporter:
+    def __init__(self, snapshotPath = None, httpPort = None, snapshotSecs = None):
+        self._snapshotPath  = pathlib.Path(snapshotPath).expanduser() if snapshotPath else None
+        self._snapshotSecs  = Settings.metricsSnapshotSecs if snapshotSecs is None else snapshotSecs
+        self._httpPort      = httpPort
+        self._httpServer    = None
+        self._stopEvent     = threading.Event()
+        self._snapshotThread = None
+
+    def start(self):
+        if self._httpPort:
+            serverClass, requestHandlerClass = _metricsRequestHandler()
+            self._httpServer = serverClass(("127.0.0.1", self._httpPort), requestHandlerClass)
+            self._httpServer.daemon_threads = True
+            threading.Thread(target = self._httpServer.serve_forever, name = "MetricsHTTP", daemon = True).start()
+            logging.info("Metrics available at http://127.0.0.1:%d/metrics", self._httpServer.server_address[1])
+        if self._snapshotPath:
+            self._snapshotThread = threading.Thread(target = self._snapshotLoop, name = "MetricsSnapshot", daemon = True)
+            self._snapshotThread.start()
+            logging.info("Writing metrics snapshots to %s", self._snapshotPath)
+
+    def stop(self):
+        self._stopEvent.set()
+        if self._httpServer:
+            self._httpServer.shutdown()
+            self._httpServer.server_close()
+        if self._snapshotThread:
+            self._snapshotThread.join()
+            self.writeSnapshot()
+
+    def _snapshotLoop(self):
+        while not self._stopEvent.wait(self._snapshotSecs):
+            self.writeSnapshot()
+
+    def writeSnapshot(self):
+        # Written to a temporary file and renamed so readers never see a partial snapshot
+        try:
+            self._snapshotPath.parent.mkdir(parents = True, exist_ok = True)
+            temporaryPath = self._snapshotPath.with_name(self._snapshotPath.name + ".tmp")
+            temporaryPath.write_text(json.dumps(metrics.snapshot(), indent = 1))
+            os.replace(temporaryPath, self._snapshotPath)
+        except OSError:
+            logging.exception("Unable to write metrics snapshot")
@@ -0,0 +1,168 @@
+from Settings import *
+from TunnelMessage import *
+
+import array
+import collections
+import ctypes
+import struct
+import threading
+import time
+
+# Preallocated ring buffer of pulses stored as one array per TunnelPulseInfo field. Each batch is unpacked with one
+# struct call per pulse and written to the columns as slices. A per tag index of the pulses still in the buffer keeps the
+# per tag queries proportional to the tag's own pulses rather than to the capacity.
+class PulseStore:
+    _typeCodes = {
+        ctypes.c_uint:      "I",
+        ctypes.c_ushort:    "H",
+        ctypes.c_ubyte:     "B",
+        ctypes.c_double:    "d",
+        ctypes.c_float:     "f",
+    }
+
+    # Native alignment matches the ctypes layout, so a TunnelPulseInfo unpacks in one call
+    _pulseStruct    = struct.Struct("@" + "".join(map(_typeCodes.get, [ fieldType for _, fieldType in TunnelPulseInfo._fields_ ])))
+    _fieldIndex     = { fieldName: index for index, (fieldName, _) in enumerate(TunnelPulseInfo._fields_) }
+
+    def __init__(self, capacity = Settings.pulseStoreCapacity):
+        self._capacity      = capacity
+        self._lock          = threading.Lock()
+        self._totalCount    = 0     # Number of pulses ever appended, next write slot is _totalCount % _capacity
+        self._tagCounts     = {}    # Tag id -> deque of the append counts of its pulses still in the buffer, oldest first
+        self._columns       = {}
+        for fieldName, fieldType in TunnelPulseInfo._fields_:
+            if fieldName != "hdr_command":
+                self._columns[fieldName] = array.array(self._typeCodes[fieldType], [0]) * capacity
+        self._columns["receive_time"] = array.array("d", [0]) * capacity
+        self._pulseColumns = [ (self._fieldIndex[fieldName], column) for fieldName, column in self._columns.items() if fieldName != "receive_time" ]
+
+    def __len__(self):
+        return min(self._totalCount, self._capacity)
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    @property
+    def totalCount(self):
+        return self._totalCount
+
+    def appendPulses(self, pulseInfos, receiveTime = None):
+        # Detector heartbeats (frequency_hz 0) may be stored but are left out of the per tag queries
+        if not pulseInfos:
+            return
+        if receiveTime is None:
+            receiveTime = time.time()
+        rows = [ self._pulseStruct.unpack_from(pulseInfo) for pulseInfo in pulseInfos ]
+        with self._lock:
+            firstCount  = self._totalCount + max(0, len(rows) - self._capacity)
+            rows        = rows[max(0, len(rows) - self._capacity):]
+            self._indexPulses(rows, firstCount)
+            startSlot   = firstCount % self._capacity
+            for fieldIndex, column in self._pulseColumns:
+                self._writeColumn(column, startSlot, [ row[fieldIndex] for row in rows ])
+            self._writeColumn(self._columns["receive_time"], startSlot, [ receiveTime ] * len(rows))
+            self._totalCount = firstCount + len(rows)
+
+    def _indexPulses(self, rows, firstCount):
+        # Drops the pulses about to be overwritten from the per tag index and adds the new ones. Caller must hold _lock.
+        tagIds          = self._columns["tag_id"]
+        frequencies     = self._columns["frequency_hz"]
+        for evictedCount in range(max(0, self._totalCount - self._capacity), min(self._totalCount, firstCount + len(rows) - self._capacity)):
+            slot = evictedCount % self._capacity
+            if frequencies[slot] != 0:
+                tagCounts = self._tagCounts[tagIds[slot]]
+                tagCounts.popleft()
+                if not tagCounts:
+                    del self._tagCounts[tagIds[slot]]
+        tagIdIndex      = self._fieldIndex["tag_id"]
+        frequencyIndex  = self._fieldIndex["frequency_hz"]
+        for count, row in enumerate(rows, firstCount):
+            if row[frequencyIndex] != 0:
+                tagCounts = self._tagCounts.get(row[tagIdIndex])
+                if tagCounts is None:
+                    tagCounts = self._tagCounts[row[tagIdIndex]] = collections.deque()
+                tagCounts.append(count)
+
+    def _writeColumn(self, column, startSlot, values):
+        firstLength = min(len(values), self._capacity - startSlot)
+        column[startSlot:startSlot + firstLength] = array.array(column.typecode, values[:firstLength])
+        if firstLength < len(values):
+            column[:len(values) - firstLength] = array.array(column.typecode, values[firstLength:])
+
+    def clear(self):
+        with self._lock:
+            self._totalCount = 0
+            self._tagCounts.clear()
+
+    def _slotRange(self, sinceCount = 0):
+        # Slots holding pulses in arrival order, oldest first. Caller must hold _lock.
+        firstCount = max(sinceCount, self._totalCount - self._capacity)
+        for count in range(firstCount, self._totalCount):
+            yield count % self._capacity
+
+    def _tagSlots(self, tagId):
+        # Slots holding the tag's pulses in arrival order. Caller must hold _lock.
+        return [ count % self._capacity for count in self._tagCounts.get(tagId, ()) ]
+
+    def column(self, fieldName, tagId = None):
+        with self._lock:
+            column = self._columns[fieldName]
+            if tagId is None:
+                return [ column[slot] for slot in self._slotRange() ]
+            return [ column[slot] for slot in self._tagSlots(tagId) ]
+
+    def columnSince(self, fieldName, sinceCount):
+        # Values appended after sinceCount (still in the buffer) and the count to pass in on the next call
+        with self._lock:
+            column = self._columns[fieldName]
+            return [ [ column[slot] for slot in self._slotRange(sinceCount) ], self._totalCount ]
+
+    def maxSNRByGroup(self, tagId, confirmedOnly = True):
+        with self._lock:
+            snrs        = self._columns["snr"]
+            groupSeqs   = self._columns["group_seq_counter"]
+            confirmed   = self._columns["confirmed_status"]
+            maxSNRs     = {}
+            for slot in self._tagSlots(tagId):
+                if confirmedOnly and not confirmed[slot]:
+                    continue
+                groupSeq = groupSeqs[slot]
+                snr = snrs[slot]
+                if snr > maxSNRs.get(groupSeq, float("-inf")):
+                    maxSNRs[groupSeq] = snr
+            return maxSNRs
+
+    def pulseRate(self, tagId, windowSecs = 60.0):
+        # Pulses per second over the trailing window, measured on the controller pulse clock
+        with self._lock:
+            startTimes = self._columns["start_time_seconds"]
+            tagStartTimes = [ startTimes[slot] for slot in self._tagSlots(tagId) ]
+        if len(tagStartTimes) < 2:
+            return 0.0
+        windowEnd       = max(tagStartTimes)
+        windowStart     = windowEnd - windowSecs
+        windowTimes     = [ startTime for startTime in tagStartTimes if startTime >= windowStart ]
+        if len(windowTimes) < 2:
+            return 0.0
+        span = windowEnd - min(windowTimes)
+        return (len(windowTimes) - 1) / span if span > 0 else 0.0
+
+    def noisePSDTrend(self, tagId, windowSecs = 60.0):
+        # Least squares slope of noise_psd against pulse start time (noise_psd units per second)
+        with self._lock:
+            startTimes  = self._columns["start_time_seconds"]
+            noisePSDs   = self._columns["noise_psd"]
+            samples     = [ (startTimes[slot], noisePSDs[slot]) for slot in self._tagSlots(tagId) ]
+        if not samples:
+            return 0.0
+        windowStart = max(sample[0] for sample in samples) - windowSecs
+        samples     = [ sample for sample in samples if sample[0] >= windowStart ]
+        sampleCount = len(samples)
+        if sampleCount < 2:
+            return 0.0
+        meanTime    = sum(sample[0] for sample in samples) / sampleCount
+        meanPSD     = sum(sample[1] for sample in samples) / sampleCount
+        covariance  = sum((sample[0] - meanTime) * (sample[1] - meanPSD) for sample in samples)
+        variance    = sum((sample[0] - meanTime) ** 2 for sample in samples)
+        return covariance / variance if variance > 0 else 0.0
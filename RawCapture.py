@@ -0,0 +1,316 @@
+from Settings import *
+from TunnelMessage import *
+from Timer import *
+from Metrics import *
+
+import logging
+import mmap
+import os
+import pathlib
+import threading
+import time
+
+# Pulls the controller's most recent raw capture over TUNNEL into a preallocated, memory mapped file.
+#
+# The capture is split into blocks of Settings.captureRequestChunks chunks. Up to Settings.captureWindowChunks chunks
+# are requested at a time, each chunk received is written straight into the mapped file and opens the window for
+# more. A block which is not complete within the retransmit timeout (smoothed round trip plus four times its
+# deviation, as TagUploader does) is re-requested, but only for the chunks it is still missing. Chunks arrive in
+# request order, so a block which is still missing chunks when a block requested after it completes has lost them and is
+# re-requested right away rather than holding up the window until its timeout.
+#
+# Which chunks have arrived is kept in a second mapped file next to the capture ("<capture>.chunks", one byte per
+# chunk), so a download cut off by a link drop, a failure or a restart resumes with the missing chunks only when it is
+# started again for the same capture. The chunk map is removed once the capture is complete.
+class CaptureDownloader:
+    def __init__(self, sendTunnelCommand, completeCallback, directory, vehicleId = 0):
+        self._sendTunnelCommand = sendTunnelCommand
+        self._completeCallback  = completeCallback      # completeCallback(success, path)
+        self._directory         = pathlib.Path(directory).expanduser()
+        self._vehicleId         = vehicleId
+        self._lock              = threading.RLock()
+        self._retransmitTimer   = Timer(Settings.captureTickMsecs, self._checkBlocks)
+        self._infoTimer         = Timer(Settings.tunnelCommandAckTimeoutMsecs, self._infoTimeout)
+        self._captureFile       = None
+        self._captureMap        = None
+        self._chunkMapFile      = None
+        self._chunkMap          = None
+        self._smoothedRttSecs   = None
+        self._rttVarianceSecs   = 0.0
+        self.active             = False
+        self.paused             = False
+        self.path               = None
+        self.captureId          = 0
+        self.chunkCount         = 0
+        self.receivedCount      = 0
+        self._chunksCounter     = metrics.counter("vehicle.{0}.capture.chunks".format(vehicleId))
+        self._duplicateCounter  = metrics.counter("vehicle.{0}.capture.duplicate_chunks".format(vehicleId))
+        self._retransmitCounter = metrics.counter("vehicle.{0}.capture.retransmit_requests".format(vehicleId))
+        metrics.gauge("vehicle.{0}.capture.progress".format(vehicleId), lambda: self.receivedCount / self.chunkCount if self.chunkCount else 0.0)
+
+    def start(self, staleCaptureId = None):
+        # Asks the controller for its most recent capture, the download starts when the info arrives. Info for
+        # staleCaptureId is asked for again until the controller reports a newer capture.
+        with self._lock:
+            if self.active:
+                return
+            self.active         = True
+            self.paused         = False
+            self._infoRetries   = 0
+            self._staleCaptureId = staleCaptureId
+            self._sendInfoRequest()
+
+    def requestInfo(self):
+        # Learns the id of the controller's most recent capture without downloading it
+        with self._lock:
+            if not self.active:
+                self._sendRequest(0, 0, 0)
+
+    def stop(self):
+        with self._lock:
+            self._close()
+
+    def pause(self):
+        # Link or controller lost: stop requesting, the chunk map keeps what has arrived
+        with self._lock:
+            if self.active and not self.paused:
+                logging.info("Capture download paused at %d/%d chunks", self.receivedCount, self.chunkCount)
+                self.paused = True
+
+    def resume(self):
+        with self._lock:
+            if not self.active or not self.paused:
+                return
+            logging.info("Capture download resumed at %d/%d chunks", self.receivedCount, self.chunkCount)
+            self.paused = False
+            if self._captureMap is None:
+                self._infoRetries = 0
+                self._sendInfoRequest()
+            else:
+                # Everything in flight when the link dropped is presumed lost, which does not count as a retry
+                self._retransmitBlocks(True)
+
+    def progress(self):
+        return [ self.receivedCount, self.chunkCount ]
+
+    def _sendInfoRequest(self):
+        self._sendRequest(0, 0, 0)
+        self._infoTimer.start()
+
+    def _infoTimeout(self):
+        with self._lock:
+            if not self.active or self._captureMap is not None or self.paused:
+                return
+            self._infoRetries += 1
+            if self._infoRetries > Settings.tunnelCommandMaxRetries:
+                logging.warning("Capture download failed - no capture info from vehicle")
+                self._finish(False)
+                return
+            self._sendInfoRequest()
+
+    def _sendRequest(self, captureId, firstChunk, chunkCount):
+        request = TunnelCaptureRequest()
+        request.hdr_command = TunnelCommand.COMMAND_ID_CAPTURE_REQUEST
+        request.capture_id  = captureId
+        request.first_chunk = firstChunk
+        request.chunk_count = chunkCount
+        self._sendTunnelCommand(request)
+
+    def handleInfo(self, info):
+        with self._lock:
+            if not self.active:
+                self.captureId = info.capture_id
+                return
+            if self._captureMap is not None:
+                return
+            if info.capture_id == self._staleCaptureId:
+                # Not replaced by the new capture yet, the info timer asks again
+                logging.info("Capture download: controller still reports the previous capture %d", info.capture_id)
+                return
+            self._infoTimer.stop()
+            if info.capture_id == 0 or info.total_bytes == 0:
+                logging.warning("Capture download: the controller has no capture")
+                self._finish(False)
+                return
+            if info.chunk_size == 0 or info.chunk_size > captureChunkDataSize:
+                logging.warning("Capture download: unsupported chunk size %d", info.chunk_size)
+                self._finish(False)
+                return
+            self.captureId      = info.capture_id
+            self._chunkSize     = info.chunk_size
+            self._totalBytes    = info.total_bytes
+            self.chunkCount     = (info.total_bytes + info.chunk_size - 1) // info.chunk_size
+            self._openFiles(info)
+            # Blocks in flight: block index -> [ send time, chunks still missing, retransmit count ]
+            self._blocks        = {}
+            self._inFlight      = 0
+            self._nextBlock     = 0
+            self._blockCount    = (self.chunkCount + Settings.captureRequestChunks - 1) // Settings.captureRequestChunks
+            self._startTime     = time.monotonic()
+            self._startReceived = self.receivedCount
+            logging.info("Capture download: id %d %d bytes %d chunks, %d already received, to %s",
+                         self.captureId, self._totalBytes, self.chunkCount, self.receivedCount, self.path)
+            self._fillWindow()
+            self._retransmitTimer.start()
+
+    def _openFiles(self, info):
+        self._directory.mkdir(parents = True, exist_ok = True)
+        self.path       = self._directory / "capture-v{0}-{1}-{2}hz.iq".format(self._vehicleId + 1, info.capture_id, info.center_frequency_hz)
+        chunkMapPath    = pathlib.Path(str(self.path) + ".chunks")
+        # A complete capture has no chunk map, an existing one of the right size is a download to resume
+        resuming = self.path.exists() and chunkMapPath.exists() and self.path.stat().st_size == self._totalBytes and chunkMapPath.stat().st_size == self.chunkCount
+        self._captureFile   = open(self.path, "r+b" if resuming else "w+b")
+        self._chunkMapFile  = open(chunkMapPath, "r+b" if resuming else "w+b")
+        if not resuming:
+            self._captureFile.truncate(self._totalBytes)
+            self._chunkMapFile.truncate(self.chunkCount)
+        self._captureMap    = mmap.mmap(self._captureFile.fileno(), self._totalBytes)
+        self._chunkMap      = mmap.mmap(self._chunkMapFile.fileno(), self.chunkCount)
+        self.receivedCount  = self.chunkCount - self._chunkMap[:].count(0) if resuming else 0
+
+    def handleChunk(self, chunk, payloadBytes):
+        # payloadBytes is the raw TUNNEL payload chunk was decoded from, data is copied from it without going through
+        # the ctypes array
+        with self._lock:
+            if self._captureMap is None or chunk.capture_id != self.captureId:
+                return
+            chunkIndex = chunk.chunk_index
+            if chunkIndex >= self.chunkCount:
+                return
+            if self._chunkMap[chunkIndex]:
+                self._duplicateCounter.increment()
+                return
+            offset      = chunkIndex * self._chunkSize
+            dataLength  = min(chunk.data_length, self._chunkSize, self._totalBytes - offset)
+            dataOffset  = TunnelCaptureChunk.data.offset
+            self._captureMap[offset:offset + dataLength] = payloadBytes[dataOffset:dataOffset + dataLength]
+            self._chunkMap[chunkIndex] = 1
+            self.receivedCount += 1
+            self._chunksCounter.increment()
+            block = self._blocks.get(chunkIndex // Settings.captureRequestChunks)
+            if block is not None:
+                block[1]        -= 1
+                self._inFlight  -= 1
+                if block[1] == 0:
+                    del self._blocks[chunkIndex // Settings.captureRequestChunks]
+                    if block[2] == 0:
+                        self._updateRtt(time.monotonic() - block[0])
+                    if not self.paused:
+                        self._retransmitBlocksBefore(block[0])
+            if self.receivedCount == self.chunkCount:
+                self._finish(True)
+            elif not self.paused:
+                self._fillWindow()
+
+    def _missingRuns(self, blockIndex):
+        # [ first chunk, chunk count ] runs of chunks not yet received in a block
+        runs        = []
+        firstChunk  = blockIndex * Settings.captureRequestChunks
+        lastChunk   = min(firstChunk + Settings.captureRequestChunks, self.chunkCount)
+        runStart    = None
+        for chunkIndex in range(firstChunk, lastChunk):
+            if self._chunkMap[chunkIndex]:
+                if runStart is not None:
+                    runs.append([ runStart, chunkIndex - runStart ])
+                    runStart = None
+            elif runStart is None:
+                runStart = chunkIndex
+        if runStart is not None:
+            runs.append([ runStart, lastChunk - runStart ])
+        return runs
+
+    def _requestBlock(self, blockIndex, retransmitCount):
+        runs = self._missingRuns(blockIndex)
+        missingCount = sum(runCount for _, runCount in runs)
+        if missingCount == 0:
+            return 0
+        for firstChunk, chunkCount in runs:
+            self._sendRequest(self.captureId, firstChunk, chunkCount)
+        self._blocks[blockIndex] = [ time.monotonic(), missingCount, retransmitCount ]
+        return missingCount
+
+    def _fillWindow(self):
+        while self._nextBlock < self._blockCount and self._inFlight < Settings.captureWindowChunks:
+            self._inFlight  += self._requestBlock(self._nextBlock, 0)
+            self._nextBlock += 1
+
+    def _retransmitTimeoutSecs(self, retransmitCount):
+        # Doubles with each retransmit of a block
+        if self._smoothedRttSecs is None:
+            baseMsecs = Settings.tunnelCommandAckTimeoutMsecs
+        else:
+            baseMsecs = max(int((self._smoothedRttSecs + 4 * self._rttVarianceSecs) * 1000), Settings.tunnelCommandMinAckTimeoutMsecs)
+        return min(baseMsecs << retransmitCount, Settings.tunnelCommandMaxAckTimeoutMsecs) / 1000.0
+
+    def _updateRtt(self, rttSecs):
+        if self._smoothedRttSecs is None:
+            self._smoothedRttSecs = rttSecs
+            self._rttVarianceSecs = rttSecs / 2
+        else:
+            self._rttVarianceSecs = 0.75 * self._rttVarianceSecs + 0.25 * abs(self._smoothedRttSecs - rttSecs)
+            self._smoothedRttSecs = 0.875 * self._smoothedRttSecs + 0.125 * rttSecs
+
+    def _checkBlocks(self):
+        with self._lock:
+            if self._captureMap is None:
+                return
+            if not self.paused:
+                self._retransmitBlocks(False)
+            if self._captureMap is not None:
+                self._retransmitTimer.start()
+
+    def _retransmitBlocksBefore(self, sendTime):
+        for blockIndex, block in list(self._blocks.items()):
+            if block[0] < sendTime:
+                self._inFlight -= block[1]
+                del self._blocks[blockIndex]
+                self._retransmitCounter.increment()
+                self._inFlight += self._requestBlock(blockIndex, block[2] + 1)
+
+    def _retransmitBlocks(self, expireAll):
+        # Re-requests the missing chunks of blocks which timed out (or of all blocks in flight), oldest first
+        now = time.monotonic()
+        for blockIndex, block in sorted(self._blocks.items()):
+            sendTime, missingCount, retransmitCount = block
+            if not expireAll:
+                if now - sendTime < self._retransmitTimeoutSecs(retransmitCount):
+                    continue
+                retransmitCount += 1
+                if retransmitCount > Settings.tunnelCommandMaxRetries:
+                    logging.warning("Capture download: no response for chunks %d+ after %d retries", blockIndex * Settings.captureRequestChunks, Settings.tunnelCommandMaxRetries)
+                    self._finish(False)
+                    return
+            self._inFlight -= missingCount
+            del self._blocks[blockIndex]
+            self._retransmitCounter.increment()
+            self._inFlight += self._requestBlock(blockIndex, retransmitCount)
+        self._fillWindow()
+
+    def _close(self):
+        self._retransmitTimer.stop()
+        self._infoTimer.stop()
+        for mapped in [ self._captureMap, self._chunkMap ]:
+            if mapped is not None:
+                mapped.flush()
+                mapped.close()
+        for openFile in [ self._captureFile, self._chunkMapFile ]:
+            if openFile is not None:
+                openFile.close()
+        self._captureMap    = None
+        self._chunkMap      = None
+        self._captureFile   = None
+        self._chunkMapFile  = None
+        self.active         = False
+
+    def _finish(self, success):
+        chunkMapPath = pathlib.Path(str(self.path) + ".chunks") if self.path else None
+        self._close()
+        if success:
+            os.unlink(chunkMapPath)
+            elapsedSecs = time.monotonic() - self._startTime
+            downloadedBytes = (self.receivedCount - self._startReceived) * self._chunkSize
+            logging.info("Capture download complete: %s %d bytes in %.2f secs, %.0f KB/s",
+                         self.path, self._totalBytes, elapsedSecs, downloadedBytes / 1024 / max(elapsedSecs, 1e-6))
+        else:
+            logging.warning("Capture download stopped at %d/%d chunks", self.receivedCount, self.chunkCount)
+        self._completeCallback(success, self.path)
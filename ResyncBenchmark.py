@@ -0,0 +1,83 @@
+from VehicleSimulator import *
+from MavlinkThread import *
+from Scheduler import *
+import AppGlobal
+
+import argparse
+import logging
+import os
+import statistics
+import tempfile
+import time
+
+# Reboots a simulated controller repeatedly under a headless pyTracker and reports how long it takes to get back to
+# detecting each time: from the controller's first heartbeat after the reboot to detection running again, as seen by
+# the simulator, along with pyTracker's own vehicle.0.resync metrics.
+class ResyncBenchmark:
+    def __init__(self, reboots, rebootSecs, port, timeoutSecs):
+        self._reboots       = reboots
+        self._timeoutSecs   = timeoutSecs
+        self._tagFilePath   = self._writeTagFile()
+        self._simulator     = VehicleSimulator("udpout:localhost:{0}".format(port), rebootSecs = rebootSecs)
+        self._mavlinkThread = MavlinkThread("udpin:localhost:{0}".format(port), self._tagFilePath)
+        self.recoverySecs   = []
+
+    def _writeTagFile(self):
+        tagFile = tempfile.NamedTemporaryFile("w", suffix = ".txt", delete = False)
+        tagFile.write("2,resync,146000000,1000,-,0,-,15,60,5\n")
+        tagFile.close()
+        return tagFile.name
+
+    def run(self):
+        AppGlobal.scheduler = Scheduler()
+        AppGlobal.scheduler.start()
+        self._simulator.start()
+        self._mavlinkThread.start()
+        try:
+            if not self._waitForDetecting():
+                print("pyTracker did not start detection")
+                return
+            for rebootIndex in range(self._reboots):
+                # Let pyTracker see a few detecting heartbeats before the next reboot
+                time.sleep(3)
+                self._simulator.reboot()
+                while not self._simulator.rebooting():
+                    time.sleep(0.01)
+                while self._simulator.rebooting():
+                    time.sleep(0.01)
+                if not self._waitForDetecting():
+                    print("reboot {0}: not recovered in {1:.0f} secs".format(rebootIndex + 1, self._timeoutSecs))
+                    continue
+                self.recoverySecs.append(time.time() - self._simulator.bootTime)
+                print("reboot {0}: detecting again {1:.0f} ms after the controller came back".format(rebootIndex + 1, self.recoverySecs[-1] * 1000))
+            if self.recoverySecs:
+                print("recovery ms median:max {0:.0f} {1:.0f}".format(statistics.median(self.recoverySecs) * 1000, max(self.recoverySecs) * 1000))
+            snapshot = metrics.snapshot()["metrics"]
+            print("resync.count", snapshot.get("vehicle.0.resync.count"), " resync.recovery_msecs", snapshot.get("vehicle.0.resync.recovery_msecs"))
+        finally:
+            self._mavlinkThread.stop()
+            self._mavlinkThread.join()
+            self._simulator.stop()
+            AppGlobal.scheduler.stop()
+            os.unlink(self._tagFilePath)
+
+    def _waitForDetecting(self):
+        deadline = time.time() + self._timeoutSecs
+        while time.time() < deadline:
+            if self._simulator.status == HeartbeatStatus.HEARTBEAT_STATUS_DETECTING:
+                return True
+            time.sleep(0.01)
+        return False
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Controller reboot recovery benchmark against a simulated vehicle")
+    parser.add_argument("--reboots",        type = int,     default = 5)
+    parser.add_argument("--reboot-secs",    type = float,   default = 3.0,      help = "how long each controller reboot takes")
+    parser.add_argument("--port",           type = int,     default = 14650)
+    parser.add_argument("--timeout",        type = float,   default = 30.0,     help = "seconds to wait for detection after each reboot")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='[%(levelname)s] %(message)s |  %(filename)s:%(lineno)d')
+    with tempfile.TemporaryDirectory() as directory:
+        Settings.tagCacheDirectory = directory
+        ResyncBenchmark(args.reboots, args.reboot_secs, args.port, args.timeout).run()
@@ -0,0 +1,63 @@
+from DetectorInfoList import *
+from TagInfoList import *
+from TunnelMessage import *
+from Scheduler import *
+import AppGlobal
+
+import argparse
+import pathlib
+import tempfile
+import time
+
+# Per pulse cost of routing a confirmed pulse to its detector and looking up its tag, as CommandHandler does for every
+# PULSE, against the number of tags loaded. Tags are loaded from a generated tag file so the lookups use the same
+# indexes as a real tag upload. Every tag has two pulse rates, so there are two detectors per tag.
+def writeTagFile(directory, tagCount):
+    tagFilePath = pathlib.Path(directory) / "TagInfo.txt"
+    with open(tagFilePath, "w") as tagFile:
+        for tagIndex in range(tagCount):
+            tagId = 2 + tagIndex * 2
+            tagFile.write("{0},bench{0},{1},1000,-,1200,-,15,60,5\n".format(tagId, 146000000 + tagIndex * 100))
+    return tagFilePath
+
+def makePulses(tagCount, pulseCount):
+    pulses = []
+    for pulseIndex in range(pulseCount):
+        pulseInfo = TunnelPulseInfo()
+        pulseInfo.hdr_command       = TunnelCommand.COMMAND_ID_PULSE
+        pulseInfo.tag_id            = 2 + 2 * (pulseIndex % tagCount)
+        pulseInfo.frequency_hz      = 146000000
+        pulseInfo.confirmed_status  = 1
+        pulseInfo.snr               = 10.0
+        pulseInfo.group_seq_counter = pulseIndex // Settings.k
+        pulses.append(pulseInfo)
+    return pulses
+
+def runBenchmark(tagCount, pulseCount, directory):
+    tagInfoList = TagInfoList(writeTagFile(directory, tagCount))
+    tagInfoList.loadTags()
+    detectorInfoList = DetectorInfoList()
+    detectorInfoList.populateFromTags(tagInfoList)
+
+    pulses = makePulses(tagCount, pulseCount)
+    startTime = time.perf_counter()
+    for pulseInfo in pulses:
+        detectorInfoList.handleTunnelPulse(pulseInfo)
+        tagInfoList.getTagInfo(pulseInfo.tag_id)
+    pulseUsecs = (time.perf_counter() - startTime) / len(pulses) * 1e6
+    print("tags {0:4d}  detectors {1:4d}  usecs/pulse {2:.2f}".format(len(tagInfoList), len(detectorInfoList), pulseUsecs))
+    detectorInfoList.clear()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Pulse to detector and tag routing cost against tag count")
+    parser.add_argument("--tags",   default = "1,10,100,500",  help = "comma separated tag counts")
+    parser.add_argument("--pulses", type = int, default = 20000)
+    args = parser.parse_args()
+
+    AppGlobal.scheduler = Scheduler()
+    AppGlobal.scheduler.start()
+    with tempfile.TemporaryDirectory() as directory:
+        Settings.tagCacheDirectory = directory
+        for tagCount in args.tags.split(","):
+            runBenchmark(int(tagCount), args.pulses, directory)
+    AppGlobal.scheduler.stop()
@@ -0,0 +1,75 @@
+from Settings import *
+from Timer import *
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+# Scheduler running on its own thread so the core does not depend on the Tk main loop. One-off callbacks are kept in
+# a heap, core Timers live in a TimerWheel which is advanced on a fixed tick. Callbacks run on the scheduler thread.
+class Scheduler(threading.Thread):
+    def __init__(self):
+        super().__init__(name = "Scheduler", daemon = True)
+        self._condition = threading.Condition()
+        self._queue     = []                    # Heap of [deadline, sequence, callback, args]
+        self._sequence  = itertools.count()
+        self._finished  = False
+        self.timerWheel = TimerWheel(Settings.timerWheelTickMsecs, Settings.timerWheelSlots)
+        self.after(Settings.timerWheelTickMsecs, self._tickTimerWheel)
+
+    def after(self, msecs, callback, *args):
+        entry = [ time.monotonic() + msecs / 1000.0, next(self._sequence), callback, args ]
+        with self._condition:
+            heapq.heappush(self._queue, entry)
+            if self._queue[0] is entry:
+                self._condition.notify()
+        return entry
+
+    def callSoon(self, callback, *args):
+        return self.after(0, callback, *args)
+
+    @staticmethod
+    def cancel(entry):
+        # Cancelled entries stay in the heap and are skipped when they come due
+        entry[2] = None
+
+    def _tickTimerWheel(self):
+        for timer in self.timerWheel.advance(time.monotonic()):
+            try:
+                timer.fire()
+            except:
+                logging.exception("Exception in timer callback")
+        self.after(Settings.timerWheelTickMsecs, self._tickTimerWheel)
+
+    def stop(self):
+        with self._condition:
+            self._finished = True
+            self._condition.notify()
+
+    def run(self):
+        while True:
+            with self._condition:
+                while not self._finished:
+                    if not self._queue:
+                        self._condition.wait()
+                        continue
+                    delaySecs = self._queue[0][0] - time.monotonic()
+                    if delaySecs <= 0:
+                        break
+                    self._condition.wait(delaySecs)
+                if self._finished:
+                    return
+                now = time.monotonic()
+                dueEntries = []
+                while self._queue and self._queue[0][0] <= now:
+                    dueEntries.append(heapq.heappop(self._queue))
+
+            for entry in dueEntries:
+                callback = entry[2]
+                if callback is not None:
+                    try:
+                        callback(*entry[3])
+                    except:
+                        logging.exception("Exception in scheduled callback")
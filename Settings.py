@@ -1,4 +1,40 @@
 class Settings:
     k                       = 3
     falseAlarmProbability   = 1     # 1 percent
-    maxPulse                = 70
\ No newline at end of file
+    maxPulse                = 70
+    pulseStoreCapacity      = 100000    # Number of pulses kept in memory
+    maxReceiveBatch         = 100       # Max number of TUNNEL messages processed per receive batch
+    tagUploadWindowSize             = 8         # Max number of tags in flight during tag upload
+    tunnelCommandAckTimeoutMsecs    = 2000      # Ack timeout until a round trip time has been measured
+    tunnelCommandMinAckTimeoutMsecs = 500
+    tunnelCommandMaxAckTimeoutMsecs = 8000
+    tunnelCommandMaxRetries         = 5
+    callbackQueueSize               = 1000      # Max number of undelivered UI state deltas
+    uiTickMsecs                     = 100       # UI drains state deltas at this interval
+    groupHistoryLength              = 32        # Finished K groups kept per detector, also the detector sparkline length
+    groupSummaryLength              = 8         # Recent K groups summarized in the detector UI
+    detectorRowsPerColumn           = 25
+    timerWheelTickMsecs             = 50        # Resolution of core timers
+    timerWheelSlots                 = 512
+    recordingDirectory              = "~/pyTrackerRecordings"
+    captureDirectory                = "~/pyTrackerCaptures"
+    captureRequestChunks            = 16        # Raw capture chunks per request block, also the retransmit unit
+    captureWindowChunks             = 256       # Max raw capture chunks requested and not yet received
+    captureTickMsecs                = 100       # Raw capture download retransmit check interval
+    bearingUpdateMsecs              = 1000      # Provisional bearing update interval while rotating
+    pulseSummaryLogSecs             = 10        # Interval of the per tag pulse summary log lines
+    minBearingConfidence            = 0.3       # Bearings below this are not used for tag localization
+    metricsSnapshotSecs             = 5         # Interval of the metrics JSON snapshot file
+    metricsHttpPort                 = 0         # Local metrics endpoint port, 0 for none
+    tagCacheDirectory               = "~/.cache/pyTracker"      # Compiled tag file caches
+    tagFilePollMsecs                = 2000      # Tag file change check interval
+    receiveQueueSize                = 10000     # TUNNEL messages waiting for processing before new ones are dropped
+    sendQueueSize                   = 1000      # TUNNEL commands waiting to be sent
+    gcsHeartbeatMsecs               = 1000
+    reconnectMinMsecs               = 500       # First retry delay after a failed or lost vehicle connection
+    reconnectMaxMsecs               = 30000     # Retry delay doubles up to this
+    resyncMismatchHeartbeats        = 2         # Consecutive controller heartbeats out of step before resyncing
+    intervalMinSamples              = 20        # Single interval gaps needed before an intra pulse estimate is used
+    intervalMaxMissedPulses         = 4         # Longer gaps between pulses are not used for the intra pulse estimate
+    intervalSigmaFloorSecs          = 0.002     # Lower bound for the intra pulse sigma sent to the controller
+    intervalPushMsecs               = 60000     # How often converged intra pulse estimates are checked for upload
@@ -0,0 +1,86 @@
+from VehicleSimulator import *
+
+import argparse
+import os
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+# Launches pyTracker against an in-process VehicleSimulator and reports how long each startup milestone takes:
+# first_frame (UI drawn), pymavlink_imported, link_connected, first_heartbeat (controller heartbeat received) and
+# detecting (START_DETECTION acked). Times are from the first pyTracker module import, as logged by
+# AppGlobal.startupMilestone, plus the process launch to first frame/heartbeat wall time which includes interpreter start.
+class StartupBenchmark:
+    _milestonePattern   = re.compile(r"Startup (\w+) (\d+) msecs")
+    _milestones         = [ "first_frame", "pymavlink_imported", "link_connected", "first_heartbeat", "detecting" ]
+
+    def __init__(self, runs, port, headless, timeoutSecs):
+        self._runs          = runs
+        self._port          = port
+        self._headless      = headless
+        self._timeoutSecs   = timeoutSecs
+        self._tagFilePath   = self._writeTagFile()
+        self._tagCacheDir   = tempfile.mkdtemp()
+        self.results        = []
+
+    def _writeTagFile(self):
+        tagFile = tempfile.NamedTemporaryFile("w", suffix = ".txt", delete = False)
+        tagFile.write("2,startup,146000000,1000,-,0,-,15,60,5\n")
+        tagFile.close()
+        return tagFile.name
+
+    def run(self):
+        for runIndex in range(self._runs):
+            result = self._runOnce(self._port + runIndex)
+            self.results.append(result)
+            print("run {0}: {1}".format(runIndex + 1, "  ".join("{0} {1:.0f}".format(name, msecs) for name, msecs in result.items())))
+        os.unlink(self._tagFilePath)
+        shutil.rmtree(self._tagCacheDir)
+        print("median:", "  ".join("{0} {1:.0f}".format(name, statistics.median(result[name] for result in self.results if name in result))
+                                  for name in self._milestones + [ "launch_to_first_heartbeat" ] if any(name in result for result in self.results)))
+
+    def _runOnce(self, port):
+        # A fresh simulator per run, on its own port, so every run starts from an idle controller
+        simulator   = VehicleSimulator("udpout:localhost:{0}".format(port))
+        simulator.start()
+        command     = [ sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "pyTracker.py"),
+                        "--connection", "udpin:localhost:{0}".format(port), "--tag-file", self._tagFilePath,
+                        "--tag-cache-dir", self._tagCacheDir, "--no-record" ]
+        if self._headless:
+            command.append("--headless")
+        launchTime  = time.perf_counter()
+        process     = subprocess.Popen(command, stderr = subprocess.PIPE, text = True)
+        killTimer   = threading.Timer(self._timeoutSecs, process.kill)
+        killTimer.start()
+        result      = {}
+        try:
+            for line in process.stderr:
+                match = self._milestonePattern.search(line)
+                if match is None:
+                    continue
+                result[match.group(1)] = float(match.group(2))
+                if match.group(1) == "first_heartbeat":
+                    result["launch_to_first_heartbeat"] = (time.perf_counter() - launchTime) * 1000
+                if "detecting" in result:
+                    break
+        finally:
+            killTimer.cancel()
+            process.terminate()
+            process.wait()
+            simulator.stop()
+        return result
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "pyTracker startup time benchmark against a simulated vehicle")
+    parser.add_argument("--runs",       type = int,     default = 5)
+    parser.add_argument("--port",       type = int,     default = 14600)
+    parser.add_argument("--headless",   action = "store_true",  help = "benchmark the headless startup, there is no first_frame")
+    parser.add_argument("--timeout",    type = float,   default = 30.0,     help = "seconds to wait for detection to start in each run")
+    args = parser.parse_args()
+
+    StartupBenchmark(args.runs, args.port, args.headless, args.timeout).run()
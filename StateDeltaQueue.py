@@ -0,0 +1,54 @@
+from enum import IntEnum
+
+import collections
+import threading
+
+class StateDelta(IntEnum):
+    CONTROLLER_HEARTBEAT    = 1     # CommandHandler.controllerLostHeartbeat changed, key is the vehicle id
+    DETECTOR_LIST           = 2     # Detectors were added or removed, key is the vehicle id
+    DETECTOR                = 3     # State of a single detector changed, key is DetectorInfo.key (vehicle id, tag id)
+    FULL_REFRESH            = 4     # Deltas were dropped, consumer must refresh everything
+
+# Bounded, non-blocking hand off of state deltas from core threads to a consumer (the UI) which drains it in batches.
+# Deltas already waiting in the queue are coalesced, so the backlog is bounded by the number of distinct deltas.
+# If the queue still fills up new deltas are dropped and the next drain reports a FULL_REFRESH instead.
+class StateDeltaQueue:
+    def __init__(self, maxSize):
+        self._maxSize       = maxSize
+        self._lock          = threading.Lock()
+        self._deltas        = collections.deque()
+        self._pending       = set()
+        self._overflowed    = False
+        self.putCount       = 0
+        self.coalescedCount = 0
+        self.droppedCount   = 0
+        self.maxBacklog     = 0
+
+    def __len__(self):
+        return len(self._deltas)
+
+    def put(self, delta, key = None):
+        with self._lock:
+            self.putCount += 1
+            item = (delta, key)
+            if item in self._pending:
+                self.coalescedCount += 1
+            elif len(self._deltas) >= self._maxSize:
+                self.droppedCount += 1
+                self._overflowed = True
+            else:
+                self._deltas.append(item)
+                self._pending.add(item)
+                self.maxBacklog = max(self.maxBacklog, len(self._deltas))
+
+    def drain(self, maxItems = None):
+        with self._lock:
+            if self._overflowed:
+                self._overflowed = False
+                self._deltas.clear()
+                self._pending.clear()
+                return [ (StateDelta.FULL_REFRESH, None) ]
+            itemCount = len(self._deltas) if maxItems is None else min(maxItems, len(self._deltas))
+            items = [ self._deltas.popleft() for _ in range(itemCount) ]
+            self._pending.difference_update(items)
+            return items
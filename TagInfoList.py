@@ -2,152 +2,289 @@ from Settings import *
 from TunnelMessage import *
 
 import csv
+import ctypes
+import hashlib
 import logging
+import os
 import pathlib
+import struct
 
 class ExtendedTagInfo:
-    def __init__(self):
-        self._nChannels = 100
-        self.tagInfo        = TunnelTagInfo()
+    __slots__ = ("tagInfo", "name", "ip_msecs_1_id", "ip_msecs_2_id")
+
+    def __init__(self, tagInfo = None):
+        self.tagInfo        = TunnelTagInfo() if tagInfo is None else tagInfo
         self.name           = "<undefined>"
         self.ip_msecs_1_id  = "<undefined>"
         self.ip_msecs_2_id  = "<undefined>"
-        self._radioCenterHz = 0
+
+    def contentBytes(self):
+        # Everything sent to or shown for the tag, used to detect changed tags on reload
+        return bytes(self.tagInfo) + "\0".join([ self.name, self.ip_msecs_1_id, self.ip_msecs_2_id ]).encode()
+
+class TagFileError(ValueError):
+    def __init__(self, errors):
+        super().__init__("TagInfoList: {0} errors in tag file\n  {1}".format(len(errors), "\n  ".join(errors)))
+        self.errors = errors
+
+class TagSetDiff:
+    # Difference between two tag sets by tag id. A tag whose upload content changed, including its channelizer
+    # assignment after retuning, counts as changed.
+    def __init__(self, previousTags, currentTags):
+        previousById    = { extTagInfo.tagInfo.id: extTagInfo for extTagInfo in previousTags }
+        currentById     = { extTagInfo.tagInfo.id: extTagInfo for extTagInfo in currentTags }
+        self.added      = [ extTagInfo for tagId, extTagInfo in currentById.items() if tagId not in previousById ]
+        self.removed    = [ extTagInfo for tagId, extTagInfo in previousById.items() if tagId not in currentById ]
+        self.changed    = []
+        self.unchanged  = []
+        for tagId, extTagInfo in currentById.items():
+            previousTagInfo = previousById.get(tagId)
+            if previousTagInfo is not None:
+                if previousTagInfo.contentBytes() == extTagInfo.contentBytes():
+                    self.unchanged.append(extTagInfo)
+                else:
+                    self.changed.append(extTagInfo)
+
+    def hasChanges(self):
+        return bool(self.added or self.removed or self.changed)
+
+    def __str__(self):
+        return "added:removed:changed:unchanged {0} {1} {2} {3}".format(len(self.added), len(self.removed), len(self.changed), len(self.unchanged))
+
+# Compiled binary copy of a parsed tag file, so startup is a single read instead of a parse. Keyed on the tag file
+# mtime and size, falling back to its SHA-256 when those differ (e.g. the file was touched or copied but not edited),
+# and on the Settings values baked into the tags.
+#
+# Layout: header, an array of raw TunnelTagInfo, then the name, ip_msecs_1_id and ip_msecs_2_id of each tag as a
+# single NUL separated UTF-8 block.
+class TagCache:
+    _headerStruct   = struct.Struct("<4sIqq32sIdI")
+    _magic          = b"PTTC"
+    _version        = 1
+    _tagInfoSize    = ctypes.sizeof(TunnelTagInfo)
+
+    def __init__(self, tagFilePath):
+        tagFilePath     = pathlib.Path(tagFilePath).resolve()
+        pathHash        = hashlib.sha1(str(tagFilePath).encode()).hexdigest()[:16]
+        self._tagFilePath   = tagFilePath
+        self.cachePath      = pathlib.Path(Settings.tagCacheDirectory).expanduser() / "{0}-{1}.tagcache".format(tagFilePath.stem, pathHash)
+
+    def _settingsKey(self):
+        return [ Settings.k, Settings.falseAlarmProbability ]
+
+    def load(self, tagFileStat):
+        # Returns the cached tags, or None if there is no valid cache for the current tag file
+        try:
+            cacheBytes = self.cachePath.read_bytes()
+        except OSError:
+            return None
+        if len(cacheBytes) < self._headerStruct.size:
+            return None
+        magic, version, mtimeNs, size, sourceHash, k, falseAlarmProbability, tagCount = self._headerStruct.unpack_from(cacheBytes)
+        if magic != self._magic or version != self._version or [ k, falseAlarmProbability ] != self._settingsKey():
+            return None
+        if mtimeNs != tagFileStat.st_mtime_ns or size != tagFileStat.st_size:
+            tagFileBytes = self._tagFilePath.read_bytes()
+            if hashlib.sha256(tagFileBytes).digest() != sourceHash:
+                return None
+            self._writeHeader(cacheBytes, tagFileStat, sourceHash, tagCount)
+        try:
+            return self._decodeTags(cacheBytes, tagCount)
+        except ValueError:
+            logging.warning("TagCache: %s is corrupt, reparsing tag file", self.cachePath)
+            return None
+
+    def _decodeTags(self, cacheBytes, tagCount):
+        stringsOffset   = self._headerStruct.size + tagCount * self._tagInfoSize
+        tagInfos        = (TunnelTagInfo * tagCount).from_buffer_copy(cacheBytes, self._headerStruct.size)
+        strings         = cacheBytes[stringsOffset:].decode().split("\0")
+        if len(strings) != tagCount * 3:
+            raise ValueError("TagCache: string count mismatch")
+        tags = []
+        for index, tagInfo in enumerate(tagInfos):
+            extTagInfo = ExtendedTagInfo(tagInfo)
+            extTagInfo.name, extTagInfo.ip_msecs_1_id, extTagInfo.ip_msecs_2_id = strings[index * 3:index * 3 + 3]
+            tags.append(extTagInfo)
+        return tags
+
+    def _writeHeader(self, cacheBytes, tagFileStat, sourceHash, tagCount):
+        # Same content, new mtime: rewrite the header so the next load does not need to hash the tag file again
+        self._write(self._header(tagFileStat, sourceHash, tagCount) + cacheBytes[self._headerStruct.size:])
+
+    def _header(self, tagFileStat, sourceHash, tagCount):
+        k, falseAlarmProbability = self._settingsKey()
+        return self._headerStruct.pack(self._magic, self._version, tagFileStat.st_mtime_ns, tagFileStat.st_size, sourceHash, k, falseAlarmProbability, tagCount)
+
+    def save(self, tags, tagFileStat, tagFileBytes):
+        cacheBytes = bytearray(self._header(tagFileStat, hashlib.sha256(tagFileBytes).digest(), len(tags)))
+        for extTagInfo in tags:
+            cacheBytes += bytes(extTagInfo.tagInfo)
+        strings = []
+        for extTagInfo in tags:
+            strings.extend([ extTagInfo.name, extTagInfo.ip_msecs_1_id, extTagInfo.ip_msecs_2_id ])
+        cacheBytes += "\0".join(strings).encode()
+        self._write(bytes(cacheBytes))
+
+    def _write(self, cacheBytes):
+        # A cache which can not be written only costs a reparse next time
+        try:
+            self.cachePath.parent.mkdir(parents = True, exist_ok = True)
+            temporaryPath = self.cachePath.with_name(self.cachePath.name + ".tmp")
+            temporaryPath.write_bytes(cacheBytes)
+            os.replace(temporaryPath, self.cachePath)
+        except OSError as error:
+            logging.warning("TagCache: unable to write %s: %s", self.cachePath, error)
+
+class TuningGroup:
+    def __init__(self, radioCenterHz, tags):
+        self.radioCenterHz  = radioCenterHz
+        self.tags           = tags
 
 class TagInfoList(list):
-    def __init__(self):
+    def __init__(self, tagFilePath = None):
+        super().__init__()
+        self._tagFilePath   = tagFilePath
         self._nChannels     = 100
         self._radioCenterHz = 0
-    
+        self._tagInfoById   = {}
+        self._tagFileMtimeNs = None
+        self.tuningGroups   = []
+
     def checkForTagFile(self):
         tagFilename = self._tagInfoFilePath()
-        tagFile     = open(tagFilename)
-        if not tagFile:
-            raise FileNotFoundError("TagInfo.txt does not exist")
-        
+        if not tagFilename.is_file():
+            raise FileNotFoundError("TagInfoList: {0} does not exist".format(tagFilename))
+
     def isEmpty(self):
         return len(self) == 0
 
+    def clear(self):
+        super().clear()
+        self._tagInfoById.clear()
+
     def loadTags(self):
+        # Loads from the compiled cache when the tag file is unchanged, otherwise parses the tag file and recompiles
+        # the cache. Returns a TagSetDiff against the previously loaded tags.
+        previousTags = list(self)
         self.clear()
         self._setupTunerVars()
 
-        tagFilename = self._tagInfoFilePath()
-
-        lineCount               = 0
-        lineFormat              = "id, name, freq_hz, ip_msecs_1, ip_msecs_1_id, ip_msecs_2, ip_msecs_2_id, pulse_width_msecs, ip_uncertainty_msecs, ip_jitter_msecs"
-        expectedValueCount      = len(lineFormat.split(","))
+        tagFilename     = self._tagInfoFilePath()
+        tagFileStat     = tagFilename.stat()
+        tagCache        = TagCache(tagFilename)
+        tags            = tagCache.load(tagFileStat)
+        if tags is None:
+            tagFileBytes    = tagFilename.read_bytes()
+            tags            = self._parseTags(tagFileBytes.decode())
+            tagCache.save(tags, tagFileStat, tagFileBytes)
+        self._tagFileMtimeNs = tagFileStat.st_mtime_ns
+
+        for extTagInfo in tags:
+            self.append(extTagInfo)
+            self._tagInfoById[extTagInfo.tagInfo.id] = extTagInfo
+
+        if not self._channelizerTuner():
+            raise ValueError("TagInfoList: Unable to tune channelizer")
+        return TagSetDiff(previousTags, self)
+
+    def tagFileChanged(self):
+        try:
+            return self._tagInfoFilePath().stat().st_mtime_ns != self._tagFileMtimeNs
+        except FileNotFoundError:
+            return False
+
+    def reloadIfChanged(self):
+        # Returns a new TagInfoList loaded from the tag file if it changed since this list was loaded, None otherwise.
+        # This list is left as it is, other threads may be using it, the caller swaps in the new one. A tag file with
+        # errors is reported once and the current tags are kept.
+        if not self.tagFileChanged():
+            return None
+        tagInfoList = TagInfoList(self._tagFilePath)
+        try:
+            tagInfoList.loadTags()
+        except ValueError as error:
+            logging.warning("%s", error)
+            self._tagFileMtimeNs = self._tagInfoFilePath().stat().st_mtime_ns
+            return None
+        return tagInfoList
+
+    # Tag file columns: [ name, tagInfo field or None for ExtendedTagInfo string fields, zero allowed ]
+    _tagFileColumns = [
+        [ "id",                     "id",                               False ],
+        [ "name",                   None,                               True ],
+        [ "freq_hz",                "frequency_hz",                     True ],
+        [ "ip_msecs_1",             "intra_pulse1_msecs",               False ],
+        [ "ip_msecs_1_id",          None,                               True ],
+        [ "ip_msecs_2",             "intra_pulse2_msecs",               True ],
+        [ "ip_msecs_2_id",          None,                               True ],
+        [ "pulse_width_msecs",      "pulse_width_msecs",                False ],
+        [ "ip_uncertainty_msecs",   "intra_pulse_uncertainty_msecs",    False ],
+        [ "ip_jitter_msecs",        "intra_pulse_jitter_msecs",         False ],
+    ]
+
+    def _parseTags(self, tagFileText):
+        # All errors in the file are collected and reported together in a single TagFileError
         k                       = Settings.k
         falseAlarmProbability   = Settings.falseAlarmProbability / 100.0
-
-        with open(tagFilename) as tagFile:
-            for tagLine in tagFile:
-                lineCount += 1
-
-                if tagLine.startswith("#"):
-                    continue
-                if len(tagLine) == 0:
+        expectedValueCount      = len(self._tagFileColumns)
+        tags                    = []
+        tagIds                  = set()
+        errors                  = []
+
+        for lineCount, tagLine in enumerate(tagFileText.splitlines(), 1):
+            if tagLine.startswith("#") or len(tagLine.strip()) == 0:
+                continue
+
+            tagValues = [ tagValue.strip() for tagValue in tagLine.split(",") ]
+            if len(tagValues) != expectedValueCount:
+                errors.append("Line #{0} Does not contain {1} values".format(lineCount, expectedValueCount))
+                continue
+
+            extTagInfo = ExtendedTagInfo()
+            extTagInfo.tagInfo.hdr_command = TunnelCommand.COMMAND_ID_TAG
+            lineErrorCount = len(errors)
+            for [ columnName, fieldName, zeroAllowed ], tagValueString in zip(self._tagFileColumns, tagValues):
+                if fieldName is None:
                     continue
-
-                tagValues = tagLine.split(",")
-                if len(tagValues) != expectedValueCount:
-                    raise Exception("TagInfoList: Line #{0} Does not contain {1} values".format(lineCount, expectedValueCount))
-
-                extTagInfo = ExtendedTagInfo()
-
-                tagValuePosition = 0
-
-                extTagInfo.tagInfo.hdr_command = TunnelCommand.COMMAND_ID_TAG
-
-                tagValueString          = tagValues[tagValuePosition]
-                tagValuePosition        += 1
-                try:
-                    extTagInfo.tagInfo.id   = int(tagValueString)
-                except ValueError:
-                    raise ValueError("TagInfoList: Line #{0} Value:'{1}'. Unable to convert id to int.".format(lineCount, tagValueString))
-                if extTagInfo.tagInfo.id <= 1:
-                    raise ValueError("TagInfoList: Line #{0} Value:'{1}'. Tag ids must be greater than 1".format(lineCount, tagValueString))
-                if extTagInfo.tagInfo.id % 2:
-                    raise ValueError("TagInfoList: Line #{0} Value:'{1}'. Tag ids must be even numbers".format(lineCount, tagValueString))
-
-                extTagInfo.name     = tagValues[tagValuePosition]
-                tagValuePosition    += 1
-                if len(extTagInfo.name) == 0:
-                    extTagInfo.name = str(extTagInfo.tagInfo.id)
-
-                tagValueString      = tagValues[tagValuePosition]
-                tagValuePosition    += 1
-                try:
-                    extTagInfo.tagInfo.frequency_hz = int(tagValueString)
-                except ValueError:
-                    raise ValueError("TagInfoList: Line #{0} Value:'{1}'. Unable to convert freq_hz to uint.".format(lineCount, tagValueString))
-
-                tagValueString      = tagValues[tagValuePosition]
-                tagValuePosition    += 1
                 try:
-                    extTagInfo.tagInfo.intra_pulse1_msecs = int(tagValueString)
+                    tagValue = int(tagValueString)
+                    if tagValue < 0:
+                        raise ValueError
                 except ValueError:
-                    raise ValueError("TagInfoList: Line #{0} Value:'{1}'. Unable to convert ip_msecs_1 to uint.".format(lineCount, tagValueString))
-                if extTagInfo.tagInfo.intra_pulse1_msecs == 0:
-                    raise ValueError("TagInfoList: Line #{0} Value:'{1}'. ip_msecs_1 value cannot be 0".format(lineCount, tagValueString))
-
-                extTagInfo.ip_msecs_1_id    = tagValues[tagValuePosition]
-                tagValuePosition            += 1
-                if len(extTagInfo.ip_msecs_1_id) == 0:
-                    extTagInfo.ip_msecs_1_id = "-"
-
-                tagValueString      = tagValues[tagValuePosition]
-                tagValuePosition    += 1
-                try:
-                    extTagInfo.tagInfo.intra_pulse2_msecs  = int(tagValueString)
-                except ValueError:
-                    raise ValueError("TagInfoList: Line #{0} Value:'{1}'. Unable to convert ip_msecs_2 to uint.".format(lineCount, tagValueString))
-
-                extTagInfo.ip_msecs_2_id    = tagValues[tagValuePosition]
-                tagValuePosition            += 1
-                if len(extTagInfo.ip_msecs_2_id) == 0:
-                    extTagInfo.ip_msecs_2_id = "-"
-
-                tagValueString      = tagValues[tagValuePosition]
-                tagValuePosition    += 1
-                try:
-                    extTagInfo.tagInfo.pulse_width_msecs = int(tagValueString)
-                except ValueError:
-                    raise ValueError("TagInfoList: Line #{0} Value:'{1}'. Unable to convert pulse_width_msecs to uint.".format(lineCount, tagValueString))
-                if extTagInfo.tagInfo.pulse_width_msecs == 0:
-                    raise ValueError("TagInfoList: Line #{0} Value:'{1}'. pulse_width_msecs value cannot be 0".format(lineCount, tagValueString))
-
-                tagValueString      = tagValues[tagValuePosition]
-                tagValuePosition    += 1
-                try:
-                    extTagInfo.tagInfo.ip_uncertainty_msecs = int(tagValueString)
-                except ValueError:
-                    raise ValueError("TagInfoList: Line #{0} Value:'{1}'. Unable to convert ip_uncertainty_msecs to uint.".format(lineCount, tagValueString))
-                if extTagInfo.tagInfo.ip_uncertainty_msecs == 0:
-                    raise ValueError("TagInfoList: Line #{0} Value:'{1}'. ip_uncertainty_msecs value cannot be 0".format(lineCount, tagValueString))
-
-                tagValueString      = tagValues[tagValuePosition]
-                tagValuePosition    += 1
-                try:
-                    extTagInfo.tagInfo.intra_pulse_jitter_msecs = int(tagValueString)
-                except ValueError:
-                    raise ValueError("TagInfoList: Line #{0} Value:'{1}'. Unable to convert ip_jitter_msecs to uint.".format(lineCount, tagValueString))
-                if extTagInfo.tagInfo.intra_pulse_jitter_msecs == 0:
-                    raise ValueError("TagInfoList: Line #{0} Value:'{1}'. ip_jitter_msecs value cannot be 0".format(lineCount, tagValueString))
-
-                extTagInfo.tagInfo.k                        = k
-                extTagInfo.tagInfo.false_alarm_probability  = falseAlarmProbability
-
-                self.append(extTagInfo)
-
-            if not self._channelizerTuner():
-                raise ValueError("TagInfoList: Unable to tune channelizer")
+                    errors.append("Line #{0} Value:'{1}'. Unable to convert {2} to uint.".format(lineCount, tagValueString, columnName))
+                    continue
+                if tagValue == 0 and not zeroAllowed:
+                    errors.append("Line #{0} Value:'{1}'. {2} value cannot be 0".format(lineCount, tagValueString, columnName))
+                    continue
+                setattr(extTagInfo.tagInfo, fieldName, tagValue)
+            if len(errors) != lineErrorCount:
+                continue
+
+            tagId = extTagInfo.tagInfo.id
+            if tagId <= 1:
+                errors.append("Line #{0} Value:'{1}'. Tag ids must be greater than 1".format(lineCount, tagId))
+                continue
+            if tagId % 2:
+                errors.append("Line #{0} Value:'{1}'. Tag ids must be even numbers".format(lineCount, tagId))
+                continue
+            if tagId in tagIds:
+                errors.append("Line #{0} Value:'{1}'. Duplicate tag id".format(lineCount, tagId))
+                continue
+            tagIds.add(tagId)
+
+            extTagInfo.name                             = tagValues[1] or str(tagId)
+            extTagInfo.ip_msecs_1_id                    = tagValues[4] or "-"
+            extTagInfo.ip_msecs_2_id                    = tagValues[6] or "-"
+            extTagInfo.tagInfo.k                        = k
+            extTagInfo.tagInfo.false_alarm_probability  = falseAlarmProbability
+            tags.append(extTagInfo)
+
+        if errors:
+            raise TagFileError(errors)
+        return tags
 
     def getTagInfo(self, id):
-        for tagInfo in self:
-            if tagInfo.tagInfo.id == id:
-                return tagInfo
-        return None
+        return self._tagInfoById.get(id)
 
     def _setupTunerVars(self):
         self._sampleRateHz       = 3750000                      # Hardwired to mini
@@ -157,17 +294,71 @@ class TagInfoList(list):
         self._halfChannelBwHz    = self._channelBwHz / 2
 
     def _channelizerTuner(self):
-        if len(self) != 1:
-            raise Exception("_channelizerTuner called with 0 or more than 1 tags")
-        self._radioCenterHz = self[0].tagInfo.frequency_hz
-        self[0].tagInfo.channelizer_channel_number               = 1
-        self[0].tagInfo.channelizer_channel_center_frequency_hz  = 146000000
+        if self.isEmpty():
+            return False
+        self.tuningGroups   = self.planTuningGroups(self)
+        self._radioCenterHz = self.tuningGroups[0].radioCenterHz
+        unfitTags = self.unfitTags()
+        if unfitTags:
+            logging.warning("TagInfoList: %d tags do not fit in the %d Hz band centered at %d Hz, %d tuning groups required. Unfit tag ids: %s",
+                            len(unfitTags), self._fullBwHz, self._radioCenterHz, len(self.tuningGroups),
+                            " ".join(str(extTagInfo.tagInfo.id) for extTagInfo in unfitTags))
         return True
 
+    def planTuningGroups(self, tags):
+        # Split the tags into the fewest radio tunings which cover them. Greedy sweep over the sorted
+        # frequencies is optimal for covering points with fixed width intervals. Largest group first.
+        usableBwHz      = self._fullBwHz - self._channelBwHz
+        sortedTags      = sorted(tags, key=lambda extTagInfo: extTagInfo.tagInfo.frequency_hz)
+        tuningGroups    = []
+        groupTags       = []
+        for extTagInfo in sortedTags:
+            if groupTags and extTagInfo.tagInfo.frequency_hz - groupTags[0].tagInfo.frequency_hz > usableBwHz:
+                tuningGroups.append(self._tuneGroup(groupTags))
+                groupTags = []
+            groupTags.append(extTagInfo)
+        if groupTags:
+            tuningGroups.append(self._tuneGroup(groupTags))
+        tuningGroups.sort(key=lambda tuningGroup: -len(tuningGroup.tags))
+        return tuningGroups
+
+    def _tuneGroup(self, groupTags):
+        # Offset by half a channel so the middle of the group lands on a channel center rather than a channel edge
+        radioCenterHz   = round((groupTags[0].tagInfo.frequency_hz + groupTags[-1].tagInfo.frequency_hz) / 2 + self._halfChannelBwHz)
+        firstChannelHz  = self._firstChannelFreqHz(radioCenterHz)
+        bandStartHz     = radioCenterHz - self._halfBwHz
+        for extTagInfo in groupTags:
+            channelNumber = int((extTagInfo.tagInfo.frequency_hz - bandStartHz) // self._channelBwHz) + 1
+            channelNumber = min(max(channelNumber, 1), self._nChannels)
+            extTagInfo.tagInfo.channelizer_channel_number               = channelNumber
+            extTagInfo.tagInfo.channelizer_channel_center_frequency_hz  = round(firstChannelHz + channelNumber * self._channelBwHz)
+        return TuningGroup(radioCenterHz, groupTags)
+
+    def activeTuningGroup(self):
+        # The largest group is the one uploaded
+        return self.tuningGroups[0] if self.tuningGroups else None
+
+    def activeTags(self):
+        # Tags covered by the active tuning group, in tag file order
+        tuningGroup = self.activeTuningGroup()
+        if tuningGroup is None:
+            return []
+        activeIds = set(extTagInfo.tagInfo.id for extTagInfo in tuningGroup.tags)
+        return [ extTagInfo for extTagInfo in self if extTagInfo.tagInfo.id in activeIds ]
+
+    def unfitTags(self):
+        tuningGroup = self.activeTuningGroup()
+        if tuningGroup is None:
+            return []
+        activeIds = set(extTagInfo.tagInfo.id for extTagInfo in tuningGroup.tags)
+        return [ extTagInfo for extTagInfo in self if extTagInfo.tagInfo.id not in activeIds ]
+
     def _firstChannelFreqHz(self, centerFreqHz):
         return centerFreqHz - self._halfBwHz - self._halfChannelBwHz;
 
     def _tagInfoFilePath(self):
+        if self._tagFilePath:
+            return pathlib.Path(self._tagFilePath)
         return pathlib.Path.home() / "TagInfo.txt"
 
     def maxIntraPulseMsecs(self):
@@ -0,0 +1,55 @@
+import math
+
+# Least squares tag location from bearings taken at different vehicle positions. Each bearing is a line through the
+# vehicle position and the estimate is the point minimizing the confidence weighted squared distance to all lines.
+# Only the 2x2 normal equations are accumulated, so adding a bearing is O(1) no matter how long the survey runs.
+class TagLocation:
+    def __init__(self, tagId):
+        self.tagId              = tagId
+        self.observationCount   = 0
+        self._a11               = 0.0   # Sum of w * n * n^T, n the unit normal of each bearing line
+        self._a12               = 0.0
+        self._a22               = 0.0
+        self._b1                = 0.0   # Sum of w * n * (n . p)
+        self._b2                = 0.0
+        self._c                 = 0.0   # Sum of w * (n . p)^2, for the residual
+        self._weightSum         = 0.0
+        self.positionX          = None
+        self.positionY          = None
+        self.errorRadius        = None  # 1 sigma radius of the error ellipse major axis, None until known
+
+    def addBearing(self, positionX, positionY, bearingDegrees, weight = 1.0):
+        bearingRadians = math.radians(bearingDegrees)
+        # Bearing direction is (cos, sin) in north/east coordinates, so the line normal is (-sin, cos)
+        normalX     = -math.sin(bearingRadians)
+        normalY     = math.cos(bearingRadians)
+        offset      = normalX * positionX + normalY * positionY
+        self._a11   += weight * normalX * normalX
+        self._a12   += weight * normalX * normalY
+        self._a22   += weight * normalY * normalY
+        self._b1    += weight * normalX * offset
+        self._b2    += weight * normalY * offset
+        self._c     += weight * offset * offset
+        self._weightSum += weight
+        self.observationCount += 1
+        self._solve()
+
+    def _solve(self):
+        determinant = self._a11 * self._a22 - self._a12 * self._a12
+        # Needs at least two bearings which are not (nearly) parallel
+        if self.observationCount < 2 or determinant < 1e-6 * self._weightSum * self._weightSum:
+            return
+        self.positionX = (self._a22 * self._b1 - self._a12 * self._b2) / determinant
+        self.positionY = (self._a11 * self._b2 - self._a12 * self._b1) / determinant
+        if self.observationCount > 2:
+            residual = (self._a11 * self.positionX * self.positionX + 2 * self._a12 * self.positionX * self.positionY + self._a22 * self.positionY * self.positionY
+                        - 2 * (self.positionX * self._b1 + self.positionY * self._b2) + self._c)
+            # Weights are relative, so the scale of the distance noise comes from the residual. The covariance is
+            # variance * A^-1, whose largest eigenvalue is variance over the smallest eigenvalue of A.
+            variance = max(residual, 0.0) / (self.observationCount - 2)
+            trace = self._a11 + self._a22
+            smallestEigenvalue = trace / 2 - math.sqrt(max(trace * trace / 4 - determinant, 0.0))
+            self.errorRadius = math.sqrt(variance / smallestEigenvalue) if smallestEigenvalue > 0 else None
+
+    def isValid(self):
+        return self.positionX is not None
@@ -0,0 +1,166 @@
+from Settings import *
+from TunnelMessage import *
+from Timer import *
+from Metrics import *
+
+import logging
+import threading
+import time
+
+# Windowed tag upload: START_TAGS, then up to Settings.tagUploadWindowSize TAG messages in flight, then END_TAGS.
+#
+# TUNNEL acks only carry the command id, so acks for TAG messages are matched to the outstanding tags in send
+# order. When a tag or its ack is lost there is no way to tell which tag the controller is missing, so a timeout
+# during the tag phase restarts the sequence from START_TAGS (which clears the controller tag set). START_TAGS and
+# END_TAGS timeouts just retransmit. The ack timeout adapts to the measured round trip time (smoothed RTT plus four
+# times its deviation, as TCP does) and doubles on each retry up to tunnelCommandMaxAckTimeoutMsecs.
+class TagUploader:
+    def __init__(self, sendTunnelCommand, completeCallback):
+        self._sendTunnelCommand = sendTunnelCommand
+        self._completeCallback  = completeCallback
+        self._lock              = threading.RLock()
+        self._ackTimer          = Timer(Settings.tunnelCommandAckTimeoutMsecs, self._ackTimeout)
+        self._tagMessages       = []
+        self._pendingCommand    = None      # START_TAGS/END_TAGS awaiting ack, None during tag phase
+        self._nextTagToSend     = 0
+        self._tagsAcked         = 0
+        self._retryCount        = 0
+        self._sendTimes         = {}        # Tag index or pending command -> send time, only for first transmissions
+        self._smoothedRttSecs   = None
+        self._rttVarianceSecs   = 0.0
+        self.active             = False
+        self.retransmitCount    = 0
+        self.restartCount       = 0
+        self.durationSecs       = 0.0
+
+    def stop(self):
+        with self._lock:
+            self.active = False
+            self._ackTimer.stop()
+
+    def start(self, tagsToSend, sdrType):
+        with self._lock:
+            self._tagMessages       = [ extTagInfo.tagInfo for extTagInfo in tagsToSend ]
+            self._sdrType           = sdrType
+            self._retryCount        = 0
+            self.retransmitCount    = 0
+            self.restartCount       = 0
+            self._startTime         = time.monotonic()
+            self.active             = True
+            self._sendStartTags()
+
+    def progress(self):
+        return [ self._tagsAcked, len(self._tagMessages) ]
+
+    def handleAck(self, ack):
+        # Returns True if the ack belongs to the upload sequence
+        with self._lock:
+            if not self.active:
+                return False
+            if self._pendingCommand is not None:
+                if ack.command != self._pendingCommand:
+                    return ack.command == TunnelCommand.COMMAND_ID_TAG
+            elif ack.command != TunnelCommand.COMMAND_ID_TAG or self._tagsAcked == self._nextTagToSend:
+                return ack.command in (TunnelCommand.COMMAND_ID_START_TAGS, TunnelCommand.COMMAND_ID_TAG, TunnelCommand.COMMAND_ID_END_TAGS)
+
+            if ack.result != CommandResult.COMMAND_RESULT_SUCCESS:
+                logging.warning("Tag upload failed - command %d rejected by controller", ack.command)
+                self._finish(False)
+                return True
+
+            self._retryCount = 0
+            self._updateRtt(self._sendTimes.pop(self._pendingCommand if self._pendingCommand is not None else self._tagsAcked, None))
+            if ack.command == TunnelCommand.COMMAND_ID_START_TAGS:
+                self._pendingCommand = None
+                self._sendTagWindow()
+            elif ack.command == TunnelCommand.COMMAND_ID_TAG:
+                self._tagsAcked += 1
+                logging.debug("Tag upload progress %d/%d", self._tagsAcked, len(self._tagMessages))
+                self._sendTagWindow()
+            else:
+                self._finish(True)
+            return True
+
+    def _sendStartTags(self):
+        self._sendTimes.clear()
+        self._nextTagToSend = 0
+        self._tagsAcked     = 0
+        startTags = TunnelStartTags()
+        startTags.hdr_command   = TunnelCommand.COMMAND_ID_START_TAGS
+        startTags.sdr_type      = self._sdrType
+        self._sendPendingCommand(startTags)
+
+    def _sendEndTags(self):
+        endTags = TunnelEndTags()
+        endTags.hdr_command = TunnelCommand.COMMAND_ID_END_TAGS
+        self._sendPendingCommand(endTags)
+
+    def _sendPendingCommand(self, tunnelMsg, retransmit = False):
+        self._pendingCommand = tunnelMsg.hdr_command
+        self._pendingMessage = tunnelMsg
+        if retransmit:
+            self._sendTimes.pop(self._pendingCommand, None)
+        else:
+            self._sendTimes[self._pendingCommand] = time.monotonic()
+        self._sendTunnelCommand(tunnelMsg)
+        self._ackTimer.start(self._ackTimeoutMsecs())
+
+    def _sendTagWindow(self):
+        if self._tagsAcked == len(self._tagMessages):
+            self._sendEndTags()
+            return
+        while self._nextTagToSend < len(self._tagMessages) and self._nextTagToSend - self._tagsAcked < Settings.tagUploadWindowSize:
+            self._sendTimes[self._nextTagToSend] = time.monotonic()
+            self._sendTunnelCommand(self._tagMessages[self._nextTagToSend])
+            self._nextTagToSend += 1
+        # Ack timer always tracks the oldest outstanding tag
+        self._ackTimer.start(self._ackTimeoutMsecs())
+
+    def _updateRtt(self, sendTime):
+        # Only acks for first transmissions are sampled, an ack for a retransmitted message is ambiguous
+        if sendTime is None:
+            return
+        rttSecs = time.monotonic() - sendTime
+        metrics.histogram("tunnel.ack_rtt_msecs").record(rttSecs * 1000)
+        if self._smoothedRttSecs is None:
+            self._smoothedRttSecs = rttSecs
+            self._rttVarianceSecs = rttSecs / 2
+        else:
+            self._rttVarianceSecs = 0.75 * self._rttVarianceSecs + 0.25 * abs(self._smoothedRttSecs - rttSecs)
+            self._smoothedRttSecs = 0.875 * self._smoothedRttSecs + 0.125 * rttSecs
+
+    def _ackTimeoutMsecs(self):
+        if self._smoothedRttSecs is None:
+            baseMsecs = Settings.tunnelCommandAckTimeoutMsecs
+        else:
+            baseMsecs = max(int((self._smoothedRttSecs + 4 * self._rttVarianceSecs) * 1000), Settings.tunnelCommandMinAckTimeoutMsecs)
+        return min(baseMsecs << self._retryCount, Settings.tunnelCommandMaxAckTimeoutMsecs)
+
+    def _ackTimeout(self):
+        with self._lock:
+            if not self.active:
+                return
+            self._retryCount += 1
+            if self._retryCount > Settings.tunnelCommandMaxRetries:
+                logging.warning("Tag upload failed - no response from vehicle after %d retries", Settings.tunnelCommandMaxRetries)
+                self._finish(False)
+            elif self._pendingCommand is not None:
+                logging.info("Tag upload: ack timeout, retransmitting command %d", self._pendingCommand)
+                self.retransmitCount += 1
+                metrics.counter("tag_upload.retransmits").increment()
+                self._sendPendingCommand(self._pendingMessage, retransmit = True)
+            else:
+                logging.info("Tag upload: ack timeout with %d/%d tags acked, restarting upload", self._tagsAcked, len(self._tagMessages))
+                self.restartCount += 1
+                metrics.counter("tag_upload.restarts").increment()
+                self._sendStartTags()
+
+    def _finish(self, success):
+        self.active         = False
+        self.durationSecs   = time.monotonic() - self._startTime
+        self._ackTimer.stop()
+        metrics.histogram("tag_upload.duration_msecs").record(self.durationSecs * 1000)
+        metrics.counter("tag_upload.complete" if success else "tag_upload.failed").increment()
+        logging.info("Tag upload %s: %d tags in %.2f secs, retransmits:restarts %d %d",
+                     "complete" if success else "failed", len(self._tagMessages), self.durationSecs, self.retransmitCount, self.restartCount)
+        self._completeCallback(success)
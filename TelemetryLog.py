@@ -0,0 +1,116 @@
+from Settings import *
+
+import atexit
+import logging
+import logging.handlers
+import queue
+import time
+
+# Periodic one line summary per tag. Pulse quality figures come from the detectors' K group statistics and the pulse
+# rate and noise trend from the pulse store rather than from the individual pulses, only the pulse and heartbeat counts
+# are kept here. Per pulse records are only logged
+# at DEBUG, at INFO the log volume is a function of the tag count rather than the pulse rate.
+class PulseSummaryLog:
+    class _TagSummary:
+        __slots__ = ("pulseCount", "confirmedCount", "heartbeatCount")
+
+        def __init__(self):
+            self.pulseCount     = 0
+            self.confirmedCount = 0
+            self.heartbeatCount = 0
+
+    def __init__(self, detectorInfoList = None, intervalSecs = None, pulseStore = None):
+        self._detectorInfoList      = detectorInfoList
+        self._pulseStore            = pulseStore
+        self._intervalSecs          = Settings.pulseSummaryLogSecs if intervalSecs is None else intervalSecs
+        self._summaries             = {}
+        self._loggedGroupCounts     = {}    # Tag id -> [ GroupStats, its finishedCount at the previous summary ]
+        self._lastFlushTime         = time.monotonic()
+
+    def addPulse(self, pulseInfo):
+        summary = self._summaries.get(pulseInfo.tag_id)
+        if summary is None:
+            summary = self._summaries[pulseInfo.tag_id] = PulseSummaryLog._TagSummary()
+        if pulseInfo.frequency_hz == 0:
+            summary.heartbeatCount += 1
+            return
+        summary.pulseCount += 1
+        if pulseInfo.confirmed_status:
+            summary.confirmedCount += 1
+        if logging.root.isEnabledFor(logging.DEBUG):
+            logging.debug("PULSE tag_id:frequency_hz:seq_ctr:group_ind:confirmed:snr:noise_psd %d %d %d %d %d %.1f %g",
+                          pulseInfo.tag_id, pulseInfo.frequency_hz, pulseInfo.group_seq_counter, pulseInfo.group_ind, pulseInfo.confirmed_status, pulseInfo.snr, pulseInfo.noise_psd)
+
+    def flush(self, force = False):
+        # Called from the receive loop, so no locking is needed against addPulse
+        now = time.monotonic()
+        if not force and now - self._lastFlushTime < self._intervalSecs:
+            return
+        elapsedSecs         = now - self._lastFlushTime
+        self._lastFlushTime = now
+        if not self._summaries or not logging.root.isEnabledFor(logging.INFO):
+            self._summaries = {}
+            return
+        for tagId, summary in sorted(self._summaries.items()):
+            groupSummary = self._groupSummary(tagId) or [ 0, 0.0, 0.0, 0.0, 0.0 ]
+            if self._pulseStore and summary.pulseCount:
+                pulseRate       = self._pulseStore.pulseRate(tagId, self._intervalSecs)
+                noisePSDTrend   = self._pulseStore.noisePSDTrend(tagId, self._intervalSecs)
+            else:
+                pulseRate = noisePSDTrend = 0.0
+            logging.info("PULSE SUMMARY tag_id:secs:pulses:confirmed:heartbeats:groups:missed_pct:snr_mean:noise_psd_mean:confirm_latency_msecs:pulses_per_sec:noise_psd_trend %d %.0f %d %d %d %d %.0f %.1f %g %.0f %.2f %g",
+                         tagId, elapsedSecs, summary.pulseCount, summary.confirmedCount, summary.heartbeatCount,
+                         groupSummary[0], groupSummary[1] * 100, groupSummary[2], groupSummary[3], groupSummary[4] * 1000, pulseRate, noisePSDTrend)
+        self._summaries = {}
+
+    def _groupSummary(self, tagId):
+        # Summary of the K groups the detector finished since the previous log line for the tag
+        detectorInfo = self._detectorInfoList.getDetectorInfo(tagId) if self._detectorInfoList else None
+        if detectorInfo is None or detectorInfo.groupStats is None:
+            return None
+        groupStats      = detectorInfo.groupStats
+        logged          = self._loggedGroupCounts.get(tagId)
+        # A detector rebuilt by a tag reload or resync starts a new GroupStats, which counts from zero
+        loggedCount     = logged[1] if logged and logged[0] is groupStats else 0
+        newGroupCount   = groupStats.finishedCount - loggedCount
+        self._loggedGroupCounts[tagId] = [ groupStats, groupStats.finishedCount ]
+        if newGroupCount <= 0:
+            return None
+        return groupStats.summary(groupStats.recentGroups(newGroupCount))
+
+_queueListener = None
+
+class _RecordQueueHandler(logging.handlers.QueueHandler):
+    # The standard prepare() merges the arguments into the message on the logging thread. Records are queued as they
+    # are instead, so the listener thread does the formatting. Log arguments must not change after the logging call,
+    # which holds for the numbers, strings and enums logged here. Exceptions are still formatted by the caller while
+    # the traceback is live.
+    def prepare(self, record):
+        if record.exc_info:
+            return super().prepare(record)
+        return record
+
+def startQueueLogging(level = logging.INFO, format = '[%(levelname)s] %(message)s |  %(filename)s:%(lineno)d', logFilePath = None):
+    # Log records are queued by the calling thread and formatted and written by a listener thread, so neither message
+    # formatting nor console and disk I/O run on the MAVLink thread
+    global _queueListener
+    handlers = [ logging.StreamHandler() ]
+    if logFilePath:
+        handlers.append(logging.FileHandler(logFilePath))
+    formatter = logging.Formatter(format)
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    logQueue = queue.SimpleQueue()
+    rootLogger = logging.getLogger()
+    rootLogger.handlers = [ _RecordQueueHandler(logQueue) ]
+    rootLogger.setLevel(level)
+    _queueListener = logging.handlers.QueueListener(logQueue, *handlers, respect_handler_level = True)
+    _queueListener.start()
+    atexit.register(stopQueueLogging)
+
+def stopQueueLogging():
+    # Flushes any queued records
+    global _queueListener
+    if _queueListener:
+        _queueListener.stop()
+        _queueListener = None
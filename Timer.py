@@ -1,24 +1,82 @@
 import AppGlobal
 
+import math
 import threading
-import logging
+import time
+
+# Hashed timer wheel which owns every core Timer. Timers are intrusive entries in the wheel slots, so rearming a timer
+# is O(1) and allocates nothing. The scheduler advances the wheel once per tick and all timers which expired during
+# the tick are returned together so their callbacks run as one batch. Pushing an armed timer's deadline later (the
+# common case, a detector timer rearmed on every pulse) only updates the deadline, the timer is moved to its new slot
+# when the wheel reaches its old one.
+class TimerWheel:
+    def __init__(self, tickMsecs, slotCount):
+        self._tickSecs      = tickMsecs / 1000.0
+        self._slots         = [ set() for _ in range(slotCount) ]
+        self._slotCount     = slotCount
+        self._lock          = threading.Lock()
+        self._startTime     = time.monotonic()
+        self._currentTick   = 0
+
+    def arm(self, timer, msecsTimeout):
+        deadlineTick = self._currentTick + max(1, math.ceil(msecsTimeout / 1000.0 / self._tickSecs))
+        with self._lock:
+            if timer._wheelSlot is not None:
+                if deadlineTick >= timer._deadlineTick:
+                    timer._deadlineTick = deadlineTick
+                    return
+                self._slots[timer._wheelSlot].discard(timer)
+            timer._deadlineTick = deadlineTick
+            timer._wheelSlot    = deadlineTick % self._slotCount
+            self._slots[timer._wheelSlot].add(timer)
+
+    def disarm(self, timer):
+        with self._lock:
+            if timer._wheelSlot is not None:
+                self._slots[timer._wheelSlot].discard(timer)
+                timer._wheelSlot = None
+
+    def advance(self, now):
+        # Returns the timers which expired since the last call
+        expiredTimers = []
+        targetTick = int((now - self._startTime) / self._tickSecs)
+        with self._lock:
+            while self._currentTick < targetTick:
+                self._currentTick += 1
+                slotIndex   = self._currentTick % self._slotCount
+                slot        = self._slots[slotIndex]
+                if slot:
+                    for timer in list(slot):
+                        if timer._deadlineTick <= self._currentTick:
+                            slot.discard(timer)
+                            timer._wheelSlot = None
+                            expiredTimers.append(timer)
+                        elif timer._deadlineTick % self._slotCount != slotIndex:
+                            slot.discard(timer)
+                            timer._wheelSlot = timer._deadlineTick % self._slotCount
+                            self._slots[timer._wheelSlot].add(timer)
+        return expiredTimers
 
 class Timer:
+    __slots__ = ("_msecsTimeout", "_callback", "_wheelSlot", "_deadlineTick")
+
     def __init__(self, msecsTimeout, callback):
         self._msecsTimeout  = msecsTimeout
         self._callback      = callback
-        self._timer         = None
-
-    def __del__(self):
-        self.stop()
+        self._wheelSlot     = None
+        self._deadlineTick  = 0
 
-    def start(self):
-        self.stop()
-        if AppGlobal.app.mainloopRunning:
-            self._timer = AppGlobal.app.after(self._msecsTimeout, self._callback)
+    def start(self, msecsTimeout = None):
+        if msecsTimeout is not None:
+            self._msecsTimeout = msecsTimeout
+        AppGlobal.scheduler.timerWheel.arm(self, self._msecsTimeout)
 
     def stop(self):
-        if self._timer:
-            if AppGlobal.app.mainloopRunning:
-                AppGlobal.app.after_cancel(self._timer)
-            self._timer = None
+        if self._wheelSlot is not None:
+            AppGlobal.scheduler.timerWheel.disarm(self)
+
+    def isActive(self):
+        return self._wheelSlot is not None
+
+    def fire(self):
+        self._callback()
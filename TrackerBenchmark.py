@@ -0,0 +1,242 @@
+from VehicleSimulator import *
+from MavlinkThread import *
+from Scheduler import *
+import AppGlobal
+
+import argparse
+import heapq
+import itertools
+import logging
+import os
+import sys
+import tempfile
+import time
+
+# Drives pyTracker against in-process VehicleSimulators over loopback UDP and reports, for each pulse rate step,
+# TUNNEL messages/s, pulse-to-UI latency percentiles, UI redraw time per tick and tracker CPU use (simulator threads
+# excluded). With several vehicles, vehicle N pulses all but the last N tags, so every vehicle has a different pulse
+# count per tag. After the run each vehicle's detector pulse counts and pulse store are checked against what its own
+# simulator sent.
+class TrackerBenchmark:
+    def __init__(self, tagCount, pulseRates, stepSecs, jitterSecs, lossProbability, port, vehicleCount = 1):
+        self._tagIds        = [ 2 + tagIndex * 2 for tagIndex in range(tagCount) ]
+        self._pulseRates    = pulseRates
+        self._stepSecs      = stepSecs
+        self._tagFilePath   = self._writeTagFile(tagCount)
+        self._simulators    = [ VehicleSimulator("udpout:localhost:{0}".format(port + vehicleIndex), 1 + vehicleIndex, pulseRateHz = pulseRates[0], tagCount = max(1, tagCount - vehicleIndex),
+                                                 jitterSecs = jitterSecs, lossProbability = lossProbability)
+                                for vehicleIndex in range(vehicleCount) ]
+        self._tagCount      = sum(simulator.tagCount for simulator in self._simulators)
+        self.mavlinkThread  = MavlinkThread([ "udpin:localhost:{0}".format(port + vehicleIndex) for vehicleIndex in range(vehicleCount) ], self._tagFilePath)
+        self._latencySamples    = []
+        self._redrawSamples     = []
+        self._lastPulseCounts   = {}
+        self.results            = []
+        self.vehicleErrors      = []
+        self._startMetrics      = {}
+
+    def _writeTagFile(self, tagCount):
+        spacingHz = min(10000, 3000000 // max(tagCount, 1))
+        tagFile = tempfile.NamedTemporaryFile("w", suffix = ".txt", delete = False)
+        for tagIndex in range(tagCount):
+            tagId = 2 + tagIndex * 2
+            tagFile.write("{0},bench{0},{1},1000,-,0,-,15,60,5\n".format(tagId, 146000000 + tagIndex * spacingHz))
+        tagFile.close()
+        return tagFile.name
+
+    def sampleLatency(self):
+        # Called on each UI refresh: latency of every pulse that arrived since the previous refresh
+        now = time.time()
+        for commandHandler in self.mavlinkThread.commandHandlers():
+            startTimes, self._lastPulseCounts[commandHandler.vehicleId] = commandHandler.pulseStore.columnSince("start_time_seconds", self._lastPulseCounts.get(commandHandler.vehicleId, 0))
+            self._latencySamples.extend(now - startTime for startTime in startTimes)
+
+    def sampleRedraw(self, redrawSecs):
+        self._redrawSamples.append(redrawSecs)
+
+    def run(self):
+        # Metrics are process wide, counts are taken relative to the start of the run
+        self._startMetrics = metrics.snapshot()["metrics"]
+        AppGlobal.scheduler = Scheduler()
+        AppGlobal.scheduler.start()
+        for simulator in self._simulators:
+            simulator.start()
+        self.mavlinkThread.start()
+        AppGlobal.app.after(0, self._waitForDetection)
+        AppGlobal.app.mainloopRunning = True
+        AppGlobal.app.mainloop()
+        AppGlobal.app.mainloopRunning = False
+        for simulator in self._simulators:
+            simulator.stop()
+            simulator.join()
+        self._waitForProcessing()
+        self._checkVehicles()
+        self.mavlinkThread.stop()
+        self.mavlinkThread.join()
+        AppGlobal.scheduler.stop()
+        os.unlink(self._tagFilePath)
+
+    def _waitForProcessing(self):
+        # Simulators are stopped, wait for the tracker to work through the messages still queued
+        deadline = time.time() + 5
+        messageCount = -1
+        while messageCount != self._tunnelMessageCount() and time.time() < deadline:
+            messageCount = self._tunnelMessageCount()
+            time.sleep(0.2)
+
+    def _checkVehicles(self):
+        # Each vehicle's pulses must land in its own detectors and pulse store only. Pulses can be lost on the way
+        # but never gained, and a tag its simulator never pulsed must have no pulses at all.
+        snapshot        = metrics.snapshot()["metrics"]
+        commandHandlers = { commandHandler.vehicleId: commandHandler for commandHandler in self.mavlinkThread.commandHandlers() }
+        for vehicleId, simulator in enumerate(self._simulators):
+            commandHandler  = commandHandlers.get(vehicleId)
+            if commandHandler is None:
+                self.vehicleErrors.append("vehicle {0}: no command handler".format(vehicleId))
+                continue
+            errors          = []
+            detectorPulses  = 0
+            for tagId in self._tagIds:
+                sentCount       = simulator.pulsesSentByTag[tagId]
+                counterName     = "detector.{0}.{1}.pulses".format(vehicleId, tagId)
+                receivedCount   = snapshot.get(counterName, 0) - self._startMetrics.get(counterName, 0)
+                detectorPulses  += receivedCount
+                if receivedCount > sentCount or (receivedCount == 0) != (sentCount == 0):
+                    errors.append("tag {0} sent:received {1} {2}".format(tagId, sentCount, receivedCount))
+            if any(detectorInfo.vehicleId != vehicleId for detectorInfo in commandHandler.detectorInfoList):
+                errors.append("detectors of another vehicle")
+            if commandHandler.pulseStore.totalCount != detectorPulses:
+                errors.append("pulse store:detector pulses {0} {1}".format(commandHandler.pulseStore.totalCount, detectorPulses))
+            print("vehicle {0}  tags pulsed {1:3d}  pulses sent {2:8d}  received {3:8d}  pulse store {4:8d}  {5}".format(
+                  vehicleId, len(simulator.pulsesSentByTag), simulator.pulsesSent, detectorPulses, commandHandler.pulseStore.totalCount, "; ".join(errors) or "ok"))
+            self.vehicleErrors.extend("vehicle {0}: {1}".format(vehicleId, error) for error in errors)
+
+    def _waitForDetection(self):
+        if all(simulator.status == HeartbeatStatus.HEARTBEAT_STATUS_DETECTING for simulator in self._simulators):
+            self._startStep(0)
+        else:
+            AppGlobal.app.after(100, self._waitForDetection)
+
+    def _startStep(self, stepIndex):
+        for simulator in self._simulators:
+            simulator.pulseRateHz   = self._pulseRates[stepIndex]
+        self._latencySamples        = []
+        self._redrawSamples         = []
+        self._stepStartTime         = time.time()
+        self._stepStartMessages     = self._tunnelMessageCount()
+        self._stepStartPulsesSent   = self._pulsesSent()
+        self._stepStartCpu          = self._trackerCpuSecs()
+        AppGlobal.app.after(int(self._stepSecs * 1000), self._endStep, stepIndex)
+
+    def _endStep(self, stepIndex):
+        elapsedSecs     = time.time() - self._stepStartTime
+        messageCount    = self._tunnelMessageCount() - self._stepStartMessages
+        pulsesSent      = self._pulsesSent() - self._stepStartPulsesSent
+        latencies       = sorted(self._latencySamples)
+        redraws         = sorted(self._redrawSamples)
+        result = {
+            "pulseRateHz":      self._pulseRates[stepIndex] * self._tagCount,
+            "pulsesSentPerSec": pulsesSent / elapsedSecs,
+            "messagesPerSec":   messageCount / elapsedSecs,
+            "latencyP50Msecs":  self._percentile(latencies, 50) * 1000,
+            "latencyP90Msecs":  self._percentile(latencies, 90) * 1000,
+            "latencyP99Msecs":  self._percentile(latencies, 99) * 1000,
+            "redrawP50Msecs":   self._percentile(redraws, 50) * 1000,
+            "redrawMaxMsecs":   (redraws[-1] if redraws else float("nan")) * 1000,
+            "cpuPercent":       (self._trackerCpuSecs() - self._stepStartCpu) / elapsedSecs * 100,
+        }
+        self.results.append(result)
+        print("rate {pulseRateHz:8.0f}/s  sent {pulsesSentPerSec:8.0f}/s  recv {messagesPerSec:8.0f} msgs/s  "
+              "latency p50:p90:p99 {latencyP50Msecs:7.1f} {latencyP90Msecs:7.1f} {latencyP99Msecs:7.1f} ms  "
+              "redraw p50:max {redrawP50Msecs:6.2f} {redrawMaxMsecs:6.2f} ms  cpu {cpuPercent:5.1f}%".format(**result))
+        if stepIndex + 1 < len(self._pulseRates):
+            self._startStep(stepIndex + 1)
+        else:
+            AppGlobal.app.shutdown()
+
+    def _tunnelMessageCount(self):
+        return sum(commandHandler.tunnelMessageCount for commandHandler in self.mavlinkThread.commandHandlers())
+
+    def _pulsesSent(self):
+        return sum(simulator.pulsesSent for simulator in self._simulators)
+
+    def _trackerCpuSecs(self):
+        simulatorCpuSecs = sum(time.clock_gettime(time.pthread_getcpuclockid(simulator.ident)) for simulator in self._simulators)
+        return time.process_time() - simulatorCpuSecs
+
+    @staticmethod
+    def _percentile(sortedValues, percent):
+        if not sortedValues:
+            return float("nan")
+        return sortedValues[min(len(sortedValues) - 1, int(len(sortedValues) * percent / 100))]
+
+def createBenchmarkApp(benchmark):
+    # Tk is only imported when there is a UI, so the benchmark also runs where there is no display
+    from TrackerUI import App
+
+    class BenchmarkApp(App):
+        def __init__(self, benchmark):
+            super().__init__(benchmark.mavlinkThread)
+            self.withdraw()
+            self._benchmark = benchmark
+
+        def _updateUI(self):
+            redrawStart = time.perf_counter()
+            super()._updateUI()
+            self._benchmark.sampleRedraw(time.perf_counter() - redrawStart)
+            self._benchmark.sampleLatency()
+
+    return BenchmarkApp(benchmark)
+
+class HeadlessBenchmarkApp:
+    # Stands in for the Tk app with the same after/mainloop/shutdown calls. The UI callback queue is drained on the
+    # same tick as the UI, but nothing is drawn, so redraw times are not reported.
+    def __init__(self, benchmark):
+        self._benchmark         = benchmark
+        self._callbackQueue     = benchmark.mavlinkThread.callbackQueue
+        self._pendingCalls      = []        # Heap of [ due time, sequence, callback, args ]
+        self._sequence          = itertools.count()
+        self._running           = False
+        self.mainloopRunning    = False
+        AppGlobal.addStateListener(self._callbackQueue.put)
+        self.after(Settings.uiTickMsecs, self._uiTick)
+
+    def after(self, msecs, callback, *args):
+        heapq.heappush(self._pendingCalls, [ time.monotonic() + msecs / 1000.0, next(self._sequence), callback, args ])
+
+    def mainloop(self):
+        self._running = True
+        while self._running:
+            dueTime, _, callback, args = heapq.heappop(self._pendingCalls)
+            delaySecs = dueTime - time.monotonic()
+            if delaySecs > 0:
+                time.sleep(delaySecs)
+            callback(*args)
+
+    def shutdown(self):
+        self._running = False
+
+    def _uiTick(self):
+        self._callbackQueue.drain()
+        self._benchmark.sampleLatency()
+        self.after(Settings.uiTickMsecs, self._uiTick)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "End to end pyTracker throughput benchmark against a simulated vehicle")
+    parser.add_argument("--tags",       type = int,     default = 20)
+    parser.add_argument("--rates",      default = "1,5,10,25,50",   help = "comma separated pulse rate steps, pulses per second per tag")
+    parser.add_argument("--step-secs",  type = float,   default = 10.0)
+    parser.add_argument("--jitter",     type = float,   default = 0.0)
+    parser.add_argument("--loss",       type = float,   default = 0.0)
+    parser.add_argument("--port",       type = int,     default = 14560)
+    parser.add_argument("--vehicles",   type = int,     default = 1,    help = "number of simulated vehicles, each on its own port and link")
+    parser.add_argument("--headless",   action = "store_true",  help = "drain UI updates without drawing them, for systems with no display")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='[%(levelname)s] %(message)s |  %(filename)s:%(lineno)d')
+    benchmark = TrackerBenchmark(args.tags, [ float(rate) for rate in args.rates.split(",") ], args.step_secs, args.jitter, args.loss, args.port, args.vehicles)
+    AppGlobal.app = HeadlessBenchmarkApp(benchmark) if args.headless else createBenchmarkApp(benchmark)
+    with tempfile.TemporaryDirectory() as directory:
+        Settings.tagCacheDirectory = directory
+        benchmark.run()
+    sys.exit(1 if benchmark.vehicleErrors else 0)
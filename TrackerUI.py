@@ -0,0 +1,268 @@
+from Settings import *
+from StateDeltaQueue import *
+from Metrics import *
+import AppGlobal
+
+import tkinter as tk
+import logging
+import time
+
+class DetectorWidget:
+    _sparklineWidth     = 100
+    _sparklineHeight    = 20
+
+    def __init__(self, parent, detectorInfo, vehicleName = None):
+        self.frame = tk.Frame(parent, borderwidth=2, relief=tk.RAISED)
+        self._heartbeatIndicator = tk.Frame(self.frame, width=10, height=self._sparklineHeight, bg="red")
+        self._heartbeatIndicator.pack(side=tk.LEFT, fill=tk.Y)
+        self._vehicleName = vehicleName
+        self._detectorInfo = detectorInfo
+        self._nameLabel = tk.Label(self.frame, text=self._nameText(detectorInfo), width=15, anchor=tk.W)
+        self._nameLabel.pack(side=tk.LEFT)
+        self._snrLabel = tk.Label(self.frame, text="-", width=6, fg="grey")
+        self._snrLabel.pack(side=tk.LEFT)
+        self._sparkline = tk.Canvas(self.frame, width=self._sparklineWidth, height=self._sparklineHeight, bg="white", highlightthickness=0)
+        self._sparkline.pack(side=tk.LEFT)
+        self._sparklineItem = self._sparkline.create_line(0, 0, 0, 0, fill="blue")
+        self._bearingLabel = tk.Label(self.frame, text="", width=12)
+        self._bearingLabel.pack(side=tk.LEFT)
+        self._locationLabel = tk.Label(self.frame, text="", width=18)
+        self._locationLabel.pack(side=tk.LEFT)
+        self._groupLabel = tk.Label(self.frame, text="", width=16, fg="grey")
+        self._groupLabel.pack(side=tk.LEFT)
+        self._displayedState    = None
+        self._displayedBearing  = None
+        self._displayedLocation = None
+        self._displayedHistory  = None
+        self._displayedGroups   = None
+
+    def _nameText(self, detectorInfo):
+        label = "{0} {1}".format(detectorInfo.tagId, detectorInfo.tagLabel)
+        if self._vehicleName:
+            label = "{0} {1}".format(self._vehicleName, label)
+        return label
+
+    def refresh(self, detectorInfo):
+        # Only touch the widgets whose displayed value actually changed
+        if detectorInfo is not self._detectorInfo:
+            # A tag reload replaced the detector, possibly with a new label, and its statistics start over
+            self._detectorInfo = detectorInfo
+            self._nameLabel.config(text = self._nameText(detectorInfo))
+            self._sparkline.coords(self._sparklineItem, 0, 0, 0, 0)
+            self._groupLabel.config(text = "")
+            self._displayedState    = None
+            self._displayedBearing  = None
+            self._displayedLocation = None
+            self._displayedHistory  = None
+            self._displayedGroups   = None
+        state = (detectorInfo.heartbeatTimeout, detectorInfo.lastPulseStale, round(detectorInfo.lastPulseSNR, 1))
+        if state != self._displayedState:
+            self._heartbeatIndicator.config(bg = "red" if detectorInfo.heartbeatTimeout else "green")
+            self._snrLabel.config(text = "{0:.1f}".format(detectorInfo.lastPulseSNR), fg = "grey" if detectorInfo.lastPulseStale else "black")
+            self._displayedState = state
+        if detectorInfo.bearing is not self._displayedBearing:
+            bearing = detectorInfo.bearing
+            self._bearingLabel.config(text = "{0:.0f}\u00b0 {1:.2f}".format(bearing.bearingDegrees, bearing.confidence) if bearing else "")
+            self._displayedBearing = bearing
+        location = detectorInfo.location
+        locationState = (location.observationCount if location else 0)
+        if locationState != self._displayedLocation:
+            if location and location.isValid():
+                errorText = "" if location.errorRadius is None else " \u00b1{0:.0f}".format(location.errorRadius)
+                self._locationLabel.config(text = "{0:.0f},{1:.0f}{2}".format(location.positionX, location.positionY, errorText))
+            self._displayedLocation = locationState
+        groupStats = detectorInfo.groupStats
+        if groupStats is None:
+            return
+        history = tuple(groupStats.snrMaxHistory())
+        if history != self._displayedHistory:
+            self._sparkline.coords(self._sparklineItem, *self._sparklineCoords(history))
+            self._displayedHistory = history
+        # Detection quality over the recent finished K groups: missed pulses, mean SNR and confirmation latency
+        if groupStats.finishedCount != self._displayedGroups:
+            groupSummary = groupStats.summary(groupStats.recentGroups(Settings.groupSummaryLength))
+            if groupSummary:
+                self._groupLabel.config(text = "miss {0:.0f}% snr {1:.1f} conf {2:.1f}s".format(groupSummary[1] * 100, groupSummary[2], groupSummary[4]))
+            self._displayedGroups = groupStats.finishedCount
+
+    def _sparklineCoords(self, history):
+        if len(history) < 2:
+            return [ 0, 0, 0, 0 ]
+        minSNR  = min(history)
+        snrSpan = max(history) - minSNR or 1.0
+        xStep   = (self._sparklineWidth - 1) / (Settings.groupHistoryLength - 1)
+        coords  = []
+        for index, snr in enumerate(history):
+            coords.append(index * xStep)
+            coords.append((self._sparklineHeight - 2) * (1.0 - (snr - minSNR) / snrSpan) + 1)
+        return coords
+
+    def destroy(self):
+        self.frame.destroy()
+
+class App(tk.Tk):
+    def __init__(self, mavlinkThread):
+        super().__init__()
+        
+        self._mavlinkThread = mavlinkThread
+        self._callbackQueue = mavlinkThread.callbackQueue
+        self._updateUIPending = False
+        self._shutdownRequested = False
+        self._lastDroppedCount = 0
+        self._detectorWidgets = {}              # DetectorInfo.key -> DetectorWidget
+        self._vehicleIndicators = {}            # Vehicle id -> controller heartbeat indicator
+        self._controllerDirty = True
+        self._detectorListDirty = True
+        self._dirtyDetectorKeys = set()
+        self.mainloopRunning = False
+        self._uiTickMsecs = metrics.histogram("ui.tick_msecs")
+        self._redrawMsecs = metrics.histogram("ui.redraw_msecs")
+        self._backlogHistogram = metrics.histogram("ui.queue_backlog")
+        metrics.gauge("ui.queue_dropped", lambda: self._callbackQueue.droppedCount)
+        metrics.gauge("ui.queue_coalesced", lambda: self._callbackQueue.coalescedCount)
+        metrics.gauge("ui.queue_max_backlog", lambda: self._callbackQueue.maxBacklog)
+
+        self.geometry( "600x400" )
+        self.vehicleIndicatorsFrame = tk.Frame(self, width = 50)
+        self.vehicleIndicatorsFrame.pack(fill=tk.Y, side=tk.LEFT)
+        self.rotationButton = tk.Button(self, text = "Start rotation", command = self._toggleRotation)
+        self._rotating = False
+        self.rotationButton.pack(side=tk.BOTTOM, anchor=tk.W, padx=10, pady=5)
+        self.captureButton = tk.Button(self, text = "Raw capture", command = self._startRawCapture)
+        self.captureButton.pack(side=tk.BOTTOM, anchor=tk.W, padx=10, pady=5)
+        self._displayedCaptureText = None
+        self.detectorsFrame = tk.Frame(self, bg = "white")
+        self.detectorsFrame.pack(expand=True, fill=tk.BOTH, side=tk.LEFT, padx=10, pady=10)
+
+        # Core threads never touch Tk. They push state deltas into the callback queue which is drained here on a
+        # fixed tick, so a flood of pulses can neither block MAVLink reception nor the UI.
+        AppGlobal.addStateListener(self._callbackQueue.put)
+        AppGlobal.addShutdownListener(self._coreShutdown)
+        self.after(Settings.uiTickMsecs, self._uiTick)
+        self.after_idle(AppGlobal.startupMilestone, "first_frame")
+
+    def _coreShutdown(self):
+        self._shutdownRequested = True
+
+    def _uiTick(self):
+        if self._shutdownRequested:
+            self.shutdown()
+            return
+        tickStart = time.perf_counter()
+        self._backlogHistogram.record(len(self._callbackQueue))
+        if self._callbackQueue.droppedCount != self._lastDroppedCount:
+            logging.warning("UI callback queue overflow: dropped:backlog %d %d", self._callbackQueue.droppedCount - self._lastDroppedCount, len(self._callbackQueue))
+            self._lastDroppedCount = self._callbackQueue.droppedCount
+        deltas = self._callbackQueue.drain()
+        for delta, key in deltas:
+            if delta == StateDelta.DETECTOR:
+                self._dirtyDetectorKeys.add(key)
+            elif delta == StateDelta.CONTROLLER_HEARTBEAT:
+                self._controllerDirty = True
+            else:
+                self._controllerDirty = True
+                self._detectorListDirty = True
+        if deltas:
+            self.updateUI()
+        self._updateCaptureButton()
+        self._uiTickMsecs.record((time.perf_counter() - tickStart) * 1000)
+        self.after(Settings.uiTickMsecs, self._uiTick)
+
+    def updateUI(self):
+        # Allow multiple calls to updateUI() to be coalesced into a single call to _updateUI()
+        if not self._updateUIPending:
+            self._updateUIPending = True
+            self.after_idle(self._updateUI)
+
+    def _updateUI(self):
+        self._updateUIPending = False
+        redrawStart = time.perf_counter()
+        self._redrawUI()
+        self._redrawMsecs.record((time.perf_counter() - redrawStart) * 1000)
+
+    def _redrawUI(self):
+        # Detectors of all vehicles are shown in one merged view, in vehicle order
+        commandHandlers = { commandHandler.vehicleId: commandHandler for commandHandler in self._mavlinkThread.commandHandlers() }
+        if not commandHandlers:
+            return
+        if self._controllerDirty:
+            self._controllerDirty = False
+            self._updateVehicleIndicators(commandHandlers)
+        if self._detectorListDirty:
+            self._detectorListDirty = False
+            self._syncDetectorWidgets(commandHandlers)
+        self._updateDetectorUI(commandHandlers)
+
+    def _vehicleName(self, vehicleId, commandHandlers):
+        return "V{0}".format(vehicleId + 1) if len(commandHandlers) > 1 else None
+
+    def _updateVehicleIndicators(self, commandHandlers):
+        for vehicleId, commandHandler in sorted(commandHandlers.items()):
+            indicator = self._vehicleIndicators.get(vehicleId)
+            if indicator is None:
+                indicator = tk.Label(self.vehicleIndicatorsFrame, text = self._vehicleName(vehicleId, commandHandlers) or "", width = 6, bg = "red")
+                indicator.pack(fill=tk.BOTH, expand=True, side=tk.TOP)
+                self._vehicleIndicators[vehicleId] = indicator
+            indicator.config(bg = "red" if commandHandler.controllerLostHeartbeat else "green")
+
+    def _syncDetectorWidgets(self, commandHandlers):
+        # Add widgets for new detectors and remove widgets for detectors which are gone, existing widgets are kept
+        currentKeys = set()
+        index = 0
+        for vehicleId, commandHandler in sorted(commandHandlers.items()):
+            for detectorInfo in commandHandler.detectorInfoList:
+                currentKeys.add(detectorInfo.key)
+                detectorWidget = self._detectorWidgets.get(detectorInfo.key)
+                if detectorWidget is None:
+                    logging.info("Creating detector UI for vehicle:detector id %d %d", vehicleId, detectorInfo.tagId)
+                    detectorWidget = DetectorWidget(self.detectorsFrame, detectorInfo, self._vehicleName(vehicleId, commandHandlers))
+                    self._detectorWidgets[detectorInfo.key] = detectorWidget
+                detectorWidget.frame.grid(row = index % Settings.detectorRowsPerColumn, column = index // Settings.detectorRowsPerColumn, sticky = tk.EW)
+                self._dirtyDetectorKeys.add(detectorInfo.key)
+                index += 1
+        for detectorKey in list(self._detectorWidgets):
+            if detectorKey not in currentKeys:
+                self._detectorWidgets.pop(detectorKey).destroy()
+
+    def _updateDetectorUI(self, commandHandlers):
+        for detectorKey in self._dirtyDetectorKeys:
+            vehicleId, tagId    = detectorKey
+            detectorWidget      = self._detectorWidgets.get(detectorKey)
+            commandHandler      = commandHandlers.get(vehicleId)
+            detectorInfo        = commandHandler.detectorInfoList.getDetectorInfo(tagId) if commandHandler else None
+            if detectorWidget and detectorInfo:
+                detectorWidget.refresh(detectorInfo)
+        self._dirtyDetectorKeys.clear()
+
+    # Commands are posted to each vehicle's processing thread, the UI never calls into the core directly
+
+    def _toggleRotation(self):
+        # Rotation applies to all vehicles
+        commandHandlers = self._mavlinkThread.commandHandlers()
+        if not commandHandlers:
+            return
+        self._rotating = not self._rotating
+        for commandHandler in commandHandlers:
+            commandHandler.callSoon(commandHandler.startRotation if self._rotating else commandHandler.stopRotation)
+        self.rotationButton.config(text = "Stop rotation" if self._rotating else "Start rotation")
+
+    def _startRawCapture(self):
+        # Capture applies to all vehicles, each download goes to its own file
+        for commandHandler in self._mavlinkThread.commandHandlers():
+            commandHandler.callSoon(commandHandler.startRawCapture)
+
+    def _updateCaptureButton(self):
+        # Download progress is polled, chunks arrive far too often to notify the UI of each one
+        received = total = 0
+        for commandHandler in self._mavlinkThread.commandHandlers():
+            progress = commandHandler.captureProgress()
+            if progress:
+                received    += progress[0]
+                total       += progress[1]
+        captureText = "Capture {0:.0f}%".format(received * 100 / total) if total else "Raw capture"
+        if captureText != self._displayedCaptureText:
+            self.captureButton.config(text = captureText)
+            self._displayedCaptureText = captureText
+
+    def shutdown(self):
+        self.destroy()
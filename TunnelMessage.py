@@ -87,12 +87,52 @@ class TunnelPulseInfo(ctypes.Structure):
         ('orientation_w',                           ctypes.c_float)
     ]
 
+# Rotation start/stop are never sent over the link, they only mark rotations in recordings
+class TunnelStartRotation(_tunnelHeaderOnly):
+    pass
+
+class TunnelStopRotation(_tunnelHeaderOnly):
+    pass
+
 class TunnelRawCapture(ctypes.Structure):
     _fields_ = [ 
         ('hdr_command',                             ctypes.c_uint),
         ('sdr_type',                                ctypes.c_uint)
     ]
 
+# Capture retrieval, a pyTracker extension to the MavlinkTagController protocol. The ground station pulls the most
+# recent raw capture in chunks: a CAPTURE_REQUEST with chunk_count 0 is answered with CAPTURE_INFO, otherwise with one
+# CAPTURE_CHUNK per requested chunk. Requests are not acked, the chunks are the response.
+class TunnelCaptureRequest(ctypes.Structure):
+    _fields_ = [ 
+        ('hdr_command',                             ctypes.c_uint),
+        ('capture_id',                              ctypes.c_uint),     # 0 for the most recent capture
+        ('first_chunk',                             ctypes.c_uint),
+        ('chunk_count',                             ctypes.c_uint)
+    ]
+
+class TunnelCaptureInfo(ctypes.Structure):
+    _fields_ = [ 
+        ('hdr_command',                             ctypes.c_uint),
+        ('capture_id',                              ctypes.c_uint),     # 0 if there is no capture
+        ('total_bytes',                             ctypes.c_uint),
+        ('chunk_size',                              ctypes.c_uint),
+        ('sample_rate_hz',                          ctypes.c_uint),
+        ('center_frequency_hz',                     ctypes.c_uint),
+        ('sdr_type',                                ctypes.c_uint)
+    ]
+
+captureChunkDataSize = 112     # Largest chunk which keeps TunnelCaptureChunk within the 128 byte TUNNEL payload
+
+class TunnelCaptureChunk(ctypes.Structure):
+    _fields_ = [ 
+        ('hdr_command',                             ctypes.c_uint),
+        ('capture_id',                              ctypes.c_uint),
+        ('chunk_index',                             ctypes.c_uint),
+        ('data_length',                             ctypes.c_ushort),
+        ('data',                                    ctypes.c_ubyte * captureChunkDataSize)
+    ]
+
 class TunnelCommand(IntEnum):
     COMMAND_ID_ACK              = 1     # Ack response to command
     COMMAND_ID_START_TAGS		= 2     # Previous tag set should be cleared, new tags are about to be uploaded
@@ -105,6 +145,9 @@ class TunnelCommand(IntEnum):
     COMMAND_ID_HEARTBEAT	   	= 9  	# Heartbeat message
     COMMAND_ID_START_ROTATION	= 10	# Start rotation, these ids are never sent as commands but are used to log the start and stop of rotation in the csv files
     COMMAND_ID_STOP_ROTATION	= 11	# Cancel rotation, these ids are never sent as commands but are used to log the start and stop of rotation in the csv files
+    COMMAND_ID_CAPTURE_REQUEST  = 12    # Request capture info or a range of capture chunks (pyTracker extension)
+    COMMAND_ID_CAPTURE_INFO     = 13    # Size and format of the most recent capture (pyTracker extension)
+    COMMAND_ID_CAPTURE_CHUNK    = 14    # One chunk of capture data (pyTracker extension)
 
 class CommandResult(IntEnum):
     COMMAND_RESULT_SUCCESS		= 1
@@ -126,60 +169,80 @@ class SdrType(IntEnum):
     SDR_TYPE_AIRSPY_HF		= 2
 
 class TunnelMessageHandler:
+    _commandStruct = struct.Struct("@I")
+
+    # Incoming TUNNEL commands we know how to decode: raw command id -> (command, structure, payload size)
+    _decodeTable = { 
+        int(command): (command, tunnelStruct, ctypes.sizeof(tunnelStruct)) for command, tunnelStruct in [
+            (TunnelCommand.COMMAND_ID_HEARTBEAT,    TunnelHeartbeat),
+            (TunnelCommand.COMMAND_ID_ACK,          TunnelAck),
+            (TunnelCommand.COMMAND_ID_PULSE,        TunnelPulseInfo),
+            (TunnelCommand.COMMAND_ID_START_ROTATION, TunnelStartRotation),
+            (TunnelCommand.COMMAND_ID_STOP_ROTATION,  TunnelStopRotation),
+            (TunnelCommand.COMMAND_ID_CAPTURE_INFO,   TunnelCaptureInfo),
+            (TunnelCommand.COMMAND_ID_CAPTURE_CHUNK,  TunnelCaptureChunk)
+        ]
+    }
+
     def __init__(self, command, system_id, status):
         self.command = command
         self.system_id = system_id
         self.status = status
 
     @staticmethod
-    def _payloadBytes(tunnelMsg):
-        byteArray = bytearray(tunnelMsg.payload_length)
-        for byteIndex in range(tunnelMsg.payload_length):
-            byteArray[byteIndex] = tunnelMsg.payload[byteIndex].to_bytes(1, byteorder='big')[0]
-        return byteArray
+    def payloadBytes(tunnelMsg):
+        # Single bulk conversion of the MAVLink payload (list of ints or bytes) to a writable buffer
+        return bytearray(tunnelMsg.payload[:tunnelMsg.payload_length])
 
     @staticmethod
     def _commandFromPayloadBytes(payloadBytes):
-        return TunnelCommand(struct.unpack("@I", payloadBytes[0:4])[0])
+        return TunnelCommand(TunnelMessageHandler._commandStruct.unpack_from(payloadBytes)[0])
 
     @staticmethod
     def commandFromMavlinkMessage(tunnelMsg):
-        logging.info("TUNNEL received: length %d", tunnelMsg.payload_length)
-        byteArray = TunnelMessageHandler._payloadBytes(tunnelMsg)
+        logging.debug("TUNNEL received: length %d", tunnelMsg.payload_length)
+        byteArray = TunnelMessageHandler.payloadBytes(tunnelMsg)
         command = TunnelMessageHandler._commandFromPayloadBytes(byteArray)
-        logging.info("Command: %s", command.name)
+        logging.debug("Command: %s", command.name)
         return command
 
     @staticmethod
     def heartbeatFromMavlinkMessage(tunnelMsg):
-        if tunnelMsg.payload_length != ctypes.sizeof(TunnelHeartbeat):
-            logging.warning("TunnelMessageHandler.heartbeatFromMavlinkMessage: incorrect payload size")
+        decoded = TunnelMessageHandler.decodePayload(TunnelMessageHandler.payloadBytes(tunnelMsg))
+        if decoded is None:
             return None
-        payloadBytes = TunnelMessageHandler._payloadBytes(tunnelMsg)
-        command = TunnelMessageHandler._commandFromPayloadBytes(payloadBytes)
-        if command != TunnelCommand.COMMAND_ID_HEARTBEAT:
-            logging.warning("TunnelMessageHandler.heartbeatFromMavlinkMessage: incorrect command, actual: %s", command.name)
+        if decoded[0] != TunnelCommand.COMMAND_ID_HEARTBEAT:
+            logging.warning("TunnelMessageHandler.heartbeatFromMavlinkMessage: incorrect command, actual: %s", decoded[0].name)
             return None
-        return TunnelHeartbeat.from_buffer_copy(payloadBytes)
-    
+        return decoded[1]
+
     @staticmethod
-    def processMavlinkMessage(mavlinkTunnelMsg):
-        logging.info("TUNNEL received: length %d", mavlinkTunnelMsg.payload_length)
-        payloadBytes = TunnelMessageHandler._payloadBytes(mavlinkTunnelMsg)
-        command = TunnelMessageHandler._commandFromPayloadBytes(payloadBytes)
-        logging.info("Command: %s", command.name)
-        if command == TunnelCommand.COMMAND_ID_HEARTBEAT:
-            return [command, TunnelHeartbeat.from_buffer_copy(payloadBytes)]
-        elif command == TunnelCommand.COMMAND_ID_ACK:
-            return [command, TunnelAck.from_buffer_copy(payloadBytes)]
-        elif command == TunnelCommand.COMMAND_ID_PULSE:
-            return [command, TunnelPulseInfo.from_buffer_copy(payloadBytes)]
-        else:
+    def decodePayload(payloadBytes):
+        # Returns [command, tunnelObject] with tunnelObject sharing payloadBytes (no copy), or None if not decodable
+        if len(payloadBytes) < TunnelMessageHandler._commandStruct.size:
+            logging.warning("TunnelMessageHandler.decodePayload: payload too short: %d", len(payloadBytes))
+            return None
+        rawCommand = TunnelMessageHandler._commandStruct.unpack_from(payloadBytes)[0]
+        decodeEntry = TunnelMessageHandler._decodeTable.get(rawCommand)
+        if decodeEntry is None:
+            logging.warning("TunnelMessageHandler.decodePayload: unsupported command: %d", rawCommand)
+            return None
+        command, tunnelStruct, expectedSize = decodeEntry
+        if len(payloadBytes) != expectedSize:
+            logging.warning("TunnelMessageHandler.decodePayload: incorrect payload size for %s - expected:actual %d %d", command.name, expectedSize, len(payloadBytes))
             return None
+        return [command, tunnelStruct.from_buffer(payloadBytes)]
+
+    @staticmethod
+    def processMavlinkMessage(mavlinkTunnelMsg):
+        decoded = TunnelMessageHandler.decodePayload(TunnelMessageHandler.payloadBytes(mavlinkTunnelMsg))
+        if decoded is not None and logging.root.isEnabledFor(logging.DEBUG):
+            logging.debug("TUNNEL received: length:command %d %s", mavlinkTunnelMsg.payload_length, decoded[0].name)
+        return decoded
         
     @staticmethod
     def sendTunnelCommand(mavlink, tunnelMsg):
-        logging.info("TUNNEL send: command %d", tunnelMsg.hdr_command)
+        logging.debug("TUNNEL send: command %d", tunnelMsg.hdr_command)
         # tunnel_send requires the payload to b 128 bytes for some reason! It's not variable length
         tunnelBytes = bytearray(tunnelMsg) + bytearray(128 - ctypes.sizeof(tunnelMsg))
         mavlink.mav.tunnel_send(mavlink.target_system, 
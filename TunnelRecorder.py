@@ -0,0 +1,210 @@
+from TunnelMessage import *
+
+import array
+import datetime
+import logging
+import mmap
+import pathlib
+import struct
+import threading
+import time
+
+# Recording file layout, all little endian:
+#   file header:    magic "PTRK", format version, record size, reserved
+#   records:        receive time (double secs), payload length, command, tag id (pulses only), 128 byte payload
+# A sidecar "<recording>.idx" written on close holds the record numbers for each tag id. If it is missing (the
+# recording was not closed cleanly) the index is rebuilt by scanning the record headers.
+_fileHeaderStruct       = struct.Struct("<4sIII")
+_recordHeaderStruct     = struct.Struct("<dHHI")
+_indexEntryStruct       = struct.Struct("<II")
+_fileMagic              = b"PTRK"
+_fileVersion            = 1
+_maxPayloadLength       = 128
+_recordSize             = _recordHeaderStruct.size + _maxPayloadLength
+_pulseTagIdOffset       = TunnelPulseInfo.tag_id.offset
+
+class TunnelRecorder:
+    def __init__(self, directory):
+        self._directory         = pathlib.Path(directory).expanduser()
+        self._file              = None
+        self._recordCount       = 0
+        self._tagIndex          = {}
+        self._lastFlushTime     = 0
+        self.path               = None
+
+    def rotate(self):
+        # Close the current recording (if any) and start a new one, called at the start of each flight
+        self.close()
+        self._directory.mkdir(parents = True, exist_ok = True)
+        self.path           = self._directory / "flight-{0}.ptrk".format(datetime.datetime.now().strftime("%Y%m%d-%H%M%S-%f"))
+        self._file          = open(self.path, "wb")
+        self._file.write(_fileHeaderStruct.pack(_fileMagic, _fileVersion, _recordSize, 0))
+        self._recordCount   = 0
+        self._tagIndex      = {}
+        logging.info("Recording TUNNEL messages to %s", self.path)
+
+    def record(self, payloadBytes, receiveTime = None):
+        if self._file is None:
+            return
+        if receiveTime is None:
+            receiveTime = time.time()
+        payloadLength   = min(len(payloadBytes), _maxPayloadLength)
+        command         = struct.unpack_from("<I", payloadBytes)[0] if payloadLength >= 4 else 0
+        tagId           = 0
+        if command == TunnelCommand.COMMAND_ID_PULSE and payloadLength >= _pulseTagIdOffset + 4:
+            tagId = struct.unpack_from("<I", payloadBytes, _pulseTagIdOffset)[0]
+            tagRecords = self._tagIndex.get(tagId)
+            if tagRecords is None:
+                tagRecords = self._tagIndex[tagId] = array.array("I")
+            tagRecords.append(self._recordCount)
+        self._file.write(_recordHeaderStruct.pack(receiveTime, payloadLength, command, tagId))
+        self._file.write(payloadBytes[:payloadLength])
+        if payloadLength < _maxPayloadLength:
+            self._file.write(bytes(_maxPayloadLength - payloadLength))
+        self._recordCount += 1
+
+    def flush(self, maxAgeSecs = 1.0):
+        now = time.monotonic()
+        if self._file and now - self._lastFlushTime >= maxAgeSecs:
+            self._file.flush()
+            self._lastFlushTime = now
+
+    def close(self):
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        with open(str(self.path) + ".idx", "wb") as indexFile:
+            for tagId, tagRecords in self._tagIndex.items():
+                indexFile.write(_indexEntryStruct.pack(tagId, len(tagRecords)))
+                indexFile.write(tagRecords.tobytes())
+        logging.info("Recording closed: %s %d records", self.path, self._recordCount)
+
+# Read only, memory mapped view of a recording
+class TunnelRecording:
+    def __init__(self, path):
+        self.path       = pathlib.Path(path)
+        self._file      = open(self.path, "rb")
+        self._mmap      = mmap.mmap(self._file.fileno(), 0, access = mmap.ACCESS_READ)
+        magic, version, recordSize, _ = _fileHeaderStruct.unpack_from(self._mmap)
+        if magic != _fileMagic or version != _fileVersion or recordSize != _recordSize:
+            raise ValueError("TunnelRecording: {0} is not a version {1} recording".format(path, _fileVersion))
+        # A partially written trailing record from an unclean shutdown is ignored
+        self.recordCount    = (len(self._mmap) - _fileHeaderStruct.size) // _recordSize
+        self._tagIndex      = self._loadTagIndex()
+
+    def close(self):
+        self._mmap.close()
+        self._file.close()
+
+    def _recordOffset(self, recordNumber):
+        return _fileHeaderStruct.size + recordNumber * _recordSize
+
+    def recordHeader(self, recordNumber):
+        # [ receive time, payload length, command, tag id ]
+        return _recordHeaderStruct.unpack_from(self._mmap, self._recordOffset(recordNumber))
+
+    def payload(self, recordNumber, payloadLength):
+        payloadOffset = self._recordOffset(recordNumber) + _recordHeaderStruct.size
+        return self._mmap[payloadOffset:payloadOffset + payloadLength]
+
+    def receiveTime(self, recordNumber):
+        return struct.unpack_from("<d", self._mmap, self._recordOffset(recordNumber))[0]
+
+    def _loadTagIndex(self):
+        indexPath = pathlib.Path(str(self.path) + ".idx")
+        tagIndex = {}
+        if indexPath.exists():
+            indexBytes = indexPath.read_bytes()
+            offset = 0
+            while offset < len(indexBytes):
+                tagId, count = _indexEntryStruct.unpack_from(indexBytes, offset)
+                offset += _indexEntryStruct.size
+                tagRecords = array.array("I")
+                tagRecords.frombytes(indexBytes[offset:offset + count * tagRecords.itemsize])
+                offset += count * tagRecords.itemsize
+                tagIndex[tagId] = tagRecords
+            return tagIndex
+        for recordNumber in range(self.recordCount):
+            _, _, command, tagId = self.recordHeader(recordNumber)
+            if command == TunnelCommand.COMMAND_ID_PULSE:
+                tagIndex.setdefault(tagId, array.array("I")).append(recordNumber)
+        return tagIndex
+
+    def tagIds(self):
+        return list(self._tagIndex)
+
+    def tagRecords(self, tagId):
+        return self._tagIndex.get(tagId, array.array("I"))
+
+    def recordAtTime(self, receiveTime):
+        # First record received at or after receiveTime, records are in receive time order
+        low, high = 0, self.recordCount
+        while low < high:
+            middle = (low + high) // 2
+            if self.receiveTime(middle) < receiveTime:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+# Duck types the pymavlink TUNNEL message fields used by CommandHandler
+class ReplayTunnelMessage:
+    __slots__ = ("payload", "payload_length")
+
+    def __init__(self, payload, payloadLength):
+        self.payload        = payload
+        self.payload_length = payloadLength
+
+    def get_type(self):
+        return "TUNNEL"
+
+# Feeds a recording back through CommandHandler.processMavlinkTunnelMessage. Stands in for MavlinkThread, so it
+# exposes the same commandHandler/callbackQueue/stop interface to the UI.
+class TunnelReplay(threading.Thread):
+    def __init__(self, recordingPath, commandHandler, callbackQueue, speed = 1.0, startTime = None, endTime = None):
+        super().__init__(name = "TunnelReplay")
+        self._recording     = TunnelRecording(recordingPath)
+        self._speed         = speed     # Multiple of real time, 0 for as fast as possible
+        self._startTime     = startTime
+        self._endTime       = endTime
+        self._finished      = False
+        self.commandHandler = commandHandler
+        self.callbackQueue  = callbackQueue
+        self.replayedCount  = 0
+
+    def stop(self):
+        self._finished = True
+
+    def commandHandlers(self):
+        return [ self.commandHandler ]
+
+    def run(self):
+        try:
+            recording       = self._recording
+            firstRecord     = 0 if self._startTime is None else recording.recordAtTime(self._startTime)
+            lastRecord      = recording.recordCount if self._endTime is None else recording.recordAtTime(self._endTime)
+            logging.info("Replaying %s records %d-%d at speed %s", recording.path, firstRecord, lastRecord, self._speed or "max")
+            replayStartWall = time.monotonic()
+            firstReceive    = recording.receiveTime(firstRecord) if firstRecord < lastRecord else 0
+
+            for recordNumber in range(firstRecord, lastRecord):
+                if self._finished:
+                    break
+                receiveTime, payloadLength, _, _ = recording.recordHeader(recordNumber)
+                if self._speed:
+                    delaySecs = (receiveTime - firstReceive) / self._speed - (time.monotonic() - replayStartWall)
+                    if delaySecs > 0:
+                        self.commandHandler.flushPulses()
+                        time.sleep(delaySecs)
+                self.commandHandler.runPendingCalls()
+                self.commandHandler.processMavlinkTunnelMessage(ReplayTunnelMessage(recording.payload(recordNumber, payloadLength), payloadLength))
+                self.replayedCount += 1
+            self.commandHandler.flushPulses()
+            self.commandHandler.runPendingCalls()
+            logging.info("Replay complete: %d records in %.2f secs", self.replayedCount, time.monotonic() - replayStartWall)
+        except:
+            logging.exception("Exception in TunnelReplay")
+        finally:
+            self.commandHandler.stop()
+            self._recording.close()
@@ -0,0 +1,133 @@
+from VehicleSimulator import *
+from TagUploader import *
+from TagInfoList import *
+from Scheduler import *
+import AppGlobal
+
+import argparse
+import logging
+import statistics
+import threading
+
+# Tag upload against an in-process VehicleSimulator over loopback UDP, with the simulator dropping and delaying its
+# command acks. For each window size and ack loss probability the tags are uploaded a number of times and the upload
+# time, retransmits and restarts are reported.
+class UploadLink:
+    # Ground end of the link: a MAVLink connection, a TagUploader sending through it and a thread feeding it the acks
+    def __init__(self, port):
+        self._mavlink           = mavutil.mavlink_connection("udpin:localhost:{0}".format(port))
+        self._finished          = False
+        self._vehicleSeen       = threading.Event()
+        self._uploadDone        = threading.Event()
+        self.success            = None
+        self.uploader           = TagUploader(self._sendTunnelCommand, self._uploadComplete)
+        self._receiveThread     = threading.Thread(target = self._receiveLoop, name = "UploadLink", daemon = True)
+        self._receiveThread.start()
+
+    def close(self):
+        self.uploader.stop()
+        self._finished = True
+        self._receiveThread.join()
+        self._mavlink.close()
+
+    def waitForVehicle(self, timeoutSecs):
+        # udpin only knows where to send once the simulator has sent something
+        return self._vehicleSeen.wait(timeoutSecs)
+
+    def upload(self, tags, timeoutSecs):
+        # Returns True or False from the uploader, None if it did not finish in time
+        self.success = None
+        self._uploadDone.clear()
+        self.uploader.start(tags, SdrType.SDR_TYPE_AIRSPY_MINI)
+        self._uploadDone.wait(timeoutSecs)
+        return self.success
+
+    def _uploadComplete(self, success):
+        self.success = success
+        self._uploadDone.set()
+
+    def _sendTunnelCommand(self, tunnelMsg):
+        TunnelMessageHandler.sendTunnelCommand(self._mavlink, tunnelMsg)
+
+    def _receiveLoop(self):
+        while not self._finished:
+            mavlinkMsg = self._mavlink.recv_match(type = "TUNNEL", blocking = True, timeout = 0.1)
+            if mavlinkMsg is None:
+                continue
+            self._vehicleSeen.set()
+            decoded = TunnelMessageHandler.processMavlinkMessage(mavlinkMsg)
+            if decoded and decoded[0] == TunnelCommand.COMMAND_ID_ACK:
+                self.uploader.handleAck(decoded[1])
+
+def makeTags(tagCount):
+    tags = []
+    for tagIndex in range(tagCount):
+        extTagInfo = ExtendedTagInfo()
+        extTagInfo.tagInfo.hdr_command          = TunnelCommand.COMMAND_ID_TAG
+        extTagInfo.tagInfo.id                   = 2 + tagIndex * 2
+        extTagInfo.tagInfo.frequency_hz         = 146000000 + tagIndex * 10000
+        extTagInfo.tagInfo.intra_pulse1_msecs   = 1000
+        extTagInfo.tagInfo.k                    = Settings.k
+        tags.append(extTagInfo)
+    return tags
+
+class UploadBenchmark:
+    def __init__(self, tagCount, windowSizes, lossProbabilities, ackDelaySecs, runs, port, timeoutSecs):
+        self._tags              = makeTags(tagCount)
+        self._windowSizes       = windowSizes
+        self._lossProbabilities = lossProbabilities
+        self._runs              = runs
+        self._timeoutSecs       = timeoutSecs
+        self._simulator         = VehicleSimulator("udpout:localhost:{0}".format(port), ackDelaySecs = ackDelaySecs, seed = 1)
+        self._port              = port
+
+    def run(self):
+        AppGlobal.scheduler = Scheduler()
+        AppGlobal.scheduler.start()
+        uploadLink = UploadLink(self._port)
+        self._simulator.start()
+        try:
+            if not uploadLink.waitForVehicle(5):
+                print("No messages from the simulator")
+                return
+            for lossProbability in self._lossProbabilities:
+                for windowSize in self._windowSizes:
+                    self._runUploads(uploadLink, windowSize, lossProbability)
+        finally:
+            uploadLink.close()
+            self._simulator.stop()
+            AppGlobal.scheduler.stop()
+
+    def _runUploads(self, uploadLink, windowSize, lossProbability):
+        Settings.tagUploadWindowSize            = windowSize
+        self._simulator.ackLossProbability      = lossProbability
+        durations = []
+        retransmits = restarts = failures = 0
+        for _ in range(self._runs):
+            success = uploadLink.upload(self._tags, self._timeoutSecs)
+            if not success:
+                failures += 1
+                uploadLink.uploader.stop()
+                continue
+            durations.append(uploadLink.uploader.durationSecs)
+            retransmits += uploadLink.uploader.retransmitCount
+            restarts    += uploadLink.uploader.restartCount
+        print("ack loss {0:4.0%}  window {1:2d}  upload mean:max {2:6.2f} {3:6.2f} s  retransmits:restarts per upload {4:5.2f} {5:5.2f}  failed {6}".format(
+              lossProbability, windowSize, statistics.mean(durations) if durations else float("nan"), max(durations, default = float("nan")),
+              retransmits / self._runs, restarts / self._runs, failures))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Tag upload time against a simulated vehicle which drops and delays acks")
+    parser.add_argument("--tags",       type = int,     default = 50)
+    parser.add_argument("--windows",    default = "1,8",    help = "comma separated upload window sizes")
+    parser.add_argument("--loss",       default = "0,0.02", help = "comma separated ack loss probabilities")
+    parser.add_argument("--ack-delay",  type = float,   default = 0.25, help = "ack delay in seconds, roughly the round trip time")
+    parser.add_argument("--runs",       type = int,     default = 5)
+    parser.add_argument("--port",       type = int,     default = 14590)
+    parser.add_argument("--timeout",    type = float,   default = 300.0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='[%(levelname)s] %(message)s |  %(filename)s:%(lineno)d')
+    benchmark = UploadBenchmark(args.tags, [ int(window) for window in args.windows.split(",") ], [ float(loss) for loss in args.loss.split(",") ],
+                                args.ack_delay, args.runs, args.port, args.timeout)
+    benchmark.run()
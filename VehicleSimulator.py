@@ -0,0 +1,304 @@
+from TunnelMessage import *
+
+import argparse
+import collections
+import ctypes
+import heapq
+import itertools
+import logging
+import math
+import random
+import threading
+import time
+
+from pymavlink import mavutil
+
+# Local stand-in for a vehicle running MavlinkTagController. Speaks the TUNNEL protocol from TunnelMessage.py:
+# sends vehicle and controller heartbeats, acks the tag upload sequence and emits a stream of TunnelPulseInfo
+# messages for the uploaded tags while detection is running. The controller can be rebooted, which silences it for a while
+# and brings it back idle with no tags, to exercise pyTracker's resync. Raw captures produce captureBytes of seeded
+# random data which is served through the capture retrieval extension. Command acks can be dropped and delayed to
+# exercise the tag upload retries.
+class VehicleSimulator(threading.Thread):
+    _commandStructs = {
+        TunnelCommand.COMMAND_ID_START_TAGS:        TunnelStartTags,
+        TunnelCommand.COMMAND_ID_END_TAGS:          TunnelEndTags,
+        TunnelCommand.COMMAND_ID_TAG:               TunnelTagInfo,
+        TunnelCommand.COMMAND_ID_START_DETECTION:   TunnelStartDetection,
+        TunnelCommand.COMMAND_ID_STOP_DETECTION:    TunnelStopDetection,
+        TunnelCommand.COMMAND_ID_RAW_CAPTURE:       TunnelRawCapture,
+        TunnelCommand.COMMAND_ID_CAPTURE_REQUEST:   TunnelCaptureRequest,
+    }
+
+    def __init__(self, connectionString = "udpout:localhost:14550", systemId = 1, pulseRateHz = None, tagCount = None, jitterSecs = 0.0, lossProbability = 0.0, rebootEverySecs = None, rebootSecs = 3.0, captureBytes = 1000000, captureSecs = 2.0,
+                 ackLossProbability = 0.0, ackDelaySecs = 0.0, seed = None):
+        super().__init__(daemon = True)
+        self._connectionString  = connectionString
+        self._systemId          = systemId
+        self.pulseRateHz        = pulseRateHz       # Pulses per second per tag, None to use the tag intra pulse time
+        self.tagCount           = tagCount          # Only emit pulses for the first tagCount uploaded tags, None for all
+        self.jitterSecs         = jitterSecs
+        self.lossProbability    = lossProbability
+        self.status             = HeartbeatStatus.HEARTBEAT_STATUS_IDLE
+        self.pulsesSent         = 0
+        self.pulsesSentByTag    = collections.Counter()     # Tag id -> pulses sent
+        self.pulsesDropped      = 0
+        self._tags              = []
+        self._pulseSchedule     = []
+        self._finished          = False
+        self._random            = random.Random(seed)
+        self.rebootEverySecs    = rebootEverySecs   # Reboot the controller periodically, None for never
+        self.rebootSecs         = rebootSecs        # How long the controller is silent while rebooting
+        self.rebootCount        = 0
+        self.bootTime           = None              # When the controller last came back from a reboot
+        self._rebootUntil       = 0
+        self._rebootRequested   = False
+        self.captureBytes       = captureBytes
+        self.captureSecs        = captureSecs
+        self.captureId          = 0
+        self.captureData        = b""
+        self.chunksSent         = 0
+        self._captureEndTime    = None
+        self.ackLossProbability = ackLossProbability
+        self.ackDelaySecs       = ackDelaySecs
+        self.acksSent           = 0
+        self.acksDropped        = 0
+        self._delayedAcks       = []                # Heap of [send time, sequence, ack]
+        self._ackSequence       = itertools.count()
+
+    def stop(self):
+        self._finished = True
+
+    def reboot(self):
+        # Thread safe, the reboot happens on the simulator thread
+        self._rebootRequested = True
+
+    def rebooting(self):
+        return time.time() < self._rebootUntil
+
+    def _startReboot(self, now):
+        logging.info("VehicleSimulator: controller rebooting for %.1f secs", self.rebootSecs)
+        self._rebootRequested   = False
+        self._rebootUntil       = now + self.rebootSecs
+        self.bootTime           = self._rebootUntil
+        self.rebootCount        += 1
+        self._tags              = []
+        self._pulseSchedule     = []
+        self._delayedAcks       = []
+        self.status             = HeartbeatStatus.HEARTBEAT_STATUS_IDLE
+
+    def run(self):
+        self._mavlink = mavutil.mavlink_connection(self._connectionString, source_system = self._systemId, source_component = 1)
+        lastHeartbeatTime = 0
+        nextRebootTime = time.time() + self.rebootEverySecs if self.rebootEverySecs else None
+        while not self._finished:
+            curTime = time.time()
+            if self._rebootRequested or (nextRebootTime and curTime >= nextRebootTime):
+                self._startReboot(curTime)
+                nextRebootTime = curTime + self.rebootEverySecs if self.rebootEverySecs else None
+            rebooting = curTime < self._rebootUntil
+            if self._captureEndTime and curTime >= self._captureEndTime:
+                self._finishCapture()
+            if curTime - lastHeartbeatTime >= 1 and not rebooting:
+                self._sendHeartbeats()
+                lastHeartbeatTime = curTime
+
+            mavlinkMsg = self._mavlink.recv_match(type="TUNNEL", blocking=True, timeout=self._nextWakeupSecs(lastHeartbeatTime + 1))
+            while mavlinkMsg:
+                # A rebooting controller does not see commands
+                if not rebooting:
+                    self._handleTunnelMessage(mavlinkMsg)
+                mavlinkMsg = self._mavlink.recv_match(type="TUNNEL", blocking=False)
+
+            self._sendDuePulses()
+            self._sendDueAcks()
+
+    def _nextWakeupSecs(self, nextHeartbeatTime):
+        nextWakeup = nextHeartbeatTime
+        if self._pulseSchedule:
+            nextWakeup = min(nextWakeup, self._pulseSchedule[0][0])
+        if self._delayedAcks:
+            nextWakeup = min(nextWakeup, self._delayedAcks[0][0])
+        return max(nextWakeup - time.time(), 0.0)
+
+    def _sendHeartbeats(self):
+        self._mavlink.mav.heartbeat_send(mavutil.mavlink.MAV_TYPE_QUADROTOR, mavutil.mavlink.MAV_AUTOPILOT_PX4, 0, 0, 0)
+        heartbeat = TunnelHeartbeat()
+        heartbeat.hdr_command   = TunnelCommand.COMMAND_ID_HEARTBEAT
+        heartbeat.system_id     = HeartbeatSystemId.HEARTBEAT_SYSTEM_ID_MAVLINKCONTROLLER
+        heartbeat.status        = self.status
+        TunnelMessageHandler.sendTunnelCommand(self._mavlink, heartbeat)
+
+    def _handleTunnelMessage(self, mavlinkMsg):
+        payloadBytes    = bytearray(mavlinkMsg.payload[:mavlinkMsg.payload_length])
+        command         = TunnelMessageHandler._commandStruct.unpack_from(payloadBytes)[0]
+        tunnelStruct    = self._commandStructs.get(command)
+        if tunnelStruct is None or len(payloadBytes) != ctypes.sizeof(tunnelStruct):
+            logging.warning("VehicleSimulator: unexpected command:length %d %d", command, len(payloadBytes))
+            return
+        tunnelMsg = tunnelStruct.from_buffer(payloadBytes)
+
+        if command == TunnelCommand.COMMAND_ID_START_TAGS:
+            self._tags = []
+            self._pulseSchedule = []
+            self.status = HeartbeatStatus.HEARTBEAT_STATUS_RECEIVING_TAGS
+        elif command == TunnelCommand.COMMAND_ID_TAG:
+            self._tags.append(tunnelMsg)
+        elif command == TunnelCommand.COMMAND_ID_END_TAGS:
+            self.status = HeartbeatStatus.HEARTBEAT_STATUS_HAS_TAGS
+        elif command == TunnelCommand.COMMAND_ID_START_DETECTION:
+            self.status = HeartbeatStatus.HEARTBEAT_STATUS_DETECTING
+            self._startPulses()
+        elif command == TunnelCommand.COMMAND_ID_STOP_DETECTION:
+            self.status = HeartbeatStatus.HEARTBEAT_STATUS_HAS_TAGS
+            self._pulseSchedule = []
+        elif command == TunnelCommand.COMMAND_ID_RAW_CAPTURE:
+            # Detection stops for the capture, afterwards the controller is left with its tags but not detecting
+            self.status = HeartbeatStatus.HEARTBEAT_STATUS_CAPTURE
+            self._pulseSchedule = []
+            self._captureEndTime = time.time() + self.captureSecs
+        elif command == TunnelCommand.COMMAND_ID_CAPTURE_REQUEST:
+            # Answered with info or chunks, not acked
+            self._handleCaptureRequest(tunnelMsg)
+            return
+        self._sendAck(command)
+
+    def _finishCapture(self):
+        self._captureEndTime    = None
+        self.captureId          += 1
+        self.captureData        = random.Random(self.captureId).randbytes(self.captureBytes)
+        self.status             = HeartbeatStatus.HEARTBEAT_STATUS_HAS_TAGS if self._tags else HeartbeatStatus.HEARTBEAT_STATUS_IDLE
+        logging.info("VehicleSimulator: capture %d complete, %d bytes", self.captureId, len(self.captureData))
+
+    def _handleCaptureRequest(self, request):
+        if request.chunk_count == 0:
+            info = TunnelCaptureInfo()
+            info.hdr_command            = TunnelCommand.COMMAND_ID_CAPTURE_INFO
+            info.capture_id             = self.captureId
+            info.total_bytes            = len(self.captureData)
+            info.chunk_size             = captureChunkDataSize
+            info.sample_rate_hz         = 3000000
+            info.center_frequency_hz    = 146000000
+            info.sdr_type               = SdrType.SDR_TYPE_AIRSPY_MINI
+            TunnelMessageHandler.sendTunnelCommand(self._mavlink, info)
+            return
+        if request.capture_id != self.captureId:
+            return
+        chunk = TunnelCaptureChunk()
+        chunk.hdr_command   = TunnelCommand.COMMAND_ID_CAPTURE_CHUNK
+        chunk.capture_id    = self.captureId
+        chunkCount          = (len(self.captureData) + captureChunkDataSize - 1) // captureChunkDataSize
+        for chunkIndex in range(request.first_chunk, min(request.first_chunk + request.chunk_count, chunkCount)):
+            self.chunksSent += 1
+            if self._random.random() < self.lossProbability:
+                continue
+            data = self.captureData[chunkIndex * captureChunkDataSize:(chunkIndex + 1) * captureChunkDataSize]
+            chunk.chunk_index   = chunkIndex
+            chunk.data_length   = len(data)
+            ctypes.memmove(chunk.data, data, len(data))
+            TunnelMessageHandler.sendTunnelCommand(self._mavlink, chunk)
+
+    def _sendAck(self, command):
+        if self._random.random() < self.ackLossProbability:
+            self.acksDropped += 1
+            return
+        ack = TunnelAck()
+        ack.hdr_command = TunnelCommand.COMMAND_ID_ACK
+        ack.command     = command
+        ack.result      = CommandResult.COMMAND_RESULT_SUCCESS
+        if self.ackDelaySecs:
+            heapq.heappush(self._delayedAcks, [ time.time() + self.ackDelaySecs, next(self._ackSequence), ack ])
+            return
+        self._sendTunnelAck(ack)
+
+    def _sendDueAcks(self):
+        now = time.time()
+        while self._delayedAcks and self._delayedAcks[0][0] <= now:
+            self._sendTunnelAck(heapq.heappop(self._delayedAcks)[2])
+
+    def _sendTunnelAck(self, ack):
+        self.acksSent += 1
+        TunnelMessageHandler.sendTunnelCommand(self._mavlink, ack)
+
+    def _startPulses(self):
+        # Schedule entries: [next pulse time, schedule index, tag, pulse count]
+        now = time.time()
+        pulsingTags = self._tags if self.tagCount is None else self._tags[:self.tagCount]
+        self._pulseSchedule = [ [ now + self._random.uniform(0, self._pulseIntervalSecs(tagInfo)), index, tagInfo, 0 ] for index, tagInfo in enumerate(pulsingTags) ]
+        heapq.heapify(self._pulseSchedule)
+
+    def _pulseIntervalSecs(self, tagInfo):
+        if self.pulseRateHz:
+            return 1.0 / self.pulseRateHz
+        return tagInfo.intra_pulse1_msecs / 1000.0
+
+    def _sendDuePulses(self):
+        now = time.time()
+        while self._pulseSchedule and self._pulseSchedule[0][0] <= now:
+            entry = heapq.heappop(self._pulseSchedule)
+            [ pulseTime, index, tagInfo, pulseCount ] = entry
+            if self._random.random() < self.lossProbability:
+                self.pulsesDropped += 1
+            else:
+                self._sendPulse(tagInfo, pulseCount, now)
+            entry[0] = pulseTime + self._pulseIntervalSecs(tagInfo) + self._random.uniform(-self.jitterSecs, self.jitterSecs)
+            entry[3] = pulseCount + 1
+            heapq.heappush(self._pulseSchedule, entry)
+
+    def _sendPulse(self, tagInfo, pulseCount, now):
+        # start_time_seconds is stamped with the local wall clock so receivers can measure end to end latency
+        k       = max(tagInfo.k, 1)
+        heading = (pulseCount * 0.5) % (2 * math.pi)
+        pulseInfo = TunnelPulseInfo()
+        pulseInfo.hdr_command                   = TunnelCommand.COMMAND_ID_PULSE
+        pulseInfo.tag_id                        = tagInfo.id
+        pulseInfo.frequency_hz                  = tagInfo.frequency_hz
+        pulseInfo.start_time_seconds            = now
+        pulseInfo.predict_next_start_seconds    = now + self._pulseIntervalSecs(tagInfo)
+        pulseInfo.snr                           = 10.0 + 5.0 * math.cos(heading) + self._random.gauss(0, 0.5)
+        pulseInfo.stft_score                    = pulseInfo.snr
+        pulseInfo.group_seq_counter             = (pulseCount // k) & 0xFFFF
+        pulseInfo.group_ind                     = pulseCount % k + 1
+        pulseInfo.group_snr                     = pulseInfo.snr
+        pulseInfo.noise_psd                     = 1e-6
+        pulseInfo.detection_status              = 1
+        pulseInfo.confirmed_status              = 1
+        pulseInfo.orientation_z                 = math.sin(heading / 2)
+        pulseInfo.orientation_w                 = math.cos(heading / 2)
+        TunnelMessageHandler.sendTunnelCommand(self._mavlink, pulseInfo)
+        self.pulsesSent += 1
+        self.pulsesSentByTag[tagInfo.id] += 1
+
+def vehicleConnectionString(connectionString, vehicleIndex):
+    # Vehicle N uses the base connection port + N, e.g. udpout:localhost:14550, udpout:localhost:14551, ...
+    prefix, port = connectionString.rsplit(":", 1)
+    return "{0}:{1}".format(prefix, int(port) + vehicleIndex)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Simulated vehicle running MavlinkTagController")
+    parser.add_argument("--connection",     default = "udpout:localhost:14550")
+    parser.add_argument("--system-id",      type = int,     default = 1)
+    parser.add_argument("--rate",           type = float,   default = None,     help = "pulses per second per tag, default is the tag intra pulse time")
+    parser.add_argument("--tag-count",      type = int,     default = None,     help = "only pulse the first N uploaded tags")
+    parser.add_argument("--jitter",         type = float,   default = 0.0,      help = "pulse time jitter in seconds")
+    parser.add_argument("--loss",           type = float,   default = 0.0,      help = "pulse loss probability")
+    parser.add_argument("--vehicles",       type = int,     default = 1,        help = "number of vehicles, each on the next port with the next system id")
+    parser.add_argument("--reboot-every",   type = float,   default = None,     help = "reboot the controller every N seconds")
+    parser.add_argument("--reboot-secs",    type = float,   default = 3.0,      help = "how long a controller reboot takes")
+    parser.add_argument("--capture-bytes",  type = int,     default = 1000000,  help = "size of each raw capture")
+    parser.add_argument("--ack-loss",       type = float,   default = 0.0,      help = "command ack loss probability")
+    parser.add_argument("--ack-delay",      type = float,   default = 0.0,      help = "command ack delay in seconds")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='[%(levelname)s] %(message)s |  %(filename)s:%(lineno)d')
+    simulators = [ VehicleSimulator(vehicleConnectionString(args.connection, vehicleIndex), args.system_id + vehicleIndex, args.rate, args.tag_count, args.jitter, args.loss, args.reboot_every, args.reboot_secs, args.capture_bytes,
+                                   ackLossProbability = args.ack_loss, ackDelaySecs = args.ack_delay)
+                   for vehicleIndex in range(args.vehicles) ]
+    for simulator in simulators:
+        simulator.start()
+    try:
+        while all(simulator.is_alive() for simulator in simulators):
+            simulators[0].join(1)
+    except KeyboardInterrupt:
+        for simulator in simulators:
+            simulator.stop()
@@ -1,68 +1,91 @@
 from MavlinkThread import *
+from Scheduler import *
+from TelemetryLog import *
+from Metrics import *
 import AppGlobal
-from Timer import *
 
-import tkinter as tk
+import argparse
 import logging
 import threading
 
 mavlinkThread = None
 
-class App(tk.Tk):
-    def __init__(self):
-        super().__init__()
-        
-        self._updateUIPending = False
-        self.mainloopRunning = False
+def startScheduler():
+    AppGlobal.scheduler = Scheduler()
+    AppGlobal.scheduler.start()
 
-        self.geometry( "600x400" )
-        self.controllerHeartbeatIndicator = tk.Frame(self, width = 50, bg = "red")
-        self.controllerHeartbeatIndicator.pack(fill=tk.Y, side=tk.LEFT)
-        self.detectorsFrame = tk.Frame(self, bg = "white")
-        self.detectorsFrame.pack(expand=True, fill=tk.BOTH, side=tk.LEFT, padx=10, pady=10)
-
-    def updateUI(self):
-        # Allow multiple calls to updateUI() to be coalesced into a single call to _updateUI()
-        if not self._updateUIPending:
-            self._updateUIPending = True
-            self.after(200, self._updateUI)
-
-    def _updateUI(self):
-        self._updateUIPending = False
-        self.controllerHeartbeatIndicator.config(bg = "red" if mavlinkThread.commandHandler.controllerLostHeartbeat else "green")
-        if len(self.detectorsFrame.winfo_children()) == 0:
-            self._createDetectorUI()
-        else:
-            self._updateDetectorUI()
-
-    def _createDetectorUI(self):
-        logging.info("Creating detector UI")
-        for detectorInfo in mavlinkThread.commandHandler.detectorInfoList:
-            logging.info("Creating detector UI for detector id {0}".format(detectorInfo.tagId)) 
-            detectorFrame = tk.Frame(self.detectorsFrame, bg="red", borderwidth=2, relief=tk.RAISED)
-            detectorFrame.pack(expand=True, fill=tk.BOTH)
-
-    def _updateDetectorUI(self):
-        logging.info("Updating detector UI")
-        pass
-
-    def shutdown(self):
-        self.destroy()
+def createMavlinkThread(connectionStrings = "udpin:localhost:14550", tagFilePaths = None, recordingDirectory = None):
+    # One vehicle per connection string, all handled by the same MavlinkThread
+    global mavlinkThread
+    mavlinkThread = MavlinkThread(connectionStrings, tagFilePaths, recordingDirectory)
+    return mavlinkThread
 
-def startMavlinkThread():
+def createReplayThread(recordingPath, speed, tagFilePath = None):
+    # Replay stands in for the MAVLink thread, feeding a recording through a CommandHandler with no vehicle link
     global mavlinkThread
-    mavlinkThread = MavlinkThread()
+    mavlinkThread = TunnelReplay(recordingPath, CommandHandler(None, tagFilePath), StateDeltaQueue(Settings.callbackQueueSize), speed)
+    return mavlinkThread
+
+def runHeadless():
+    shutdownEvent = threading.Event()
+    AppGlobal.addShutdownListener(shutdownEvent.set)
     mavlinkThread.start()
+    try:
+        while not shutdownEvent.wait(1):
+            if not mavlinkThread.is_alive():
+                break
+    except KeyboardInterrupt:
+        pass
 
-if __name__ == "__main__":
-    logging.basicConfig(level=logging.INFO, format='[%(levelname)s] %(message)s |  %(filename)s:%(lineno)d')
-    AppGlobal.app = App()
-    AppGlobal.app.after(500, startMavlinkThread)
+def runUI():
+    # Tk is only imported when there is a UI, so headless systems do not need it installed
+    from TrackerUI import App
+    AppGlobal.app = App(mavlinkThread)
+    # The MAVLink thread (pymavlink import and vehicle connections) starts once the first frame is up
+    AppGlobal.app.after_idle(mavlinkThread.start)
     try:
         AppGlobal.app.mainloopRunning = True
         AppGlobal.app.mainloop()
     except:
         pass
     AppGlobal.app.mainloopRunning = False
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Ground station for MavlinkTagController")
+    parser.add_argument("--headless",   action = "store_true",  help = "run without a UI")
+    parser.add_argument("--connection", action = "append",      help = "vehicle connection, repeat for multiple vehicles, default is udpin:localhost:14550")
+    parser.add_argument("--tag-file",   action = "append",      help = "tag file, default is ~/TagInfo.txt. Give once for all vehicles or once per vehicle")
+    parser.add_argument("--record-dir", default = Settings.recordingDirectory, help = "directory for flight recordings")
+    parser.add_argument("--tag-cache-dir", default = Settings.tagCacheDirectory, help = "directory for compiled tag file caches")
+    parser.add_argument("--no-record",  action = "store_true",  help = "do not record TUNNEL messages")
+    parser.add_argument("--replay",     default = None,         help = "replay a flight recording instead of connecting to a vehicle")
+    parser.add_argument("--speed",      type = float, default = 1.0, help = "replay speed as a multiple of real time, 0 for as fast as possible")
+    parser.add_argument("--log-level",  default = "INFO",       help = "DEBUG logs every pulse, INFO logs periodic per tag summaries")
+    parser.add_argument("--log-file",   default = None,         help = "also write the log to this file")
+    parser.add_argument("--metrics-file", default = None,       help = "periodically write a JSON metrics snapshot to this file")
+    parser.add_argument("--metrics-port", type = int, default = Settings.metricsHttpPort, help = "serve JSON metrics on http://127.0.0.1:PORT/metrics, 0 for none")
+    args = parser.parse_args()
+    Settings.tagCacheDirectory = args.tag_cache_dir
+
+    startQueueLogging(getattr(logging, args.log_level.upper()), logFilePath = args.log_file)
+    metricsExporter = MetricsExporter(args.metrics_file, args.metrics_port)
+    metricsExporter.start()
+    startScheduler()
+    if args.replay:
+        createReplayThread(args.replay, args.speed, args.tag_file[0] if args.tag_file else None)
+    else:
+        connectionStrings   = args.connection or [ "udpin:localhost:14550" ]
+        tagFilePaths        = args.tag_file or [ None ]
+        if len(tagFilePaths) not in (1, len(connectionStrings)):
+            parser.error("--tag-file must be given once or once per --connection")
+        createMavlinkThread(connectionStrings, tagFilePaths, None if args.no_record else args.record_dir)
+    if args.headless:
+        runHeadless()
+    else:
+        runUI()
     mavlinkThread.stop()
-    mavlinkThread.join()
\ No newline at end of file
+    if mavlinkThread.is_alive():
+        mavlinkThread.join()
+    AppGlobal.scheduler.stop()
+    metricsExporter.stop()
+    stopQueueLogging()
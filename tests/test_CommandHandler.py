@@ -0,0 +1,104 @@
+import pytest
+
+from Settings import *
+from Scheduler import *
+from CommandHandler import *
+import AppGlobal
+
+@pytest.fixture
+def tagFile(tmp_path, monkeypatch):
+    # Writes a tag file of (id, ip_msecs_1, ip_msecs_2) tags and returns its path
+    monkeypatch.setattr(Settings, "tagCacheDirectory", str(tmp_path / "cache"))
+    tagFilePath = tmp_path / "TagInfo.txt"
+    def writeTags(tags):
+        lines = [ "{0},tag{0},{1},{2},-,{3},-,15,60,5".format(tagId, 146000000 + index * 10000, ip1Msecs, ip2Msecs) for index, [ tagId, ip1Msecs, ip2Msecs ] in enumerate(tags) ]
+        tagFilePath.write_text("\n".join(lines) + "\n")
+        return tagFilePath
+    return writeTags
+
+@pytest.fixture
+def scheduler():
+    AppGlobal.scheduler = Scheduler()
+    AppGlobal.scheduler.start()
+    yield AppGlobal.scheduler
+    AppGlobal.scheduler.stop()
+
+def convergeEstimator(detectorInfo, intervalSecs):
+    detectorInfo.intervalEstimator = IntervalEstimator(detectorInfo.intraPulseMsecs)
+    for pulseIndex in range(200):
+        detectorInfo.intervalEstimator.addPulse(pulseIndex * intervalSecs + (pulseIndex % 3) * 0.001)
+    assert detectorInfo.intervalEstimator.isConverged()
+
+def reloadedTags(tagFilePath):
+    tagInfoList = TagInfoList(tagFilePath)
+    tagInfoList.loadTags()
+    return tagInfoList.activeTags()
+
+def test_interval_estimates_follow_unchanged_tags(tagFile, scheduler):
+    # Replay mode (no sender) sets up the detectors from the tag file right away
+    tagFilePath     = tagFile([ [ 2, 1000, 1500 ] ])
+    commandHandler  = CommandHandler(None, tagFilePath)
+    convergeEstimator(commandHandler.detectorInfoList.getDetectorInfo(2), 1.0)
+    convergeEstimator(commandHandler.detectorInfoList.getDetectorInfo(3), 1.5)
+    tags = reloadedTags(tagFilePath)
+    assert commandHandler._applyIntervalEstimates(tags)
+    assert tags[0].tagInfo.ip1_mu == pytest.approx(1.0, abs = 0.002)
+    assert tags[0].tagInfo.ip2_mu == pytest.approx(1.5, abs = 0.002)
+    commandHandler.stop()
+
+def test_reloaded_tags_do_not_get_stale_interval_estimates(tagFile, scheduler):
+    # Tag 2's intra pulse time changed and its second rate was dropped, the learned estimates no longer apply
+    commandHandler  = CommandHandler(None, tagFile([ [ 2, 1000, 1500 ] ]))
+    convergeEstimator(commandHandler.detectorInfoList.getDetectorInfo(2), 1.0)
+    convergeEstimator(commandHandler.detectorInfoList.getDetectorInfo(3), 1.5)
+    tags = reloadedTags(tagFile([ [ 2, 2000, 0 ] ]))
+    assert not commandHandler._applyIntervalEstimates(tags)
+    assert tags[0].tagInfo.intra_pulse1_msecs == 2000
+    assert [ tags[0].tagInfo.ip1_mu, tags[0].tagInfo.ip1_sigma, tags[0].tagInfo.ip2_mu, tags[0].tagInfo.ip2_sigma ] == [ 0, 0, 0, 0 ]
+    commandHandler.stop()
+
+class RecordingSender:
+    def __init__(self):
+        self.captureRequests = []
+
+    def sendTunnelCommand(self, tunnelMsg):
+        if tunnelMsg.hdr_command == TunnelCommand.COMMAND_ID_CAPTURE_REQUEST:
+            self.captureRequests.append([ tunnelMsg.capture_id, tunnelMsg.first_chunk, tunnelMsg.chunk_count ])
+
+def controllerHeartbeat(status):
+    heartbeat = TunnelHeartbeat()
+    heartbeat.hdr_command   = TunnelCommand.COMMAND_ID_HEARTBEAT
+    heartbeat.system_id     = HeartbeatSystemId.HEARTBEAT_SYSTEM_ID_MAVLINKCONTROLLER
+    heartbeat.status        = status
+    return heartbeat
+
+def captureInfo(captureId):
+    info = TunnelCaptureInfo()
+    info.hdr_command            = TunnelCommand.COMMAND_ID_CAPTURE_INFO
+    info.capture_id             = captureId
+    info.total_bytes            = captureChunkDataSize * 4
+    info.chunk_size             = captureChunkDataSize
+    info.center_frequency_hz    = 146000000
+    return info
+
+def test_capture_download_skips_the_previous_capture(tagFile, scheduler, tmp_path, monkeypatch):
+    # A controller slow to report CAPTURE still reports its old status after the ack, so the download starts while
+    # the controller still has the previous capture. That one must not be downloaded.
+    monkeypatch.setattr(Settings, "captureDirectory", str(tmp_path / "captures"))
+    sender          = RecordingSender()
+    commandHandler  = CommandHandler(sender, tagFile([ [ 2, 1000, 0 ] ]))
+    commandHandler._handleTunnelHeartbeat(controllerHeartbeat(HeartbeatStatus.HEARTBEAT_STATUS_HAS_TAGS))
+    commandHandler.startRawCapture()
+    commandHandler._captureDownloader.handleInfo(captureInfo(4))
+    ack = TunnelAck()
+    ack.hdr_command = TunnelCommand.COMMAND_ID_ACK
+    ack.command     = TunnelCommand.COMMAND_ID_RAW_CAPTURE
+    ack.result      = CommandResult.COMMAND_RESULT_SUCCESS
+    commandHandler._handleTunnelAck(ack)
+    commandHandler._handleTunnelHeartbeat(controllerHeartbeat(HeartbeatStatus.HEARTBEAT_STATUS_HAS_TAGS))
+    commandHandler._captureDownloader.handleInfo(captureInfo(4))
+    assert sender.captureRequests == [ [ 0, 0, 0 ], [ 0, 0, 0 ] ]
+    commandHandler._captureDownloader.handleInfo(captureInfo(5))
+    assert sender.captureRequests[2] == [ 5, 0, 4 ]
+    assert commandHandler.captureProgress() == [ 0, 4 ]
+    commandHandler.stop()
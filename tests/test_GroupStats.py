@@ -0,0 +1,61 @@
+import time
+
+import pytest
+
+from GroupStats import *
+
+class FakeClock:
+    def __init__(self):
+        self.secs = 100.0
+
+    def __call__(self):
+        return self.secs
+
+class Pulse:
+    def __init__(self, groupInd):
+        self.group_ind          = groupInd
+        self.noise_psd          = 1e-6
+        self.stft_score         = 10.0
+        self.group_snr          = 10.0
+        self.detection_status   = 1
+
+@pytest.fixture
+def clock(monkeypatch):
+    fakeClock = FakeClock()
+    monkeypatch.setattr(time, "perf_counter", fakeClock)
+    return fakeClock
+
+def addGroup(groupStats, seqCtr, k = 3):
+    for groupInd in range(1, k + 1):
+        groupStats.addPulse(Pulse(groupInd), seqCtr, 10.0)
+
+def test_confirmation_latency_runs_from_first_report(clock):
+    groupStats = GroupStats(3)
+    groupStats.addReport(7)
+    clock.secs += 0.5
+    groupStats.addReport(7)            # Later reports of the same group do not move its start
+    clock.secs += 1.0
+    addGroup(groupStats, 7)
+    groupStats.addReport(7)            # A report of the group already confirmed is ignored
+    clock.secs += 2.0
+    addGroup(groupStats, 8)            # Confirmed without an unconfirmed report first
+    addGroup(groupStats, 9)
+    assert [ group.confirmLatencySecs for group in groupStats.recentGroups() ] == [ 1.5, 0.0 ]
+    assert groupStats.summary(groupStats.recentGroups())[4] == pytest.approx(0.75)
+
+def test_report_of_another_group_does_not_time_the_next_confirmed_group(clock):
+    groupStats = GroupStats(3)
+    groupStats.addReport(4)
+    clock.secs += 5.0
+    addGroup(groupStats, 5)
+    addGroup(groupStats, 6)
+    assert groupStats.recentGroups()[0].confirmLatencySecs == 0.0
+
+def test_missed_pulses_across_sequence_counter_reset(clock):
+    # A controller reboot restarts group_seq_counter, which must not count as missed groups or pulses
+    groupStats = GroupStats(3)
+    addGroup(groupStats, 500)
+    addGroup(groupStats, 0, k = 2)
+    addGroup(groupStats, 1)
+    assert [ group.missedCount for group in groupStats.recentGroups() ] == [ 0, 1 ]
+    assert groupStats.summary(groupStats.recentGroups())[1] == pytest.approx(1 / 6)
@@ -0,0 +1,70 @@
+import os
+import socket
+import time
+
+import pytest
+
+# TUNNEL is a MAVLink 2 message
+os.environ.setdefault("MAVLINK20", "1")
+pytest.importorskip("pymavlink")
+
+from VehicleSimulator import *
+from MavlinkThread import *
+from Scheduler import *
+import AppGlobal
+
+tagIds = [ 2, 4, 6 ]
+
+def freePort():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as probe:
+        probe.bind(("localhost", 0))
+        return probe.getsockname()[1]
+
+def waitFor(condition, timeoutSecs):
+    deadline = time.time() + timeoutSecs
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+@pytest.fixture
+def tracker(tmp_path, monkeypatch):
+    # [ MavlinkThread, VehicleSimulator ] connected over loopback, tracking three tags
+    monkeypatch.setattr(Settings, "tagCacheDirectory", str(tmp_path / "cache"))
+    tagFilePath = tmp_path / "TagInfo.txt"
+    tagFilePath.write_text("".join("{0},resync{0},{1},1000,-,0,-,15,60,5\n".format(tagId, 146000000 + tagId * 10000) for tagId in tagIds))
+    AppGlobal.scheduler = Scheduler()
+    AppGlobal.scheduler.start()
+    port            = freePort()
+    simulator       = VehicleSimulator("udpout:localhost:{0}".format(port), rebootSecs = 1.0)
+    mavlinkThread   = MavlinkThread("udpin:localhost:{0}".format(port), str(tagFilePath))
+    simulator.start()
+    mavlinkThread.start()
+    yield [ mavlinkThread, simulator ]
+    mavlinkThread.stop()
+    mavlinkThread.join()
+    simulator.stop()
+    simulator.join()
+    AppGlobal.scheduler.stop()
+
+def test_controller_reboot_is_resynced(tracker):
+    mavlinkThread, simulator = tracker
+    assert waitFor(lambda: simulator.status == HeartbeatStatus.HEARTBEAT_STATUS_DETECTING, 20)
+    resyncCount     = metrics.counter("vehicle.0.resync.count").value
+    recoveryCount   = metrics.histogram("vehicle.0.resync.recovery_msecs").count
+    # Let pyTracker see the controller detecting with its tags, only then is a reboot a resync rather than startup
+    time.sleep(2.5)
+
+    # The controller comes back idle with no tags, pyTracker has to upload them again and restart detection
+    simulator.reboot()
+    assert waitFor(simulator.rebooting, 5)
+    assert waitFor(lambda: simulator.status == HeartbeatStatus.HEARTBEAT_STATUS_IDLE and simulator._tags == [], 1)
+    assert waitFor(lambda: not simulator.rebooting(), 5)
+    assert waitFor(lambda: simulator.status == HeartbeatStatus.HEARTBEAT_STATUS_DETECTING, 20)
+
+    assert simulator.rebootCount == 1
+    assert [ tagInfo.id for tagInfo in simulator._tags ] == tagIds
+    assert metrics.counter("vehicle.0.resync.count").value == resyncCount + 1
+    assert waitFor(lambda: metrics.histogram("vehicle.0.resync.recovery_msecs").count == recoveryCount + 1, 5)
+    assert waitFor(lambda: simulator.pulsesSent > 0, 5)
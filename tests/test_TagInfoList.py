@@ -0,0 +1,88 @@
+from Settings import *
+from TagInfoList import *
+
+import pytest
+
+sampleRateHz    = 3750000
+channelBwHz     = sampleRateHz / 100
+usableBwHz      = sampleRateHz - channelBwHz
+
+@pytest.fixture
+def tagFile(tmp_path, monkeypatch):
+    # Writes a tag file with one tag per frequency and returns its path
+    monkeypatch.setattr(Settings, "tagCacheDirectory", str(tmp_path / "cache"))
+    tagFilePath = tmp_path / "TagInfo.txt"
+    def writeTags(frequencies):
+        lines = [ "{0},tag{0},{1},1000,-,0,-,15,60,5".format(2 + index * 2, frequencyHz) for index, frequencyHz in enumerate(frequencies) ]
+        tagFilePath.write_text("\n".join(lines) + "\n")
+        return tagFilePath
+    return writeTags
+
+def loadTags(tagFilePath):
+    tagInfoList = TagInfoList(tagFilePath)
+    tagInfoList.loadTags()
+    return tagInfoList
+
+def assertTagsTuned(tuningGroup):
+    # Every tag is in a channel of the band and within half a channel of that channel's center
+    for extTagInfo in tuningGroup.tags:
+        tagInfo = extTagInfo.tagInfo
+        assert 1 <= tagInfo.channelizer_channel_number <= 100
+        assert abs(tagInfo.channelizer_channel_center_frequency_hz - tagInfo.frequency_hz) <= channelBwHz / 2 + 1
+        assert abs(tagInfo.frequency_hz - tuningGroup.radioCenterHz) <= sampleRateHz / 2
+
+def test_tags_within_one_band_use_one_tuning(tagFile):
+    tagInfoList = loadTags(tagFile([ 146000000, 146500000, 147000000, 146000000 + int(usableBwHz) ]))
+    assert len(tagInfoList.tuningGroups) == 1
+    assert len(tagInfoList.activeTags()) == 4
+    assert tagInfoList.unfitTags() == []
+    assertTagsTuned(tagInfoList.activeTuningGroup())
+
+def test_group_is_split_when_tags_span_more_than_the_band(tagFile):
+    frequencies = [ 146000000, 146100000, 146200000, 150000000, 150100000 ]
+    tagInfoList = loadTags(tagFile(frequencies))
+    assert len(tagInfoList.tuningGroups) == 2
+    # Largest group first, it is the one uploaded
+    assert [ len(tuningGroup.tags) for tuningGroup in tagInfoList.tuningGroups ] == [ 3, 2 ]
+    assert sorted(extTagInfo.tagInfo.frequency_hz for extTagInfo in tagInfoList.activeTags()) == frequencies[:3]
+    assert sorted(extTagInfo.tagInfo.frequency_hz for extTagInfo in tagInfoList.unfitTags()) == frequencies[3:]
+    assert tagInfoList.radioCenterHz() == tagInfoList.tuningGroups[0].radioCenterHz
+    for tuningGroup in tagInfoList.tuningGroups:
+        assertTagsTuned(tuningGroup)
+
+def test_adjacent_frequencies_on_a_channel_boundary(tagFile):
+    # The outer tags set the tuning, which puts a channel edge at the radio center. Tags 1 Hz either side of that
+    # edge land in adjacent channels, each within half a channel of its channel center.
+    outerFrequencies    = [ 146000000, 147000000 ]
+    radioCenterHz       = loadTags(tagFile(outerFrequencies)).radioCenterHz()
+    tagInfoList         = loadTags(tagFile(outerFrequencies + [ radioCenterHz - 1, radioCenterHz ]))
+    assert tagInfoList.radioCenterHz() == radioCenterHz
+    belowEdge   = tagInfoList.getTagInfo(6).tagInfo
+    onEdge      = tagInfoList.getTagInfo(8).tagInfo
+    assert onEdge.channelizer_channel_number == belowEdge.channelizer_channel_number + 1
+    assert onEdge.channelizer_channel_center_frequency_hz - belowEdge.channelizer_channel_center_frequency_hz == round(channelBwHz)
+    assertTagsTuned(tagInfoList.activeTuningGroup())
+
+def test_tags_spread_wider_than_the_sample_rate(tagFile):
+    # 60 tags 500 kHz apart cover 29.5 MHz. A tuning covers the usable 3.7125 MHz of the band, 8 of the tags, so
+    # 8 tunings are needed and every tag is in exactly one of them.
+    frequencies = [ 146000000 + index * 500000 for index in range(60) ]
+    tagInfoList = loadTags(tagFile(frequencies))
+    tuningGroups = tagInfoList.tuningGroups
+    assert len(tuningGroups) == 8
+    groupedIds = sorted(extTagInfo.tagInfo.id for tuningGroup in tuningGroups for extTagInfo in tuningGroup.tags)
+    assert groupedIds == sorted(extTagInfo.tagInfo.id for extTagInfo in tagInfoList)
+    assert [ len(tuningGroup.tags) for tuningGroup in tuningGroups ] == sorted((len(tuningGroup.tags) for tuningGroup in tuningGroups), reverse = True)
+    for tuningGroup in tuningGroups:
+        groupFrequencies = [ extTagInfo.tagInfo.frequency_hz for extTagInfo in tuningGroup.tags ]
+        assert max(groupFrequencies) - min(groupFrequencies) <= usableBwHz
+        assertTagsTuned(tuningGroup)
+    assert len(tagInfoList.activeTags()) + len(tagInfoList.unfitTags()) == 60
+
+def test_more_tags_than_channels_in_one_band(tagFile):
+    # Tags closer together than a channel share channels, they still need only one tuning
+    frequencies = [ 146000000 + index * 10000 for index in range(150) ]
+    tagInfoList = loadTags(tagFile(frequencies))
+    assert len(tagInfoList.tuningGroups) == 1
+    assert len(tagInfoList.activeTags()) == 150
+    assertTagsTuned(tagInfoList.activeTuningGroup())
@@ -0,0 +1,53 @@
+import math
+import random
+import statistics
+
+from TagLocalizer import *
+from DetectorInfoList import *
+from BearingEstimator import Bearing
+
+tagX, tagY          = 100.0, 50.0
+surveyRadius        = 200.0
+bearingNoiseDegrees = 3.0
+
+def surveyLocation(bearingCount, randomGenerator):
+    # Bearings taken from around a circle centered on the tag, so the distance noise is the same for every line
+    tagLocation = TagLocation(2)
+    for _ in range(bearingCount):
+        angle       = randomGenerator.uniform(0, 2 * math.pi)
+        positionX   = tagX + surveyRadius * math.cos(angle)
+        positionY   = tagY + surveyRadius * math.sin(angle)
+        bearing     = math.degrees(math.atan2(tagY - positionY, tagX - positionX)) + randomGenerator.gauss(0, bearingNoiseDegrees)
+        tagLocation.addBearing(positionX, positionY, bearing % 360)
+    return tagLocation
+
+def test_estimate_and_error_radius_match_bearing_noise():
+    randomGenerator = random.Random(1)
+    for bearingCount in (20, 1000):
+        errors  = []
+        radii   = []
+        for _ in range(100):
+            tagLocation = surveyLocation(bearingCount, randomGenerator)
+            errors.append(math.hypot(tagLocation.positionX - tagX, tagLocation.positionY - tagY))
+            radii.append(tagLocation.errorRadius)
+        # Lines from all around the tag give a round error ellipse: each axis has the major axis sigma, the 2D error
+        # sigma * sqrt(2), and sigma is the distance noise over sqrt(N / 2)
+        expectedRadius  = surveyRadius * math.radians(bearingNoiseDegrees) / math.sqrt(bearingCount / 2)
+        rmsError        = math.sqrt(statistics.mean(error * error for error in errors))
+        assert 0.8 < statistics.mean(radii) / expectedRadius < 1.25
+        assert 0.8 < rmsError / (math.sqrt(2) * statistics.mean(radii)) < 1.25
+
+def test_error_radius_shrinks_with_bearings():
+    randomGenerator = random.Random(2)
+    radius100 = statistics.mean(surveyLocation(100, randomGenerator).errorRadius for _ in range(50))
+    radius400 = statistics.mean(surveyLocation(400, randomGenerator).errorRadius for _ in range(50))
+    assert 0.4 < radius400 / radius100 < 0.6
+
+def test_rotation_adds_one_bearing_per_tag():
+    # The id and id + 1 detectors of tag 2 both report a bearing from the same rotation
+    detectorInfoList = DetectorInfoList()
+    tagLocations = detectorInfoList.addRotationBearings([ Bearing(2, 90.0, 0.6, 10, 0.0, 0.0), Bearing(3, 95.0, 0.9, 10, 0.0, 0.0), Bearing(4, 45.0, 0.5, 10, 0.0, 0.0) ])
+    assert sorted(tagLocation.tagId for tagLocation in tagLocations) == [ 2, 4 ]
+    tagLocation = detectorInfoList.tagLocation(3)
+    assert tagLocation.observationCount == 1
+    assert tagLocation._weightSum == 0.9
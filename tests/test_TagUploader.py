@@ -0,0 +1,80 @@
+import os
+import socket
+
+import pytest
+
+# TUNNEL is a MAVLink 2 message
+os.environ.setdefault("MAVLINK20", "1")
+pytest.importorskip("pymavlink")
+
+from Settings import *
+from Scheduler import *
+from UploadBenchmark import *
+import AppGlobal
+
+tagCount = 16       # Two full upload windows
+
+def freePort():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as probe:
+        probe.bind(("localhost", 0))
+        return probe.getsockname()[1]
+
+@pytest.fixture
+def scheduler():
+    AppGlobal.scheduler = Scheduler()
+    AppGlobal.scheduler.start()
+    yield AppGlobal.scheduler
+    AppGlobal.scheduler.stop()
+
+@pytest.fixture
+def vehicle(scheduler, tmp_path, monkeypatch):
+    # [ UploadLink, VehicleSimulator ] connected over loopback
+    monkeypatch.setattr(Settings, "tagCacheDirectory", str(tmp_path / "cache"))
+    port        = freePort()
+    uploadLink  = UploadLink(port)
+    simulator   = VehicleSimulator("udpout:localhost:{0}".format(port), seed = 1)
+    simulator.start()
+    assert uploadLink.waitForVehicle(5)
+    yield [ uploadLink, simulator ]
+    uploadLink.close()
+    simulator.stop()
+    simulator.join()
+
+def uploadedTagIds(simulator):
+    return [ tagInfo.id for tagInfo in simulator._tags ]
+
+def test_upload_with_delayed_acks(vehicle):
+    uploadLink, simulator = vehicle
+    simulator.ackDelaySecs = 0.1
+    tags = makeTags(tagCount)
+    assert uploadLink.upload(tags, 10)
+    assert uploadedTagIds(simulator) == [ extTagInfo.tagInfo.id for extTagInfo in tags ]
+    assert simulator.status == HeartbeatStatus.HEARTBEAT_STATUS_HAS_TAGS
+    assert uploadLink.uploader.retransmitCount == 0
+    assert uploadLink.uploader.restartCount == 0
+    # START_TAGS, two windows of tags, END_TAGS: well under the 18 round trips of sending one message at a time
+    assert uploadLink.uploader.durationSecs < 18 * simulator.ackDelaySecs / 2
+
+def test_upload_with_dropped_and_delayed_acks(vehicle):
+    # Lost START_TAGS/END_TAGS acks are retransmitted, a lost TAG ack restarts from START_TAGS. Acks still in flight
+    # from before a restart must not be taken for acks of the new sequence.
+    uploadLink, simulator = vehicle
+    simulator.ackDelaySecs          = 0.02
+    simulator.ackLossProbability    = 0.05
+    tags = makeTags(tagCount)
+    for _ in range(3):
+        assert uploadLink.upload(tags, 60)
+        assert uploadedTagIds(simulator) == [ extTagInfo.tagInfo.id for extTagInfo in tags ]
+        assert simulator.status == HeartbeatStatus.HEARTBEAT_STATUS_HAS_TAGS
+        assert uploadLink.uploader.restartCount <= 15
+        assert uploadLink.uploader.retransmitCount <= 15
+    assert simulator.acksDropped > 0
+
+def test_upload_gives_up_when_no_acks_arrive(vehicle, monkeypatch):
+    uploadLink, simulator = vehicle
+    monkeypatch.setattr(Settings, "tunnelCommandAckTimeoutMsecs", 100)
+    monkeypatch.setattr(Settings, "tunnelCommandMaxAckTimeoutMsecs", 400)
+    simulator.ackLossProbability = 1.0
+    assert uploadLink.upload(makeTags(tagCount), 10) is False
+    assert uploadLink.uploader.retransmitCount == Settings.tunnelCommandMaxRetries
+    assert not uploadLink.uploader.active
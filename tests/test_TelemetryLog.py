@@ -0,0 +1,34 @@
+import logging
+import threading
+
+from TelemetryLog import *
+
+class ThreadRecordingArgument:
+    # Remembers which thread turned it into a string
+    def __init__(self):
+        self.formattedOn = None
+
+    def __str__(self):
+        self.formattedOn = threading.current_thread().name
+        return "argument"
+
+def test_queue_logging_formats_on_listener_thread(monkeypatch, tmp_path):
+    rootLogger = logging.getLogger()
+    monkeypatch.setattr(rootLogger, "handlers", list(rootLogger.handlers))
+    monkeypatch.setattr(rootLogger, "level", rootLogger.level)
+    logFilePath = tmp_path / "pyTracker.log"
+    startQueueLogging(logging.INFO, format = "%(message)s", logFilePath = logFilePath)
+
+    argument = ThreadRecordingArgument()
+    logging.info("value %s", argument)
+    try:
+        raise ValueError("bad value")
+    except ValueError:
+        logging.exception("failed")
+    stopQueueLogging()
+
+    logLines = logFilePath.read_text().splitlines()
+    assert argument.formattedOn not in (None, threading.current_thread().name)
+    assert logLines[0] == "value argument"
+    assert logLines[1:3] == [ "failed", "Traceback (most recent call last):" ]
+    assert logLines[-1] == "ValueError: bad value"
@@ -0,0 +1,29 @@
+import os
+import socket
+
+import pytest
+
+# TUNNEL is a MAVLink 2 message
+os.environ.setdefault("MAVLINK20", "1")
+pytest.importorskip("pymavlink")
+
+from TrackerBenchmark import *
+import AppGlobal
+
+def freePort():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as probe:
+        probe.bind(("localhost", 0))
+        return probe.getsockname()[1]
+
+def test_vehicles_stay_separate(monkeypatch, tmp_path):
+    # Three vehicles pulsing 3, 2 and 1 of the same tags: every vehicle's detectors and pulse store must match what
+    # its own simulator sent
+    monkeypatch.setattr(AppGlobal, "_stateListeners", [])
+    monkeypatch.setattr(AppGlobal, "_shutdownListeners", [])
+    monkeypatch.setattr(Settings, "tagCacheDirectory", str(tmp_path / "cache"))
+    benchmark = TrackerBenchmark(3, [ 10.0 ], 2.0, 0.0, 0.0, freePort(), vehicleCount = 3)
+    monkeypatch.setattr(AppGlobal, "app", HeadlessBenchmarkApp(benchmark))
+    benchmark.run()
+    assert len(benchmark.results) == 1
+    assert benchmark.vehicleErrors == []
+    assert [ len(simulator.pulsesSentByTag) for simulator in benchmark._simulators ] == [ 3, 2, 1 ]
@@ -0,0 +1,52 @@
+import ctypes
+
+import pytest
+
+from TunnelMessage import *
+from DecodeBenchmark import BenchmarkTunnelMessage
+
+def makeTunnelObject(tunnelStruct, command):
+    # Every field set to a distinct value so a misplaced or truncated field shows up in the comparison
+    tunnelObject = tunnelStruct()
+    for fieldIndex, field in enumerate(tunnelStruct._fields_):
+        fieldName, fieldType = field[0], field[1]
+        if fieldName == "hdr_command":
+            tunnelObject.hdr_command = command
+        elif issubclass(fieldType, ctypes.Array):
+            getattr(tunnelObject, fieldName)[:] = [ (fieldIndex + byteIndex) % 256 for byteIndex in range(fieldType._length_) ]
+        elif fieldType in (ctypes.c_double, ctypes.c_float):
+            setattr(tunnelObject, fieldName, fieldIndex + 0.5)
+        else:
+            setattr(tunnelObject, fieldName, fieldIndex + 1)
+    return tunnelObject
+
+@pytest.mark.parametrize("rawCommand", sorted(TunnelMessageHandler._decodeTable))
+def test_decode_round_trip(rawCommand):
+    command, tunnelStruct, _ = TunnelMessageHandler._decodeTable[rawCommand]
+    tunnelObject = makeTunnelObject(tunnelStruct, command)
+
+    decoded = TunnelMessageHandler.processMavlinkMessage(BenchmarkTunnelMessage(tunnelObject))
+
+    assert decoded is not None
+    assert decoded[0] is command
+    assert type(decoded[1]) is tunnelStruct
+    assert bytes(decoded[1]) == bytes(tunnelObject)
+
+def test_decode_rejects_wrong_size():
+    tunnelObject = makeTunnelObject(TunnelPulseInfo, TunnelCommand.COMMAND_ID_PULSE)
+    assert TunnelMessageHandler.decodePayload(bytearray(tunnelObject)[:-1]) is None
+    assert TunnelMessageHandler.decodePayload(bytearray(tunnelObject) + bytearray(1)) is None
+    assert TunnelMessageHandler.decodePayload(bytearray(2)) is None
+
+def test_decode_rejects_commands_not_in_table():
+    tunnelObject = makeTunnelObject(TunnelStartTags, TunnelCommand.COMMAND_ID_START_TAGS)
+    assert TunnelMessageHandler.decodePayload(bytearray(tunnelObject)) is None
+    unknownCommand = TunnelHeartbeat()
+    unknownCommand.hdr_command = 99
+    assert TunnelMessageHandler.decodePayload(bytearray(unknownCommand)) is None
+
+def test_decoded_object_shares_payload():
+    payloadBytes = bytearray(makeTunnelObject(TunnelAck, TunnelCommand.COMMAND_ID_ACK))
+    command, tunnelAck = TunnelMessageHandler.decodePayload(payloadBytes)
+    payloadBytes[4] = 0x7f
+    assert tunnelAck.command == 0x7f